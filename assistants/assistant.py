@@ -1,32 +1,82 @@
-from langchain_openai import ChatOpenAI
+from typing import Optional
 from pydantic import BaseModel
-from langchain_core.runnables import Runnable, RunnableConfig
+from langchain_core.runnables import RunnableConfig
 from state import State
+from helpers.session import get_session_context
+import helpers.context_window as context_window
+import helpers.llm_governor as llm_governor
+import helpers.model_registry as model_registry
+import time
+from datetime import datetime
 from dotenv import load_dotenv
 load_dotenv()
 
-llm = ChatOpenAI(model="gpt-4o", temperature=0)
+# Session and turn values go in a short message after the conversation: the system prompt and
+# the tool schemas before it are then the same for every call, and stay in the provider's prompt cache
+SESSION_CONTEXT = (
+    "system",
+    "Session context. Current time: {time}. Language: {language}. Currency: {currency}.",
+)
 
 class Assistant:
-    def __init__(self, runnable: Runnable):
+    def __init__(self, runnable: model_registry.NodeModels):
         self.runnable = runnable
 
-    def __call__(self, state: State, config: RunnableConfig):
-        while True:
-            result = self.runnable.invoke(state)
-
-            if not result.tool_calls and (
-                not result.content
-                or isinstance(result.content, list)
-                and not result.content[0].get("text")
-            ):
-                messages = state["messages"] + [("user", "Respond with a real output.")]
-                state = {**state, "messages": messages}
-                messages = state["messages"] + [("user", "Respond with a real output.")]
-                state = {**state, "messages": messages}
-            else:
-                break
-        return {"messages": result}
+    async def __call__(self, state: State, config: RunnableConfig):
+        # Language and currency belong to the session, not to the process
+        session = get_session_context(config)
+        messages, updates = await context_window.build_context(state)
+        state = {
+            **state,
+            "messages": messages,
+            "language": session.language,
+            "currency": session.currency,
+            "time": datetime.now().strftime("%Y-%m-%d %H:%M, %A"),
+        }
+        # The model of the task (routing, tool selection or final answer); a smaller model that
+        # fails or gives an unreliable answer is replaced by the escalation model. The smaller model
+        # gets a single attempt, the retry budget is kept for the escalation
+        started = time.perf_counter()
+        task, model = self.runnable.model_for(messages)
+        escalation = None
+        try:
+            result = await self._ainvoke(model, state, config, max_retries=0 if model != model_registry.ESCALATION_MODEL else None)
+            if model != model_registry.ESCALATION_MODEL:
+                escalation = self.runnable.escalation_reason(result)
+        except Exception as e:
+            if model == model_registry.ESCALATION_MODEL:
+                raise
+            print(f"Escalating {self.runnable.node} from {model}: {e!r}")
+            escalation = 'failure'
+        if escalation:
+            result = await self._ainvoke(model_registry.ESCALATION_MODEL, state, config)
+        model_registry.record_node(self.runnable.node, started, escalation)
+        return {"messages": result, **updates}
+
+    async def _ainvoke(self, model: str, state: dict, config: RunnableConfig, max_retries: Optional[int] = None):
+        # Timeout, bounded retries and hedging; an empty answer is asked again with a nudge
+        try:
+            result = await llm_governor.ainvoke(
+                self.runnable.runnable(model), state, config, is_empty=_is_empty, retry_input=_nudge, max_retries=max_retries
+            )
+        except Exception:
+            model_registry.record_call(self.runnable.node, model)
+            raise
+        model_registry.record_call(self.runnable.node, model, result)
+        context_window.record_usage(result)
+        return result
+
+
+def _is_empty(result) -> bool:
+    return not result.tool_calls and (
+        not result.content
+        or isinstance(result.content, list)
+        and not result.content[0].get("text")
+    )
+
+
+def _nudge(state: dict) -> dict:
+    return {**state, "messages": state["messages"] + [("user", "Respond with a real output.")]}
 
 
 class CompleteOrEscalate(BaseModel):
@@ -1,13 +1,10 @@
-from assistants.assistant import CompleteOrEscalate
+from assistants.assistant import CompleteOrEscalate, SESSION_CONTEXT
 from langchain_core.prompts import ChatPromptTemplate
-from datetime import datetime
-from langchain_openai import ChatOpenAI
+from helpers.model_registry import NodeModels
 from dotenv import load_dotenv
 import tools.excursion_tools as tools
 load_dotenv()
 
-llm = ChatOpenAI(model="gpt-4o", temperature=0)
-
 book_excursion_prompt = ChatPromptTemplate.from_messages(
     [
         (
@@ -23,6 +20,8 @@ book_excursion_prompt = ChatPromptTemplate.from_messages(
             "4. Any additional request. "
             "Use the 'get_availability_for_transfer_and_excursions' tool to search for available trip/excursions or transfer services. "
             "To get the town or city ID, use the 'get_town_id_for_transport_and_excursions' tool. Never ask it to the user. "
+            "If the user has no date yet and asks what to do or which services exist (e.g. 'what can I do near Puerto Varas?'), "
+            "use the 'recommend_excursions_and_transfers' tool; check the availability only once the user picks a date. "
             "Return to the user a maximum of 3 trip/excursions or transfer services options (unless the number of results is less). "
             "Choose the ones you consider the best results based on price-quality criteria. "
             "You can filter the trip/excursions or transfer services by category, stars, price, location/adress, Service type (Shared or Private), "
@@ -52,8 +51,7 @@ book_excursion_prompt = ChatPromptTemplate.from_messages(
             "When searching, be persistent. Expand your query bounds if the first search returns no results. "
             "If you need more information or the customer changes their mind, escalate the task back to the main assistant."
             " Remember that a booking isn't completed until after the relevant tool has successfully been used."
-            "\nCurrent time: {time}."
-            "If user doesn't provide a year, always assume is a future date. Never use past dates to search availability. "
+            " If user doesn't provide a year, always assume is a future date. Never use past dates to search availability. "
             '\n\nIf the user needs help, and none of your tools are appropriate for it, then "CompleteOrEscalate" the dialog to the host assistant. Do not waste the user\'s time. Do not make up invalid tools or functions.'
             "\n\nSome examples for which you should CompleteOrEscalate:\n"
             " - 'nevermind i think I'll book separately'\n"
@@ -62,12 +60,13 @@ book_excursion_prompt = ChatPromptTemplate.from_messages(
             " - 'Excursion booking confirmed!'",
         ),
         ("placeholder", "{messages}"),
+        SESSION_CONTEXT,
     ]
-).partial(time=datetime.now())
+)
 
-book_excursion_safe_tools = [tools.get_availability_for_transfer_and_excursions, tools.get_town_id_for_transport_and_excursions, tools.get_excursion_or_transfer_description, tools.get_excursion_or_transfer_options_avilable]
+book_excursion_safe_tools = [tools.get_availability_for_transfer_and_excursions, tools.recommend_excursions_and_transfers, tools.get_town_id_for_transport_and_excursions, tools.get_excursion_or_transfer_description, tools.get_excursion_or_transfer_options_avilable]
 book_excursion_sensitive_tools = [tools.create_transport_or_excursion_booking, tools.cancel_transport_or_excursion_booking]
 book_excursion_tools = book_excursion_safe_tools + book_excursion_sensitive_tools
-book_excursion_runnable = book_excursion_prompt | llm.bind_tools(
-    book_excursion_tools + [CompleteOrEscalate]
+book_excursion_runnable = NodeModels(
+    "book_excursion", book_excursion_prompt, book_excursion_tools + [CompleteOrEscalate], sensitive_tools=book_excursion_sensitive_tools
 )
\ No newline at end of file
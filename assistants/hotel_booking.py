@@ -1,15 +1,12 @@
 #mport __init__
-from assistants.assistant import CompleteOrEscalate
+from assistants.assistant import CompleteOrEscalate, SESSION_CONTEXT
 from langchain_core.prompts import ChatPromptTemplate
-from datetime import datetime
-from langchain_openai import ChatOpenAI
+from helpers.model_registry import NodeModels
 from dotenv import load_dotenv
 import tools.hotel_tools as tools
 import os
 load_dotenv()
 
-llm = ChatOpenAI(model="gpt-4o", temperature=0)
-
 book_hotel_prompt = ChatPromptTemplate.from_messages(
     [
         (
@@ -27,6 +24,8 @@ book_hotel_prompt = ChatPromptTemplate.from_messages(
             "\td) Any additional request.\n"
             "Use the 'get_availability_for_hotels' tool to search for available hotels. "
             "To get the town or city ID, use the 'get_town_id_for_hotels' tool. Never ask it to the user. "
+            "If the user is flexible with the dates (e.g. 'the cheapest weekend in March'), use the 'search_hotels_flexible_dates' tool once "
+            "instead of searching date by date. It also searches several rooms at once. "
             "Return to the user a maximum of 3 hotel options (unless the number of results is less). "
             "Choose the ones you consider the best results based on price-quality criteria. "
             "Consider, for these purposes, the ammenities, rating and price of the hotel.  "
@@ -69,10 +68,7 @@ book_hotel_prompt = ChatPromptTemplate.from_messages(
             "If you need more information or the customer changes their mind, escalate the task back to the main assistant. "
             "Remember that a booking isn't completed until after the relevant tool has successfully been used."
             "When you return an answer, use the python string format to make it more readable."
-            "\nCurrent time: {time}. "
-            "\nCurrency: {currency}. "
-            "\nLanguage: {language}. "
-            "If user doesn't provide a year, always assume is a future date. Never use past dates to search availability. "
+            " If user doesn't provide a year, always assume is a future date. Never use past dates to search availability. "
             '\n\nIf the user needs help, and none of your tools are appropriate for it, then "CompleteOrEscalate" the dialog to the host assistant.'
             " Do not waste the user's time. Do not make up invalid tools or functions."
             "\n\nSome examples for which you should CompleteOrEscalate:\n"
@@ -82,12 +78,13 @@ book_hotel_prompt = ChatPromptTemplate.from_messages(
             " - 'Hotel booking confirmed'",
         ),
         ("placeholder", "{messages}"),
+        SESSION_CONTEXT,
     ]
-).partial(time=datetime.now(), language=os.getenv("LANGUAGE"), currency=os.getenv("CURRENCY"))
+)
 
-book_hotel_safe_tools = [tools.get_availability_for_hotels, tools.get_town_id_for_hotels, tools.get_hotel_info, tools.get_hotel_rooms_available]
+book_hotel_safe_tools = [tools.get_availability_for_hotels, tools.search_hotels_flexible_dates, tools.get_town_id_for_hotels, tools.get_hotel_info, tools.get_hotel_rooms_available]
 book_hotel_sensitive_tools = [tools.create_hotel_booking, tools.update_hotel_booking, tools.cancel_hotel_booking]
 book_hotel_tools = book_hotel_safe_tools + book_hotel_sensitive_tools
-book_hotel_runnable = book_hotel_prompt | llm.bind_tools(
-    book_hotel_tools + [CompleteOrEscalate]
+book_hotel_runnable = NodeModels(
+    "book_hotel", book_hotel_prompt, book_hotel_tools + [CompleteOrEscalate], sensitive_tools=book_hotel_sensitive_tools
 )
\ No newline at end of file
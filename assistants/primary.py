@@ -1,14 +1,12 @@
 import os
-from datetime import datetime
 from pydantic import BaseModel, Field
 from langchain_core.prompts import ChatPromptTemplate
-from langchain_openai import ChatOpenAI
+from helpers.model_registry import NodeModels
+from assistants.assistant import SESSION_CONTEXT
 from langchain_community.tools.tavily_search import TavilySearchResults
 from dotenv import load_dotenv
 load_dotenv()
 
-llm = ChatOpenAI(model="gpt-4o", temperature=0)
-
 class ToHotelBookingAssistant(BaseModel):
     """Transfer work to a specialized assistant to handle hotel bookings."""
 
@@ -71,27 +69,31 @@ primary_assistant_prompt = ChatPromptTemplate.from_messages(
             "If the user needs to modify (update) or cancel a hotel reservation, you should delegate or escalate to assistant 1; "
             "the user needs to cancel an excursion or transfer reservation, you should delegate or escalate to assistant 2, just described. "
             "Is not possible to modify or update a excursion or transfer reservation. If the user ask you, you should inform that is not possible. "
-            "By default, you must give your answers in {language}. However, if the user writes to you in a different language, your answers should be in that language. "
+            "By default, you must give your answers in the language of the session context. However, if the user writes to you in a different language, your answers should be in that language. "
             "The user is not aware of the different specialized assistants, so do not mention them; just quietly delegate through function calls. "
             "Provide detailed information to the customer, and always double-check the database before concluding that information is unavailable. "
             "When searching, be persistent. Expand your query bounds if the first search returns no results. "
             "If a search comes up empty, expand your search before giving up. "
-            "When you return an answer, use the markdown format to make it more readable."
-            "\nCurrent time: {time}. "
-            "\nCurrency: {currency}. "
+            "When you return an answer, use the markdown format to make it more readable. "
             "If user doesn't provide a year, always assume is a future date. Never use past dates to search availability. ",
         ),
         ("placeholder", "{messages}"),
+        SESSION_CONTEXT,
     ]
-).partial(time=datetime.now(), language=os.getenv("LANGUAGE"), currency=os.getenv("CURRENCY"))
+)
 
 primary_assistant_tools = [
     #TavilySearchResults(max_results=1)
 ]
-assistant_runnable = primary_assistant_prompt | llm.bind_tools(
+# Choosing a specialist is a routing task, served by the small model (see helpers/model_registry.py)
+assistant_runnable = NodeModels(
+    "primary_assistant",
+    primary_assistant_prompt,
     primary_assistant_tools
     + [
         ToHotelBookingAssistant,
         ToBookExcursion,
-    ]
+    ],
+    exclusive_tools=(ToHotelBookingAssistant, ToBookExcursion),
+    routing=True,
 )
\ No newline at end of file
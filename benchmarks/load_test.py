@@ -0,0 +1,306 @@
+"""
+Offline load test of the /chat WebSocket.
+
+Starts the CTS API stand-in (benchmarks/mock_cts.py) and main.app with
+the scripted chat model (benchmarks/serve.py) in their own processes,
+then drives concurrent WebSocket clients through the hotel and excursion
+flows of benchmarks/scripted_llm.py and reports:
+
+- turns/sec and p50/p95/p99 turn latency (and time to the first frame)
+- CTS API and model calls per turn
+- server RSS over the run
+- semantic cache hits, with --semantic-cache (the excursion_faq flow asks a cacheable question)
+
+Examples:
+
+    python -m benchmarks.load_test --clients 1,10,50 --conversations 2
+    python -m benchmarks.load_test --clients 20 --save baseline.json
+    python -m benchmarks.load_test --clients 20 --baseline baseline.json
+    python -m benchmarks.load_test --clients 4 --flows excursion_faq --semantic-cache
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import date, timedelta
+from pathlib import Path
+import httpx
+import websockets
+from benchmarks.scripted_llm import FLOWS
+
+ROOT = Path(__file__).resolve().parent.parent
+TOWNS = ['Santiago', 'Pucón', 'Puerto Varas', 'Valparaíso', 'San Pedro de Atacama', 'Puerto Natales']
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def percentile(values: list, p: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    index = min(len(values) - 1, max(0, round(p / 100 * len(values) + 0.5) - 1))
+    return values[index]
+
+
+def spawn(module: str, port: int, env: dict, log_dir: str, *extra: str) -> subprocess.Popen:
+    log = open(os.path.join(log_dir, f'{module.rsplit(".", 1)[-1]}.log'), 'w')
+    return subprocess.Popen(
+        [sys.executable, '-m', module, '--port', str(port), *extra],
+        cwd=ROOT, env=env, stdout=log, stderr=subprocess.STDOUT,
+    )
+
+
+async def wait_ready(url: str, process: subprocess.Popen, timeout: float = 60):
+    deadline = time.monotonic() + timeout
+    async with httpx.AsyncClient() as client:
+        while time.monotonic() < deadline:
+            if process.poll() is not None:
+                raise RuntimeError(f'{url} exited with code {process.returncode}')
+            try:
+                if (await client.get(url)).status_code == 200:
+                    return
+            except httpx.TransportError:
+                pass
+            await asyncio.sleep(0.2)
+    raise TimeoutError(f'{url} did not start in {timeout} seconds')
+
+
+class Results:
+    def __init__(self):
+        self.latencies = []
+        self.first_frame = []
+        self.deltas = 0
+        self.errors = 0
+
+
+async def receive_turn(ws, results: Results, timeout: float) -> str:
+    """Read frames until the end of a turn and return the type of the last one."""
+    started = time.perf_counter()
+    first = None
+    while True:
+        frame = await asyncio.wait_for(ws.recv(), timeout)
+        if first is None:
+            first = time.perf_counter() - started
+        try:
+            data = json.loads(frame)
+        except ValueError:
+            # Errors are sent as plain text
+            results.errors += 1
+            kind = 'error'
+            break
+        kind = data.get('type')
+        if kind == 'delta':
+            results.deltas += 1
+            continue
+        if kind in ('text', 'approval_needed'):
+            break
+    results.latencies.append(time.perf_counter() - started)
+    results.first_frame.append(first)
+    return kind
+
+
+async def conversation(url: str, flow: str, results: Results, timeout: float, language: str):
+    checkin = date.today() + timedelta(days=random.randint(10, 90))
+    values = {
+        'town': random.choice(TOWNS),
+        'checkin': checkin.isoformat(),
+        'checkout': (checkin + timedelta(days=random.randint(1, 5))).isoformat(),
+        'adults': random.randint(1, 4),
+    }
+    async with websockets.connect(url, max_size=None) as ws:
+        for template in FLOWS[flow]:
+            message = {'message': template.format(**values), 'currency': 'CLP', 'language': language, 'token': 'bench-token'}
+            await ws.send(json.dumps(message))
+            try:
+                kind = await receive_turn(ws, results, timeout)
+                while kind == 'approval_needed':
+                    await ws.send(json.dumps({'message': 'si' if language == 'Spanish' else 'yes'}))
+                    kind = await receive_turn(ws, results, timeout)
+            except asyncio.TimeoutError:
+                results.errors += 1
+                return
+
+
+async def client(url: str, conversations: int, flows: list, results: Results, timeout: float, language: str):
+    for i in range(conversations):
+        try:
+            await conversation(url, flows[i % len(flows)], results, timeout, language)
+        except (OSError, websockets.WebSocketException) as e:
+            print(f'Connection error: {e}')
+            results.errors += 1
+
+
+async def sample_rss(url: str, samples: list, stop: asyncio.Event, interval: float):
+    async with httpx.AsyncClient() as http:
+        while not stop.is_set():
+            try:
+                samples.append((await http.get(url)).json()['rss_bytes'])
+            except (httpx.HTTPError, ValueError, KeyError):
+                pass
+            try:
+                await asyncio.wait_for(stop.wait(), interval)
+            except asyncio.TimeoutError:
+                pass
+
+
+async def run_level(args, clients: int, server: str, cts: str) -> dict:
+    async with httpx.AsyncClient() as http:
+        await http.post(f'{cts}/__reset')
+        llmBefore = (await http.get(f'{server}/__bench')).json()['llm']
+    results = Results()
+    rss = []
+    stop = asyncio.Event()
+    sampler = asyncio.create_task(sample_rss(f'{server}/__bench', rss, stop, args.rss_interval))
+    flows = args.flows.split(',')
+    wsUrl = server.replace('http://', 'ws://') + '/chat'
+    started = time.perf_counter()
+    await asyncio.gather(*[
+        client(wsUrl, args.conversations, flows[i % len(flows):] + flows[:i % len(flows)], results, args.turn_timeout, args.language)
+        for i in range(clients)
+    ])
+    elapsed = time.perf_counter() - started
+    stop.set()
+    await sampler
+    async with httpx.AsyncClient() as http:
+        upstream = (await http.get(f'{cts}/__stats')).json()
+        bench = (await http.get(f'{server}/__bench')).json()
+        metrics = (await http.get(f'{server}/metrics')).json()
+    turns = len(results.latencies)
+    llmCalls = bench['llm']['calls'] - llmBefore['calls']
+    return {
+        'clients': clients,
+        'turns': turns,
+        'errors': results.errors,
+        'elapsed_s': round(elapsed, 2),
+        'turns_per_s': round(turns / elapsed, 2) if elapsed else 0,
+        'latency_ms': {f'p{p}': round(percentile(results.latencies, p) * 1000, 1) for p in (50, 95, 99)},
+        'first_frame_ms': {f'p{p}': round(percentile(results.first_frame, p) * 1000, 1) for p in (50, 95, 99)},
+        'delta_frames': results.deltas,
+        'upstream_calls': upstream['total'],
+        'upstream_calls_per_turn': round(upstream['total'] / turns, 2) if turns else 0,
+        'upstream_by_route': upstream['calls'],
+        'llm_calls_per_turn': round(llmCalls / turns, 2) if turns else 0,
+        'rss_mb': {
+            'start': round(rss[0] / 2 ** 20, 1) if rss else None,
+            'max': round(max(rss) / 2 ** 20, 1) if rss else None,
+            'end': round(rss[-1] / 2 ** 20, 1) if rss else None,
+            'samples': [round(value / 2 ** 20, 1) for value in rss],
+        },
+        'server_metrics': metrics,
+    }
+
+
+def print_report(levels: list, baseline: dict = None):
+    previous = {level['clients']: level for level in (baseline or {}).get('levels', [])}
+    header = f"{'clients':>7} {'turns':>6} {'err':>4} {'turns/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'1st p50':>8} {'cts/turn':>9} {'llm/turn':>9} {'rss max':>8}"
+    print(header)
+    print('-' * len(header))
+    for level in levels:
+        print(
+            f"{level['clients']:>7} {level['turns']:>6} {level['errors']:>4} {level['turns_per_s']:>8} "
+            f"{level['latency_ms']['p50']:>8} {level['latency_ms']['p95']:>8} {level['latency_ms']['p99']:>8} "
+            f"{level['first_frame_ms']['p50']:>8} {level['upstream_calls_per_turn']:>9} {level['llm_calls_per_turn']:>9} "
+            f"{level['rss_mb']['max']:>8}"
+        )
+        semantic = level['server_metrics']['semantic_cache']
+        if semantic['lookups']:
+            print(f"{'':>7} semantic cache: {semantic['hits']}/{semantic['lookups']} hits ({semantic['hit_rate']:.0%}), {semantic['stored']} stored")
+        before = previous.get(level['clients'])
+        if before:
+            def change(now, then):
+                return f'{(now - then) / then * 100:+.1f}%' if then else 'n/a'
+            print(
+                f"{'vs base':>7} {'':>6} {'':>4} {change(level['turns_per_s'], before['turns_per_s']):>8} "
+                f"{change(level['latency_ms']['p50'], before['latency_ms']['p50']):>8} "
+                f"{change(level['latency_ms']['p95'], before['latency_ms']['p95']):>8} "
+                f"{change(level['latency_ms']['p99'], before['latency_ms']['p99']):>8} "
+                f"{change(level['first_frame_ms']['p50'], before['first_frame_ms']['p50']):>8} "
+                f"{change(level['upstream_calls_per_turn'], before['upstream_calls_per_turn']):>9} "
+                f"{change(level['llm_calls_per_turn'], before['llm_calls_per_turn']):>9} "
+                f"{change(level['rss_mb']['max'] or 0, before['rss_mb']['max'] or 0):>8}"
+            )
+
+
+async def main(args):
+    random.seed(args.seed)
+    logDir = tempfile.mkdtemp(prefix='travel-assistant-load-')
+    ctsPort, serverPort = args.cts_port or free_port(), args.port or free_port()
+    cts, server = f'http://127.0.0.1:{ctsPort}', f'http://127.0.0.1:{serverPort}'
+    env = {
+        **os.environ,
+        'PYTHONPATH': str(ROOT),
+        'CTS_API_V1': f'{cts}/api',
+        'CTS_API_V2': f'{cts}/api-v2',
+        'CTS_DTT_CITY_URL': f'{cts}/api/city/dtt/?q=',
+        'SCRIPTED_LLM_LATENCY_MS': str(args.llm_latency_ms),
+        'SCRIPTED_LLM_SMALL_LATENCY_MS': str(args.llm_small_latency_ms),
+        'SCRIPTED_LLM_TOKEN_DELAY_MS': str(args.llm_token_delay_ms),
+        'SEMANTIC_CACHE_ENABLED': str(args.semantic_cache),
+    }
+    processes = [
+        spawn('benchmarks.mock_cts', ctsPort, env, logDir,
+              '--latency-ms', str(args.cts_latency_ms), '--hotels', str(args.hotels),
+              '--services', str(args.services), '--towns', str(args.towns)),
+        spawn('benchmarks.serve', serverPort, env, logDir),
+    ]
+    try:
+        await wait_ready(f'{cts}/__stats', processes[0])
+        await wait_ready(f'{server}/metrics', processes[1])
+        levels = []
+        for clients in [int(value) for value in args.clients.split(',')]:
+            print(f'Running {clients} clients x {args.conversations} conversations...')
+            levels.append(await run_level(args, clients, server, cts))
+    finally:
+        for process in processes:
+            process.terminate()
+        for process in processes:
+            process.wait(timeout=10)
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+    print_report(levels, baseline)
+    print(f'Server and CTS stand-in logs: {logDir}')
+    report = {'args': vars(args), 'levels': levels}
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f'Saved results to {args.save}')
+    if args.json:
+        print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Offline load test of the /chat WebSocket")
+    parser.add_argument("--clients", default="10", help="Comma separated concurrency levels, e.g. 1,10,50")
+    parser.add_argument("--conversations", type=int, default=2, help="Conversations per client")
+    parser.add_argument("--flows", default="hotel,excursion", help=f"Comma separated flows: {', '.join(FLOWS)}")
+    parser.add_argument("--language", default="English")
+    parser.add_argument("--cts-latency-ms", type=float, default=80)
+    parser.add_argument("--llm-latency-ms", type=float, default=300, help="Scripted model time to first token")
+    parser.add_argument("--llm-small-latency-ms", type=float, default=120, help="Time to first token of the small (mini) models")
+    parser.add_argument("--llm-token-delay-ms", type=float, default=15)
+    parser.add_argument("--hotels", type=int, default=20, help="Hotels per CTS search")
+    parser.add_argument("--services", type=int, default=15, help="Excursions per CTS availability")
+    parser.add_argument("--towns", type=int, default=2000, help="Towns in the CTS city catalogs")
+    parser.add_argument("--semantic-cache", action="store_true", help="Enable the semantic cache, with scripted embeddings")
+    parser.add_argument("--turn-timeout", type=float, default=120)
+    parser.add_argument("--rss-interval", type=float, default=0.5)
+    parser.add_argument("--port", type=int, default=0)
+    parser.add_argument("--cts-port", type=int, default=0)
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--save", help="Write the results to this JSON file")
+    parser.add_argument("--baseline", help="Compare against results saved with --save")
+    parser.add_argument("--json", action="store_true", help="Also print the full results as JSON")
+    asyncio.run(main(parser.parse_args()))
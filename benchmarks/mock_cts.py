@@ -0,0 +1,278 @@
+"""
+Local stand-in for the CTS booking API, used by the load test.
+
+It serves the CTS_API_V1 / CTS_API_V2 endpoints the tools call with
+generated (deterministic) payloads, after a configurable latency, and
+counts every call so the load test can report upstream calls per turn.
+
+Run it on its own with:
+
+    python -m benchmarks.mock_cts --port 8200 --latency-ms 80 --hotels 20
+"""
+import argparse
+import asyncio
+import os
+import random
+from collections import Counter
+from datetime import date, timedelta
+from functools import lru_cache
+from fastapi import FastAPI, Request
+
+KNOWN_TOWNS = [
+    'Santiago', 'Pucón', 'Puerto Varas', 'Valparaíso', 'Viña del Mar', 'San Pedro de Atacama',
+    'Puerto Natales', 'La Serena', 'Punta Arenas', 'Arica', 'Iquique', 'Valdivia',
+]
+
+settings = {
+    'latency_ms': float(os.getenv("MOCK_CTS_LATENCY_MS", 80)),
+    'jitter_ms': float(os.getenv("MOCK_CTS_JITTER_MS", 20)),
+    'towns': int(os.getenv("MOCK_CTS_TOWNS", 2000)),
+    'hotels': int(os.getenv("MOCK_CTS_HOTELS", 20)),
+    'rooms': int(os.getenv("MOCK_CTS_ROOMS", 6)),
+    'services': int(os.getenv("MOCK_CTS_SERVICES", 15)),
+    'bookings': int(os.getenv("MOCK_CTS_BOOKINGS", 500)),
+    'page_size': int(os.getenv("MOCK_CTS_PAGE_SIZE", 50)),
+}
+
+app = FastAPI()
+calls = Counter()
+
+
+@app.middleware("http")
+async def count_and_delay(request: Request, call_next):
+    if not request.url.path.startswith('/__'):
+        delay = settings['latency_ms'] + random.uniform(-1, 1) * settings['jitter_ms']
+        await asyncio.sleep(max(delay, 0) / 1000)
+    response = await call_next(request)
+    route = request.scope.get('route')
+    if route is not None and not request.url.path.startswith('/__'):
+        calls[f'{request.method} {route.path}'] += 1
+    return response
+
+
+@lru_cache(maxsize=4)
+def _catalog(count: int) -> tuple:
+    return tuple(KNOWN_TOWNS) + tuple(f'Town {i:04d}' for i in range(len(KNOWN_TOWNS), count))
+
+
+def _town_names() -> tuple:
+    return _catalog(settings['towns'])
+
+
+def _amenities(seed: int) -> list:
+    amenities = ['Wifi', 'Pool', 'Spa', 'Parking', 'Breakfast', 'Gym', 'Bar', 'Restaurant', 'Pet friendly', 'Air conditioning']
+    return [{'name': name} for i, name in enumerate(amenities) if (seed + i) % 3 != 0]
+
+
+def _dates(checkin: str, checkout: str) -> list:
+    try:
+        start = date.fromisoformat(checkin)
+        nights = max((date.fromisoformat(checkout) - start).days, 1)
+    except (TypeError, ValueError):
+        start, nights = date.today(), 1
+    return [(start + timedelta(days=i)).isoformat() for i in range(nights)]
+
+
+def _room(hotelId: int, i: int) -> dict:
+    return {
+        'roomtype_id': hotelId * 100 + i,
+        'roomtype': f'Room type {i + 1}',
+        'rateplan_name': 'Flexible rate' if i % 2 == 0 else 'Non refundable',
+        'cancellation_type': 'Free cancellation' if i % 2 == 0 else 'Non refundable',
+        'mealplan': 'Breakfast included' if i % 3 == 0 else 'Room only',
+        'adults': 2,
+        'bed_options': 'King' if i % 2 == 0 else 'Twin',
+        'size': f'{20 + i * 5} m2',
+        'details': [{'inventory_id': hotelId * 1000 + i, 'rate_id': hotelId * 10 + i}],
+    }
+
+
+def _availability(hotelId: int, currency: int, checkin: str, checkout: str) -> list:
+    dates = _dates(checkin, checkout)
+    result = []
+    for i in range(settings['rooms']):
+        price = 50000 + (hotelId % 17) * 5000 + i * 7500 if currency == 1 else 60 + (hotelId % 17) * 6 + i * 9
+        # Stays starting on Friday or Saturday cost a fifth more, so flexible-date searches have something to find
+        if date.fromisoformat(checkin).weekday() in (4, 5):
+            price = round(price * 1.2)
+        result.append({
+            'currency_id': currency,
+            'price_base': price * 0.8,
+            'price_value': price * 0.84,
+            'price_value_with_tax': price,
+            'additional_base': 0,
+            'additional_total_base': 0,
+            'additional_value_with_tax': 0,
+            'markup': [12],
+            'details': [
+                {
+                    'date': day, 'total': price / len(dates), 'total_base': price * 0.8 / len(dates),
+                    'total_with_tax': price / len(dates), 'additional_base': 0, 'additional_total_base': 0,
+                    'additional_total_with_tax': 0, 'rooms': 1,
+                } for day in dates
+            ],
+            'rooms': [_room(hotelId, i)],
+        })
+    return result
+
+
+def _hotel(hotelId: int, townId: int, currency: int, checkin: str, checkout: str) -> dict:
+    return {
+        'id': hotelId,
+        'name': f'Hotel {hotelId}',
+        'town_id': townId,
+        'town': {'name': _town_names()[townId % len(_town_names())]},
+        'address': f'Avenida Principal {hotelId}',
+        'category': {'name': 'Hotel', 'rating': 3 + hotelId % 3},
+        'policies_description': 'Check-in desde las 15:00. ' * 4,
+        'policies_description_en': 'Check-in from 15:00. ' * 4,
+        'ammenities': _amenities(hotelId),
+        'availability': _availability(hotelId, currency, checkin, checkout),
+        'cancellation': 48,
+        'images': [{'url': f'https://example.com/hotels/{hotelId}.jpg', 'is_primary': True}],
+        'checkin': '15:00',
+        'checkout': '12:00',
+        'phone': '+56 2 2345 6789',
+    }
+
+
+def _service(serviceId: int, townId: int, tipos: int, fecha: str, adults: int, children: int, currency: int) -> dict:
+    city = _town_names()[townId % len(_town_names())]
+    kind = 'Excursion' if tipos == 2 else 'Transfer'
+    return {
+        'id': serviceId,
+        'city': city,
+        'glosas': {'g_text_es': f'{kind} {serviceId} en {city}', 'g_text_en': f'{kind} {serviceId} in {city}'},
+        'descriptions': {'d_text_es': 'Recorrido guiado por los principales atractivos. ' * 3, 'd_text_en': 'Guided tour of the main sights. ' * 3},
+        'concepts': ['Transport', 'Guide', 'Entrance fees'],
+        'services': [
+            {
+                'service_code': serviceId * 10 + i,
+                'sale_price': 35000 + i * 5000 if currency == 1 else 40 + i * 6,
+                'currency': 'CLP' if currency == 1 else 'USD',
+                'service_duration': f'{4 + i} hours',
+                'meeting_point': 'Hotel lobby',
+                'city': city,
+                'allow_childs': True,
+                'is_regular': i % 2 == 0,
+                'cancellation_date': fecha,
+                'travel_date': fecha,
+                'language': ['Español', 'Inglés'],
+                'guide': 'Bilingual',
+                'adults': adults,
+                'children': children,
+            } for i in range(3)
+        ],
+    }
+
+
+@app.get("/api/city/dtt/")
+async def dtt_cities():
+    return [{'dtt_id': i, 'display_name': name} for i, name in enumerate(_town_names())]
+
+
+@app.get("/api-v2/city/")
+async def cities():
+    return [{'id': i, 'name': name} for i, name in enumerate(_town_names())]
+
+
+@app.post("/api/hotel/")
+async def search_hotels(request: Request):
+    body = await request.json()
+    townId = int(body.get('townId') or 0)
+    return {'data': [
+        _hotel(townId * 1000 + i, townId, body.get('currency', 2), body.get('checkin'), body.get('checkout'))
+        for i in range(settings['hotels'])
+    ]}
+
+
+@app.post("/api/hotel/{hotelId}/")
+async def hotel_detail(hotelId: int, request: Request):
+    body = await request.json()
+    townId = int(body.get('townId') or hotelId // 1000)
+    return {'data': _hotel(hotelId, townId, body.get('currency', 2), body.get('checkin'), body.get('checkout'))}
+
+
+@app.get("/api/booking/")
+async def list_bookings(request: Request, page: int = 1):
+    wanted = request.query_params.get(os.getenv("CTS_BOOKING_LOOKUP_PARAM", "search"))
+    bookings = [
+        {'file_number': str(100000 + i), 'slug': f'booking-{100000 + i}', 'items': [{'id': 500000 + i}]}
+        for i in range(settings['bookings'])
+    ]
+    if wanted:
+        return {'results': [booking for booking in bookings if booking['file_number'] == wanted], 'next': None}
+    size = settings['page_size']
+    start = (page - 1) * size
+    nextUrl = None
+    if start + size < len(bookings):
+        nextUrl = str(request.url.include_query_params(page=page + 1))
+    return {'results': bookings[start:start + size], 'next': nextUrl}
+
+
+@app.post("/api/booking/")
+async def create_booking():
+    fileNumber = 100000 + settings['bookings'] + random.randint(0, 99999)
+    return {'file_number': fileNumber, 'slug': f'booking-{fileNumber}'}
+
+
+@app.put("/api/booking/{slug}/")
+async def update_booking(slug: str):
+    return {'file_number': slug.rsplit('-', 1)[-1], 'slug': slug}
+
+
+@app.put("/api/booking/item/{itemId}/")
+async def update_booking_item(itemId: int):
+    return {'file_number': str(itemId - 400000)}
+
+
+@app.post("/api/booking/cancel/")
+async def cancel_booking(request: Request):
+    body = await request.json()
+    return {'slug': f'booking-{body.get("file_number")}'}
+
+
+@app.get("/api-v2/availability/")
+async def availability(townId: int, tipos: int, fecha: str, adults: int = 1, children: int = 0, currency: int = 2):
+    return [
+        _service(townId * 100 + tipos * 50 + i, townId, tipos, fecha, adults, children, currency)
+        for i in range(settings['services'])
+    ]
+
+
+@app.post("/api-v2/booking/")
+async def create_service_booking():
+    return {'booking_id': random.randint(200000, 299999)}
+
+
+@app.delete("/api-v2/booking/{bookingId}/")
+async def cancel_service_booking(bookingId: str):
+    return {'is_active': False}
+
+
+@app.get("/__stats")
+async def stats():
+    return {'total': sum(calls.values()), 'calls': dict(calls)}
+
+
+@app.post("/__reset")
+async def reset():
+    calls.clear()
+    return {'total': 0}
+
+
+if __name__ == "__main__":
+    import uvicorn
+    parser = argparse.ArgumentParser(description="Local stand-in for the CTS API")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8200)
+    parser.add_argument("--latency-ms", type=float, default=settings['latency_ms'])
+    parser.add_argument("--jitter-ms", type=float, default=settings['jitter_ms'])
+    parser.add_argument("--towns", type=int, default=settings['towns'])
+    parser.add_argument("--hotels", type=int, default=settings['hotels'])
+    parser.add_argument("--rooms", type=int, default=settings['rooms'])
+    parser.add_argument("--services", type=int, default=settings['services'])
+    parser.add_argument("--bookings", type=int, default=settings['bookings'])
+    args = parser.parse_args()
+    settings.update({key: getattr(args, key) for key in settings if hasattr(args, key)})
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
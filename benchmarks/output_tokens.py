@@ -0,0 +1,73 @@
+"""
+Tokens sent back to the model by the listing tools, prose vs compact output.
+
+Renders the hotel and excursion availability of the CTS stand-in for
+towns of growing size with both output formats and counts the tokens
+(with tiktoken when its encoding is available, otherwise estimated at
+four characters per token):
+
+    python -m benchmarks.output_tokens --sizes 20,100,200
+"""
+import argparse
+import os
+from benchmarks import mock_cts
+import helpers.compact_output as compact_output
+import helpers.excursion_helper as excursion_helper
+import helpers.hotel_helper as hotel_helper
+
+
+def token_counter():
+    try:
+        import tiktoken
+        encoding = tiktoken.get_encoding('o200k_base')
+        return 'tiktoken o200k_base', lambda text: len(encoding.encode(text))
+    except Exception:
+        return 'estimate (4 chars/token)', lambda text: len(text) // 4
+
+
+def hotel_outputs(size: int) -> dict:
+    mock_cts.settings['hotels'] = size
+    payload = {'townId': 1, 'checkin': '2026-12-01', 'checkout': '2026-12-03', 'rooms': [{'adults': 2, 'children': 0, 'infants': 0, 'ages': []}], 'currency': 1}
+    hotels = [mock_cts._hotel(1000 + i, 1, 1, payload['checkin'], payload['checkout']) for i in range(size)]
+    page, offset, total = compact_output.page(hotels)
+    return {
+        'prose, all results': hotel_helper.generate_hotels_availability_response({'data': hotels}, payload),
+        'compact, all results': hotel_helper.generate_hotels_availability_table({'data': hotels}, payload),
+        'compact, first page': hotel_helper.generate_hotels_availability_table({'data': page}, payload, offset=offset, total=total),
+        'compact, first page, 3 fields': hotel_helper.generate_hotels_availability_table({'data': page}, payload, fields=['name', 'price_from'], offset=offset, total=total),
+    }
+
+
+def excursion_outputs(size: int) -> dict:
+    services = [mock_cts._service(100 + i, 1, 2, '2026-12-01', 2, 0, 1) for i in range(size)]
+    page, offset, total = compact_output.page(services)
+    args = ('2026-12-01', 2, 0, 1)
+    return {
+        'prose, all results': excursion_helper.generate_excursion_availability_response(services, *args),
+        'compact, all results': excursion_helper.generate_excursion_availability_table(services, *args, language='English'),
+        'compact, first page': excursion_helper.generate_excursion_availability_table(page, *args, language='English', offset=offset, total=total),
+        'compact, first page, 3 fields': excursion_helper.generate_excursion_availability_table(page, *args, language='English', fields=['name', 'price_from'], offset=offset, total=total),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Tokens of the listing tools output, prose vs compact")
+    parser.add_argument("--sizes", default="20,100,200", help="Comma separated numbers of results per town")
+    args = parser.parse_args()
+    os.environ.setdefault("FRONT_HOST", "http://localhost:5173")
+    counter, count = token_counter()
+    print(f'Token counter: {counter}')
+    for name, outputs in (('hotels', hotel_outputs), ('excursions', excursion_outputs)):
+        print(f'\n{name}')
+        print(f"{'results':>8} {'format':<30} {'tokens':>8} {'per result':>11} {'vs prose':>9}")
+        for size in [int(value) for value in args.sizes.split(',')]:
+            rendered = outputs(size)
+            prose = count(rendered['prose, all results'])
+            for label, text in rendered.items():
+                tokens = count(text)
+                shown = size if 'all' in label else min(size, compact_output.MAX_RESULTS)
+                print(f"{size:>8} {label:<30} {tokens:>8} {tokens / shown:>11.1f} {(tokens - prose) / prose * 100:>+8.1f}%")
+
+
+if __name__ == "__main__":
+    main()
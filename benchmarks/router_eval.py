@@ -0,0 +1,121 @@
+"""
+Accuracy and latency of the intent router on a labelled test set.
+
+Every request of TEST_SET is classified as the graph would. A request is
+either routed straight to an assistant (keyword or embedding stage) or
+sent to the primary assistant LLM (fallback). The report shows how often
+routing happens, how often a routed request went to the right assistant,
+and the primary assistant time saved per message at --llm-ms per LLM call:
+
+    python -m benchmarks.router_eval                  # keywords and embeddings (needs OPENAI_API_KEY)
+    python -m benchmarks.router_eval --no-embeddings  # keywords only, offline
+"""
+import argparse
+import asyncio
+import os
+import time
+from collections import Counter
+
+HOTEL, EXCURSION, OTHER = 'hotel', 'excursion', 'other'
+
+# Not in intent_router.EXAMPLES; 'other' means only the LLM can tell (or it is not a booking request)
+TEST_SET = [
+    ('quiero un hotel en Pucón para el fin de semana', HOTEL),
+    ('hotel en la Serena del 10 al 12 de enero para 2 adultos', HOTEL),
+    ('Necesito una habitación para tres personas en Valdivia', HOTEL),
+    ('busco hostal barato en Valparaíso', HOTEL),
+    ('¿Tienen cabañas en Puerto Varas?', HOTEL),
+    ('I need a hotel in Santiago from December 1 to December 3', HOTEL),
+    ('any rooms left in Punta Arenas for next Friday?', HOTEL),
+    ('find me accommodation near the beach in Viña del Mar', HOTEL),
+    ('where can I sleep in Puerto Natales for 2 nights', HOTEL),
+    ('preciso de um quarto em Santiago para dois adultos', HOTEL),
+    ('quero reservar uma pousada em Pucón', HOTEL),
+    ('cancel booking 12345', HOTEL),
+    ('please cancel my reservation 99812', HOTEL),
+    ('anular la reserva 45120', HOTEL),
+    ('update booking 77001 with a late check-in note', HOTEL),
+    ('what time is check-in at the hotel?', HOTEL),
+    ('tell me more about the first hotel', HOTEL),
+    ('which rooms are available there?', HOTEL),
+    ('quiero alojarme en Frutillar', HOTEL),
+    ('donde me quedo en Chiloé', HOTEL),
+    ('quiero un tour por el desierto de Atacama', EXCURSION),
+    ('¿qué excursiones hay en Puerto Natales?', EXCURSION),
+    ('necesito traslado del aeropuerto de Santiago al centro', EXCURSION),
+    ('transfer from the airport to my hotel in Santiago', EXCURSION),
+    ('book a city tour in Valparaíso for 4 adults', EXCURSION),
+    ('what activities can we do with kids in Pucón?', EXCURSION),
+    ('I want to go trekking in Torres del Paine', EXCURSION),
+    ('quiero ir al Valle de la Luna el martes', EXCURSION),
+    ('un paseo en barco por el lago Todos los Santos', EXCURSION),
+    ('quero um passeio para Isla Negra', EXCURSION),
+    ('quais excursões existem em San Pedro?', EXCURSION),
+    ('is there a shuttle from Calama to San Pedro de Atacama?', EXCURSION),
+    ('tell me more about the first excursion', EXCURSION),
+    ('what options does it have?', OTHER),
+    ('cancel my tour booking 5531', EXCURSION),
+    ('hola, buenas tardes', OTHER),
+    ('thank you!', OTHER),
+    ('what can you help me with?', OTHER),
+    ('¿en qué moneda están los precios?', OTHER),
+    ('what is the weather like in Patagonia in winter?', OTHER),
+    ('I am planning a trip to Chile, any ideas?', OTHER),
+    ('quiero viajar a Chile en marzo', OTHER),
+    ('necesito ayuda', OTHER),
+    ('hotel and a tour in San Pedro please', OTHER),
+    ('sí, confirmo', OTHER),
+]
+
+
+async def evaluate(router, llm_ms: float) -> dict:
+    confusion = Counter()
+    stages = Counter()
+    elapsed = []
+    for text, expected in TEST_SET:
+        start = time.perf_counter()
+        intent, decided_by = await router.classify(text)
+        elapsed.append((time.perf_counter() - start) * 1000)
+        stages[decided_by] += 1
+        confusion[(expected, intent if decided_by != 'fallback' else 'llm')] += 1
+    routed = sum(count for (expected, got), count in confusion.items() if got != 'llm')
+    correct = sum(count for (expected, got), count in confusion.items() if got == expected)
+    elapsed.sort()
+    return {
+        'messages': len(TEST_SET),
+        'routed': routed,
+        'routed_rate': routed / len(TEST_SET),
+        'routed_accuracy': correct / routed if routed else 0.0,
+        'misrouted': routed - correct,
+        'stages': dict(stages),
+        'confusion': confusion,
+        'router_ms': {'p50': elapsed[len(elapsed) // 2], 'max': elapsed[-1]},
+        # Each routed message skips one primary assistant call; every message pays the router time
+        'saved_ms_per_message': routed / len(TEST_SET) * llm_ms - sum(elapsed) / len(elapsed),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Accuracy and latency of the intent router")
+    parser.add_argument("--no-embeddings", action="store_true", help="Keyword stage only (no OpenAI call)")
+    parser.add_argument("--llm-ms", type=float, default=1200, help="Latency of one primary assistant LLM call")
+    args = parser.parse_args()
+    if args.no_embeddings:
+        os.environ["ROUTER_EMBEDDINGS"] = "False"
+    import helpers.intent_router as router
+
+    result = asyncio.run(evaluate(router, args.llm_ms))
+    print(f"Embeddings: {'on' if router.embeddings is not None else 'off'}")
+    print(f"Messages: {result['messages']}, routed without the LLM: {result['routed']} ({result['routed_rate']:.0%})")
+    print(f"Routed accuracy: {result['routed_accuracy']:.1%} ({result['misrouted']} misrouted)")
+    print(f"Decided by: {result['stages']}")
+    print(f"Router time: p50 {result['router_ms']['p50']:.2f} ms, max {result['router_ms']['max']:.2f} ms")
+    print(f"Primary assistant time saved per message at {args.llm_ms:.0f} ms per call: {result['saved_ms_per_message']:.0f} ms")
+    print(f"\n{'expected':<10} {'hotel':>6} {'excursion':>10} {'llm':>5}")
+    for expected in (HOTEL, EXCURSION, OTHER):
+        row = [result['confusion'][(expected, got)] for got in (HOTEL, EXCURSION, 'llm')]
+        print(f"{expected:<10} {row[0]:>6} {row[1]:>10} {row[2]:>5}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,300 @@
+"""
+Deterministic stand-in for ChatOpenAI, used by the load test.
+
+ScriptedChatModel plays the role of every assistant of the graph: it
+recognizes which assistant is calling it from the tools bound to it, and
+answers the scripted user messages of FLOWS with the same tool calls a
+real model makes in a hotel or excursion conversation. Ids (towns,
+hotels, rooms, services) are read back from earlier tool results, so the
+tools run against the mock CTS API exactly as in production.
+
+ScriptedEmbeddings stands in for OpenAIEmbeddings, so the semantic cache
+can run offline: the same question always gets the same vector.
+"""
+import asyncio
+import hashlib
+import json
+import os
+import re
+import time
+import uuid
+from typing import Any, AsyncIterator, Iterator, List, Optional
+from langchain_core.embeddings import Embeddings
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk, BaseMessage, HumanMessage, SystemMessage
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+from langchain_core.utils.function_calling import convert_to_openai_tool
+from pydantic import BaseModel
+
+# User turns of each flow; the load test answers the approval of the booking step
+FLOWS = {
+    'hotel': [
+        'hotel search: I need a hotel in {town} from {checkin} to {checkout} for {adults} adults',
+        'hotel info: tell me more about the first hotel',
+        'hotel rooms: which rooms are available there?',
+        'hotel book: book the first room for John Doe, john@example.com, +56911111111, passport 123456, Chile',
+    ],
+    'excursion': [
+        'excursion search: I want an excursion in {town} on {checkin} for {adults} adults',
+        'excursion describe: tell me more about the first excursion',
+        'excursion options: what options does it have?',
+        'excursion book: book the first option in Inglés for John Doe, john@example.com, +56911111111, passport 123456, Chile',
+    ],
+    # A self-contained catalog question that every conversation asks, answered from the semantic cache after the first
+    'excursion_faq': [
+        'excursion search: I want an excursion in {town} on {checkin} for {adults} adults',
+        'excursion describe: what does the full day lakes and volcanoes tour include?',
+    ],
+}
+
+# Tool calls of each step of a turn; the final text answer comes after the last one
+HOTEL_PLANS = {
+    'search': ['get_town_id_for_hotels', 'get_availability_for_hotels'],
+    'info': ['get_hotel_info'],
+    'rooms': ['get_hotel_rooms_available'],
+    'book': ['create_hotel_booking'],
+}
+EXCURSION_PLANS = {
+    'search': ['get_town_id_for_transport_and_excursions', 'get_availability_for_transfer_and_excursions'],
+    'describe': ['get_excursion_or_transfer_description'],
+    'options': ['get_excursion_or_transfer_options_avilable'],
+    'book': ['create_transport_or_excursion_booking'],
+}
+
+ANSWER = (
+    'Here is what I found for you. I compared the available options and picked the ones that best match your request, '
+    'with prices in your currency and the main details of each one. Let me know which one you prefer, or if you would '
+    'like me to search again with different dates, another town or a different number of passengers.'
+)
+
+# Counters of the current process, reported by benchmarks/serve.py
+stats = {'calls': 0, 'tool_calls': 0, 'input_chars': 0, 'output_chars': 0}
+
+# Prompt prefixes already sent, to report cached input tokens like the OpenAI prompt cache:
+# the longest prefix (tools, then messages) seen before, from 1024 tokens on, in 128-token steps
+_prefixes = set()
+
+
+def _usage(messages: List[BaseMessage], tools: Optional[list], reply: AIMessage) -> dict:
+    digest = hashlib.sha1(json.dumps(tools or [], sort_keys=True).encode())
+    chars = len(json.dumps(tools or []))
+    cachedChars = 0
+    keys = []
+    for message in messages:
+        piece = f'{message.type}:{_content(message)}{getattr(message, "tool_calls", "")}'
+        digest.update(piece.encode())
+        chars += len(piece)
+        keys.append(digest.hexdigest())
+        if keys[-1] in _prefixes:
+            cachedChars = chars
+    _prefixes.update(keys)
+    cached = cachedChars // 4
+    cached = cached - cached % 128 if cached >= 1024 else 0
+    output = (len(_content(reply)) + len(str(reply.tool_calls))) // 4
+    return {
+        'input_tokens': chars // 4, 'output_tokens': output, 'total_tokens': chars // 4 + output,
+        'input_token_details': {'cache_read': cached},
+    }
+
+
+def _content(message: BaseMessage) -> str:
+    return message.content if isinstance(message.content, str) else str(message.content)
+
+
+def _last_human(messages: List[BaseMessage]) -> int:
+    for i in range(len(messages) - 1, -1, -1):
+        if isinstance(messages[i], HumanMessage):
+            return i
+    return -1
+
+
+def _find(messages: List[BaseMessage], key: str, pattern: Optional[str] = None):
+    """Latest value of a tool call argument, or of a pattern (prose or table output) in a tool result, human or system message."""
+    for message in reversed(messages):
+        for toolCall in getattr(message, 'tool_calls', None) or []:
+            if key in toolCall['args'] and toolCall['args'][key] not in (None, ''):
+                return toolCall['args'][key]
+        if pattern and not isinstance(message, AIMessage):
+            match = re.search(pattern, _content(message))
+            if match:
+                return next(group for group in match.groups() if group is not None)
+    return None
+
+
+class ScriptedChatModel(BaseChatModel):
+    """Chat model that follows FLOWS instead of calling OpenAI."""
+
+    model: str = 'scripted'
+    temperature: float = 0
+    latency_ms: float = float(os.getenv("SCRIPTED_LLM_LATENCY_MS", 300))
+    token_delay_ms: float = float(os.getenv("SCRIPTED_LLM_TOKEN_DELAY_MS", 15))
+    # Time to first token when it plays a small model (gpt-4o-mini and the like)
+    small_latency_ms: float = float(os.getenv("SCRIPTED_LLM_SMALL_LATENCY_MS", 120))
+
+    @property
+    def _llm_type(self) -> str:
+        return 'scripted'
+
+    @property
+    def _latency(self) -> float:
+        small = any(name in self.model for name in ('mini', 'nano'))
+        return (self.small_latency_ms if small else self.latency_ms) / 1000
+
+    def bind_tools(self, tools: list, **kwargs: Any):
+        return self.bind(tools=[convert_to_openai_tool(tool) for tool in tools], **kwargs)
+
+    def _reply(self, messages: List[BaseMessage], tools: Optional[list]) -> AIMessage:
+        message = self._answer(messages, tools)
+        message.usage_metadata = _usage(messages, tools, message)
+        return message
+
+    def _answer(self, messages: List[BaseMessage], tools: Optional[list]) -> AIMessage:
+        names = {tool['function']['name'] for tool in tools or []}
+        stats['calls'] += 1
+        stats['input_chars'] += sum(len(_content(message)) for message in messages)
+        if not names:
+            # Summary of the context window
+            return AIMessage(content='The user is planning a trip and is comparing hotels and excursions.')
+
+        last = _last_human(messages)
+        request = _content(messages[last]).lower() if last >= 0 else ''
+        # The session context message closes every prompt; it is not part of the turn
+        turn = [message for message in messages[last + 1:] if not isinstance(message, SystemMessage)]
+        if 'ToHotelBookingAssistant' in names:
+            return self._primary(request, turn)
+        plans = HOTEL_PLANS if 'get_availability_for_hotels' in names else EXCURSION_PLANS
+        intent = next((intent for intent in plans if f' {intent}:' in request), None)
+        if intent is None:
+            return AIMessage(content=ANSWER)
+        plan = plans[intent]
+        done = sum(
+            1 for message in turn
+            if isinstance(message, AIMessage) and any(tc['name'] in plan for tc in message.tool_calls)
+        )
+        if done >= len(plan):
+            return AIMessage(content=ANSWER)
+        return self._tool_call(plan[done], messages, request)
+
+    def _primary(self, request: str, turn: List[BaseMessage]) -> AIMessage:
+        if turn:
+            # Back from a specialized assistant
+            return AIMessage(content=ANSWER)
+        name = 'ToHotelBookingAssistant' if request.startswith('hotel') else 'ToBookExcursion'
+        args = {'location': _match(request, r' in ([a-zñáéíóú ]+?) (?:from|on) ') or 'santiago', 'request': request}
+        if name == 'ToHotelBookingAssistant':
+            dates = re.findall(r'\d{4}-\d{2}-\d{2}', request)
+            args.update({'checkin_date': dates[0] if dates else '', 'checkout_date': dates[-1] if dates else ''})
+        return _tool_message(name, args)
+
+    def _tool_call(self, name: str, messages: List[BaseMessage], request: str) -> AIMessage:
+        town = _find(messages, 'townName', r'(?i) in ([a-zñáéíóú ]+?) (?:from|on) ') or 'santiago'
+        dates = re.findall(r'\d{4}-\d{2}-\d{2}', ' '.join(_content(m) for m in messages if isinstance(m, HumanMessage)))
+        checkin = _find(messages, 'checkin_date') or _find(messages, 'fecha') or (dates[-2] if len(dates) > 1 else (dates[-1] if dates else ''))
+        checkout = _find(messages, 'checkout_date') or (dates[-1] if dates else '')
+        adults = int(_find(messages, 'adults', r'for (\d+) adults') or 2)
+        townId = _find(messages, 'townId', r'^(\d+)$')
+        if name.startswith('get_town_id'):
+            args = {'townName': town}
+        elif name == 'get_availability_for_hotels':
+            args = {'townId': str(townId), 'checkin_date': checkin, 'checkout_date': checkout, 'adults': adults}
+        elif name in ('get_hotel_info', 'get_hotel_rooms_available', 'create_hotel_booking'):
+            hotelId = _find(messages, 'hotelId', r'Hotel ID: (\d+)|\nid\|[^\n]*\n(\d+)\|')
+            args = {'hotelId': str(hotelId), 'townId': str(townId), 'checkin_date': checkin, 'checkout_date': checkout, 'adults': adults}
+            if name == 'create_hotel_booking':
+                args.update({
+                    'hotelId': int(hotelId), 'roomId': int(_find(messages, 'roomId', r'Room Id: (\d+)') or 0),
+                    'name': 'John', 'lastName': 'Doe', 'email': 'john@example.com', 'phone': '+56911111111',
+                    'passportOrDni': '123456', 'country': 'Chile',
+                })
+        elif name == 'get_availability_for_transfer_and_excursions':
+            args = {'townId': int(townId), 'tipos': 2, 'fecha': checkin, 'adults': adults}
+        else:
+            serviceId = int(_find(messages, 'serviceId', r'/services/(\d+)\?|\nid\|[^\n]*\n(\d+)\|') or 0)
+            args = {'serviceId': serviceId, 'townId': int(townId), 'tipos': 2, 'date': checkin, 'adults': adults, 'children': 0}
+            if name == 'create_transport_or_excursion_booking':
+                del args['date']
+                args.update({
+                    'serviceCode': int(_find(messages, 'serviceCode', r'Service code: (\d+)|\nservice_code\|[^\n]*\n(\d+)\|') or 0),
+                    'travelDate': checkin, 'language': 'Inglés', 'firstName': 'John', 'lastName': 'Doe',
+                    'email': 'john@example.com', 'phone': '+56911111111', 'passportOrDni': '123456', 'country': 'Chile',
+                })
+        stats['tool_calls'] += 1
+        return _tool_message(name, args)
+
+    def _generate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None, run_manager=None, **kwargs: Any) -> ChatResult:
+        time.sleep(self._latency)
+        message = self._reply(messages, kwargs.get('tools'))
+        stats['output_chars'] += len(_content(message))
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    async def _agenerate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None, run_manager=None, **kwargs: Any) -> ChatResult:
+        await asyncio.sleep(self._latency)
+        message = self._reply(messages, kwargs.get('tools'))
+        stats['output_chars'] += len(_content(message))
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    def _stream(self, messages: List[BaseMessage], stop: Optional[List[str]] = None, run_manager=None, **kwargs: Any) -> Iterator[ChatGenerationChunk]:
+        result = self._generate(messages, stop, **kwargs)
+        yield ChatGenerationChunk(message=_chunk(result.generations[0].message, result.generations[0].message.usage_metadata))
+
+    async def _astream(self, messages: List[BaseMessage], stop: Optional[List[str]] = None, run_manager=None, **kwargs: Any) -> AsyncIterator[ChatGenerationChunk]:
+        await asyncio.sleep(self._latency)
+        message = self._reply(messages, kwargs.get('tools'))
+        stats['output_chars'] += len(_content(message))
+        if message.tool_calls:
+            chunk = ChatGenerationChunk(message=_chunk(message, message.usage_metadata))
+            if run_manager:
+                await run_manager.on_llm_new_token('', chunk=chunk)
+            yield chunk
+            return
+        for i, word in enumerate(_content(message).split(' ')):
+            if i and self.token_delay_ms:
+                await asyncio.sleep(self.token_delay_ms / 1000)
+            chunk = ChatGenerationChunk(message=AIMessageChunk(content=word if i == 0 else f' {word}'))
+            if run_manager:
+                await run_manager.on_llm_new_token(chunk.text, chunk=chunk)
+            yield chunk
+        # Usage comes last, as with stream_usage
+        yield ChatGenerationChunk(message=AIMessageChunk(content='', usage_metadata=message.usage_metadata))
+
+
+class ScriptedEmbeddings(BaseModel, Embeddings):
+    """Embeddings that hash the words of a text into a fixed number of buckets instead of calling OpenAI."""
+
+    model: str = 'scripted'
+    dimensions: int = 256
+
+    def _vector(self, text: str) -> List[float]:
+        vector = [0.0] * self.dimensions
+        for word in re.findall(r'\w+', text.lower()):
+            vector[int(hashlib.sha1(word.encode()).hexdigest(), 16) % self.dimensions] += 1.0
+        return vector
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return [self._vector(text) for text in texts]
+
+    def embed_query(self, text: str) -> List[float]:
+        return self._vector(text)
+
+    async def aembed_query(self, text: str) -> List[float]:
+        return self._vector(text)
+
+
+def _match(text: str, pattern: str) -> Optional[str]:
+    match = re.search(pattern, text)
+    return match.group(1) if match else None
+
+
+def _tool_message(name: str, args: dict) -> AIMessage:
+    return AIMessage(content='', tool_calls=[{'name': name, 'args': args, 'id': f'call_{uuid.uuid4().hex[:24]}'}])
+
+
+def _chunk(message: AIMessage, usage: Optional[dict] = None) -> AIMessageChunk:
+    return AIMessageChunk(
+        content=message.content,
+        usage_metadata=usage,
+        tool_call_chunks=[
+            {'name': tc['name'], 'args': json.dumps(tc['args']), 'id': tc['id'], 'index': i}
+            for i, tc in enumerate(message.tool_calls)
+        ],
+    )
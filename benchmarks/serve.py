@@ -0,0 +1,67 @@
+"""
+Run main.app with ScriptedChatModel in place of ChatOpenAI, and ScriptedEmbeddings in place of OpenAIEmbeddings.
+
+The load test starts this module in its own process, so the measured
+server does not share an event loop with the clients driving it:
+
+    python -m benchmarks.serve --port 8100
+"""
+import argparse
+import os
+import sys
+import tempfile
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+# Every module does `from langchain_openai import ChatOpenAI`, so the swap must happen before main is imported
+import langchain_openai
+from benchmarks import scripted_llm
+langchain_openai.ChatOpenAI = scripted_llm.ScriptedChatModel
+langchain_openai.OpenAIEmbeddings = scripted_llm.ScriptedEmbeddings
+
+
+def rss_bytes() -> int:
+    """Resident set size of this process."""
+    try:
+        with open('/proc/self/statm') as statm:
+            return int(statm.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except OSError:
+        import resource
+        # ru_maxrss is the peak, in kilobytes on Linux and bytes on macOS
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == 'darwin' else peak * 1024
+
+
+def create_app():
+    os.environ.setdefault("OPENAI_API_KEY", "scripted")
+    os.environ.setdefault("TAVILY_API_KEY", "scripted")
+    os.environ.setdefault("FRONT_HOST", "http://localhost:5173")
+    os.environ["ENABLE_STORAGE_LOGS"] = "False"
+    # The router keeps its keyword stage; the semantic cache is off unless the load test asks for it
+    os.environ.setdefault("ROUTER_EMBEDDINGS", "False")
+    os.environ.setdefault("SEMANTIC_CACHE_ENABLED", "False")
+    # Conversation logs and the checkpoint database go to a scratch directory
+    workdir = tempfile.mkdtemp(prefix='travel-assistant-bench-')
+    os.makedirs(os.path.join(workdir, 'logs'))
+    os.chdir(workdir)
+    # Finished logs are "uploaded" to a local directory standing in for the bucket
+    os.environ.setdefault("LOG_BUCKET_DIR", os.path.join(workdir, 'bucket'))
+
+    import main
+
+    @main.app.get("/__bench")
+    async def bench_stats():
+        return {'rss_bytes': rss_bytes(), 'llm': dict(scripted_llm.stats)}
+
+    return main.app
+
+
+if __name__ == "__main__":
+    import uvicorn
+    parser = argparse.ArgumentParser(description="Serve main.app with a scripted chat model")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8100)
+    args = parser.parse_args()
+    uvicorn.run(create_app(), host=args.host, port=args.port, log_level="warning")
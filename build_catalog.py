@@ -0,0 +1,55 @@
+"""
+Build or refresh the excursion and transfer catalog snapshot.
+
+Fetches the availability of every town of CTS_API_V2 on a few sample
+dates, embeds the services and writes the snapshot and its faiss index to
+CATALOG_DIR. Later runs only fetch the towns older than --max-age-hours
+and only embed the services whose text changed:
+
+    poetry run python build_catalog.py --token <CTS token>
+    poetry run python build_catalog.py --towns 12,40 --max-age-hours 0
+"""
+import argparse
+import asyncio
+import os
+import time
+from dotenv import load_dotenv
+import helpers.catalog as catalog
+import helpers.cts_client as cts_client
+from helpers.session import SessionContext
+
+load_dotenv()
+
+
+async def run(args):
+    session = SessionContext(currency=args.currency, cts_token=args.token)
+    townIds = [int(townId) for townId in args.towns.split(',')] if args.towns else None
+    sampleDays = tuple(int(days) for days in args.sample_days.split(','))
+    start = time.perf_counter()
+    try:
+        counters = await catalog.build(
+            session, args.directory, townIds=townIds, max_age_hours=args.max_age_hours,
+            sample_days=sampleDays, adults=args.adults, concurrency=args.concurrency,
+        )
+    finally:
+        await cts_client.aclose()
+    print(f"Towns fetched: {counters['towns']} ({counters['failed_towns']} failed)")
+    print(f"Services in the catalog: {counters.get('services', 0)}, embedded now: {counters.get('embedded', 0)}")
+    print(f"Done in {time.perf_counter() - start:.1f}s, written to {args.directory}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build or refresh the excursion and transfer catalog snapshot")
+    parser.add_argument("--directory", default=catalog.CATALOG_DIR)
+    parser.add_argument("--token", default=os.getenv("CTS_TOKEN"), help="CTS token used for the availability calls")
+    parser.add_argument("--currency", default="USD", help="Currency of the indicative prices (USD or CLP)")
+    parser.add_argument("--towns", help="Comma separated town ids to refresh whatever their age")
+    parser.add_argument("--max-age-hours", type=float, default=24, help="Refresh the towns fetched longer ago than this")
+    parser.add_argument("--sample-days", default="7,30,90", help="Days from today whose availability is merged")
+    parser.add_argument("--adults", type=int, default=2)
+    parser.add_argument("--concurrency", type=int, default=4, help="Towns fetched at the same time")
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,327 @@
+import asyncio
+import os
+import sqlite3
+import threading
+import time
+import zlib
+from abc import ABC, abstractmethod
+from contextlib import contextmanager
+from typing import Any, AsyncIterator, Iterator, List, Optional, Sequence, Tuple
+from langchain_core.runnables import RunnableConfig
+from langgraph.checkpoint.base import (
+    WRITES_IDX_MAP,
+    BaseCheckpointSaver,
+    ChannelVersions,
+    Checkpoint,
+    CheckpointMetadata,
+    CheckpointTuple,
+    get_checkpoint_id,
+)
+from langgraph.checkpoint.memory import MemorySaver
+from langgraph.checkpoint.serde.types import TASKS
+
+
+def _check_keep_last(keep_last: int) -> int:
+    # A conversation resumes from its latest checkpoint, so at least that one is kept
+    if keep_last < 1:
+        raise ValueError(f"CHECKPOINT_KEEP_LAST must be at least 1, got {keep_last}")
+    return keep_last
+
+
+class EvictableSaver(ABC):
+    """
+    Operations the app needs from a checkpoint backend on top of BaseCheckpointSaver.
+
+    A backend (SQLite here, Redis or Postgres elsewhere) only has to be able to
+    drop a whole thread and to tell which threads have been idle for a while;
+    eviction and the async wrappers are built on top of those two methods.
+    """
+
+    # Whether a thread is dropped when its socket closes, unless CHECKPOINT_DELETE_ON_DISCONNECT says otherwise
+    delete_on_disconnect = False
+
+    @abstractmethod
+    def delete_thread(self, thread_id: str) -> None:
+        """Delete every checkpoint and pending write of the thread."""
+
+    @abstractmethod
+    def idle_threads(self, idle_for: float) -> List[str]:
+        """Ids of the threads not written to in the last idle_for seconds."""
+
+    def evict_idle(self, idle_for: float) -> List[str]:
+        """Delete every thread not written to in the last idle_for seconds; returns their ids."""
+        threads = self.idle_threads(idle_for)
+        for thread_id in threads:
+            self.delete_thread(thread_id)
+        return threads
+
+    async def adelete_thread(self, thread_id: str) -> None:
+        await asyncio.get_running_loop().run_in_executor(None, self.delete_thread, thread_id)
+
+    async def aevict_idle(self, idle_for: float) -> List[str]:
+        return await asyncio.get_running_loop().run_in_executor(None, self.evict_idle, idle_for)
+
+
+class BoundedMemorySaver(EvictableSaver, MemorySaver):
+    """In-process saver that keeps only the last checkpoints of each thread and can evict idle threads."""
+
+    # Nothing outlives the process, so a closed conversation only holds memory
+    delete_on_disconnect = True
+
+    def __init__(self, keep_last: int = 10, **kwargs):
+        super().__init__(**kwargs)
+        self.keep_last = _check_keep_last(keep_last)
+        self.last_seen: dict[str, float] = {}
+
+    def put(self, config: RunnableConfig, checkpoint: Checkpoint, metadata: CheckpointMetadata, new_versions: ChannelVersions) -> RunnableConfig:
+        result = super().put(config, checkpoint, metadata, new_versions)
+        thread_id = config["configurable"]["thread_id"]
+        checkpoint_ns = config["configurable"]["checkpoint_ns"]
+        self.last_seen[thread_id] = time.monotonic()
+        checkpoints = self.storage[thread_id][checkpoint_ns]
+        for checkpoint_id in sorted(checkpoints)[:-self.keep_last]:
+            del checkpoints[checkpoint_id]
+            self.writes.pop((thread_id, checkpoint_ns, checkpoint_id), None)
+        return result
+
+    def delete_thread(self, thread_id: str) -> None:
+        self.storage.pop(thread_id, None)
+        for key in [key for key in self.writes if key[0] == thread_id]:
+            del self.writes[key]
+        self.last_seen.pop(thread_id, None)
+
+    def idle_threads(self, idle_for: float) -> List[str]:
+        limit = time.monotonic() - idle_for
+        return [thread_id for thread_id, seen in list(self.last_seen.items()) if seen < limit]
+
+
+class SqliteSaver(EvictableSaver, BaseCheckpointSaver):
+    """
+    File-backed saver. Several workers on the same host can share the file.
+
+    Serialized values are zlib-compressed and only the last `keep_last`
+    checkpoints of each thread are kept, since a conversation only ever
+    resumes from its latest one.
+    """
+
+    def __init__(self, path: str, keep_last: int = 10, **kwargs):
+        super().__init__(**kwargs)
+        self.keep_last = _check_keep_last(keep_last)
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS checkpoints (
+                thread_id TEXT NOT NULL,
+                checkpoint_ns TEXT NOT NULL DEFAULT '',
+                checkpoint_id TEXT NOT NULL,
+                parent_checkpoint_id TEXT,
+                type TEXT,
+                checkpoint BLOB,
+                metadata_type TEXT,
+                metadata BLOB,
+                PRIMARY KEY (thread_id, checkpoint_ns, checkpoint_id)
+            );
+            CREATE TABLE IF NOT EXISTS writes (
+                thread_id TEXT NOT NULL,
+                checkpoint_ns TEXT NOT NULL DEFAULT '',
+                checkpoint_id TEXT NOT NULL,
+                task_id TEXT NOT NULL,
+                idx INTEGER NOT NULL,
+                channel TEXT NOT NULL,
+                type TEXT,
+                value BLOB,
+                PRIMARY KEY (thread_id, checkpoint_ns, checkpoint_id, task_id, idx)
+            );
+            CREATE TABLE IF NOT EXISTS threads (
+                thread_id TEXT PRIMARY KEY,
+                updated_at REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS threads_updated_at ON threads (updated_at);
+            """
+        )
+
+    def _dumps(self, value: Any) -> Tuple[str, bytes]:
+        type_, data = self.serde.dumps_typed(value)
+        return type_, zlib.compress(data)
+
+    def _loads(self, type_: str, data: bytes) -> Any:
+        return self.serde.loads_typed((type_, zlib.decompress(data)))
+
+    @contextmanager
+    def _transaction(self):
+        with self.lock:
+            self.conn.execute("BEGIN")
+            try:
+                yield self.conn
+            except BaseException:
+                self.conn.execute("ROLLBACK")
+                raise
+            self.conn.execute("COMMIT")
+
+    def _execute(self, query: str, params: Sequence = ()) -> list:
+        with self.lock:
+            return self.conn.execute(query, params).fetchall()
+
+    def _tuple(self, thread_id: str, checkpoint_ns: str, row: tuple) -> CheckpointTuple:
+        checkpoint_id, parent_checkpoint_id, type_, checkpoint, metadata_type, metadata = row
+        writes = self._execute(
+            "SELECT task_id, channel, type, value FROM writes WHERE thread_id = ? AND checkpoint_ns = ? AND checkpoint_id = ? ORDER BY task_id, idx",
+            (thread_id, checkpoint_ns, checkpoint_id),
+        )
+        sends = []
+        if parent_checkpoint_id:
+            sends = self._execute(
+                "SELECT type, value FROM writes WHERE thread_id = ? AND checkpoint_ns = ? AND checkpoint_id = ? AND channel = ? ORDER BY task_id, idx",
+                (thread_id, checkpoint_ns, parent_checkpoint_id, TASKS),
+            )
+        return CheckpointTuple(
+            config={"configurable": {"thread_id": thread_id, "checkpoint_ns": checkpoint_ns, "checkpoint_id": checkpoint_id}},
+            checkpoint={
+                **self._loads(type_, checkpoint),
+                "pending_sends": [self._loads(send_type, value) for send_type, value in sends],
+            },
+            metadata=self._loads(metadata_type, metadata),
+            pending_writes=[(task_id, channel, self._loads(write_type, value)) for task_id, channel, write_type, value in writes],
+            parent_config={"configurable": {"thread_id": thread_id, "checkpoint_ns": checkpoint_ns, "checkpoint_id": parent_checkpoint_id}}
+            if parent_checkpoint_id
+            else None,
+        )
+
+    def get_tuple(self, config: RunnableConfig) -> Optional[CheckpointTuple]:
+        thread_id = config["configurable"]["thread_id"]
+        checkpoint_ns = config["configurable"].get("checkpoint_ns", "")
+        columns = "checkpoint_id, parent_checkpoint_id, type, checkpoint, metadata_type, metadata"
+        if checkpoint_id := get_checkpoint_id(config):
+            rows = self._execute(
+                f"SELECT {columns} FROM checkpoints WHERE thread_id = ? AND checkpoint_ns = ? AND checkpoint_id = ?",
+                (thread_id, checkpoint_ns, checkpoint_id),
+            )
+        else:
+            rows = self._execute(
+                f"SELECT {columns} FROM checkpoints WHERE thread_id = ? AND checkpoint_ns = ? ORDER BY checkpoint_id DESC LIMIT 1",
+                (thread_id, checkpoint_ns),
+            )
+        if not rows:
+            return None
+        return self._tuple(thread_id, checkpoint_ns, rows[0])
+
+    def list(
+        self,
+        config: Optional[RunnableConfig],
+        *,
+        filter: Optional[dict[str, Any]] = None,
+        before: Optional[RunnableConfig] = None,
+        limit: Optional[int] = None,
+    ) -> Iterator[CheckpointTuple]:
+        query = "SELECT thread_id, checkpoint_ns, checkpoint_id, parent_checkpoint_id, type, checkpoint, metadata_type, metadata FROM checkpoints"
+        where, params = [], []
+        if config:
+            where.append("thread_id = ?")
+            params.append(config["configurable"]["thread_id"])
+            if (checkpoint_ns := config["configurable"].get("checkpoint_ns")) is not None:
+                where.append("checkpoint_ns = ?")
+                params.append(checkpoint_ns)
+            if checkpoint_id := get_checkpoint_id(config):
+                where.append("checkpoint_id = ?")
+                params.append(checkpoint_id)
+        if before and (before_checkpoint_id := get_checkpoint_id(before)):
+            where.append("checkpoint_id < ?")
+            params.append(before_checkpoint_id)
+        if where:
+            query += " WHERE " + " AND ".join(where)
+        query += " ORDER BY checkpoint_id DESC"
+        for thread_id, checkpoint_ns, *row in self._execute(query, params):
+            if limit is not None and limit <= 0:
+                break
+            checkpoint_tuple = self._tuple(thread_id, checkpoint_ns, tuple(row))
+            if filter and not all(checkpoint_tuple.metadata.get(key) == value for key, value in filter.items()):
+                continue
+            if limit is not None:
+                limit -= 1
+            yield checkpoint_tuple
+
+    def put(self, config: RunnableConfig, checkpoint: Checkpoint, metadata: CheckpointMetadata, new_versions: ChannelVersions) -> RunnableConfig:
+        thread_id = config["configurable"]["thread_id"]
+        checkpoint_ns = config["configurable"].get("checkpoint_ns", "")
+        checkpoint = checkpoint.copy()
+        checkpoint.pop("pending_sends", None)
+        type_, data = self._dumps(checkpoint)
+        metadata_type, metadata_data = self._dumps(metadata)
+        with self._transaction() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO checkpoints VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (thread_id, checkpoint_ns, checkpoint["id"], config["configurable"].get("checkpoint_id"), type_, data, metadata_type, metadata_data),
+            )
+            conn.execute("INSERT OR REPLACE INTO threads VALUES (?, ?)", (thread_id, time.time()))
+            stale = conn.execute(
+                "SELECT checkpoint_id FROM checkpoints WHERE thread_id = ? AND checkpoint_ns = ? ORDER BY checkpoint_id DESC LIMIT -1 OFFSET ?",
+                (thread_id, checkpoint_ns, self.keep_last),
+            ).fetchall()
+            for (checkpoint_id,) in stale:
+                for table in ("checkpoints", "writes"):
+                    conn.execute(
+                        f"DELETE FROM {table} WHERE thread_id = ? AND checkpoint_ns = ? AND checkpoint_id = ?",
+                        (thread_id, checkpoint_ns, checkpoint_id),
+                    )
+        return {"configurable": {"thread_id": thread_id, "checkpoint_ns": checkpoint_ns, "checkpoint_id": checkpoint["id"]}}
+
+    def put_writes(self, config: RunnableConfig, writes: Sequence[Tuple[str, Any]], task_id: str, task_path: str = "") -> None:
+        thread_id = config["configurable"]["thread_id"]
+        checkpoint_ns = config["configurable"].get("checkpoint_ns", "")
+        checkpoint_id = config["configurable"]["checkpoint_id"]
+        rows = [
+            (thread_id, checkpoint_ns, checkpoint_id, task_id, WRITES_IDX_MAP.get(channel, idx), channel, *self._dumps(value))
+            for idx, (channel, value) in enumerate(writes)
+        ]
+        with self._transaction() as conn:
+            conn.executemany("INSERT OR REPLACE INTO writes VALUES (?, ?, ?, ?, ?, ?, ?, ?)", rows)
+
+    def delete_thread(self, thread_id: str) -> None:
+        with self._transaction() as conn:
+            for table in ("checkpoints", "writes", "threads"):
+                conn.execute(f"DELETE FROM {table} WHERE thread_id = ?", (thread_id,))
+
+    def idle_threads(self, idle_for: float) -> List[str]:
+        rows = self._execute("SELECT thread_id FROM threads WHERE updated_at < ?", (time.time() - idle_for,))
+        return [thread_id for (thread_id,) in rows]
+
+    async def aget_tuple(self, config: RunnableConfig) -> Optional[CheckpointTuple]:
+        return await asyncio.get_running_loop().run_in_executor(None, self.get_tuple, config)
+
+    async def alist(
+        self,
+        config: Optional[RunnableConfig],
+        *,
+        filter: Optional[dict[str, Any]] = None,
+        before: Optional[RunnableConfig] = None,
+        limit: Optional[int] = None,
+    ) -> AsyncIterator[CheckpointTuple]:
+        items = await asyncio.get_running_loop().run_in_executor(
+            None, lambda: list(self.list(config, filter=filter, before=before, limit=limit))
+        )
+        for item in items:
+            yield item
+
+    async def aput(self, config: RunnableConfig, checkpoint: Checkpoint, metadata: CheckpointMetadata, new_versions: ChannelVersions) -> RunnableConfig:
+        return await asyncio.get_running_loop().run_in_executor(None, self.put, config, checkpoint, metadata, new_versions)
+
+    async def aput_writes(self, config: RunnableConfig, writes: Sequence[Tuple[str, Any]], task_id: str, task_path: str = "") -> None:
+        return await asyncio.get_running_loop().run_in_executor(None, self.put_writes, config, writes, task_id, task_path)
+
+    def get_next_version(self, current: Optional[str], channel: Any) -> str:
+        # Same string versions as MemorySaver, so both backends are interchangeable
+        return MemorySaver.get_next_version(self, current, channel)
+
+
+def create_checkpointer():
+    """Build the checkpoint backend selected by CHECKPOINT_BACKEND ('sqlite' or 'memory')."""
+    backend = os.getenv("CHECKPOINT_BACKEND", "sqlite")
+    keep_last = int(os.getenv("CHECKPOINT_KEEP_LAST", 10))
+    if backend == "memory":
+        return BoundedMemorySaver(keep_last=keep_last)
+    if backend == "sqlite":
+        return SqliteSaver(os.getenv("CHECKPOINT_SQLITE_PATH", "checkpoints.sqlite"), keep_last=keep_last)
+    raise ValueError(f"Unknown checkpoint backend: {backend}")
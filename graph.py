@@ -1,6 +1,6 @@
-from typing import Literal, Dict, List, Union
+from typing import Literal, Dict, List, Optional, Union
 from langchain_core.runnables import Runnable
-from langgraph.checkpoint.memory import MemorySaver
+from checkpointer import create_checkpointer
 from langgraph.graph import StateGraph, START, END
 from langgraph.prebuilt import tools_condition
 from state import State
@@ -11,6 +11,9 @@ from assistants.assistant import Assistant, CompleteOrEscalate
 from assistants.primary import ToHotelBookingAssistant, ToBookExcursion
 from langchain_core.messages import ToolMessage, AIMessage, HumanMessage, SystemMessage
 from utilities import create_tool_node_with_fallback, create_entry_node, _print_event
+import helpers.intent_router as intent_router
+import helpers.semantic_cache as semantic_cache
+from langchain_core.runnables import RunnableConfig
 import uuid
 
 builder = StateGraph(State)
@@ -25,7 +28,65 @@ builder.add_node("primary_assistant", Assistant(assistant_runnable))
 builder.add_node(
     "primary_assistant_tools", create_tool_node_with_fallback(primary_assistant_tools)
 )
-builder.add_edge(START, "primary_assistant")
+
+# Fast path: unambiguous requests enter the specialized assistant directly,
+# without the primary assistant LLM call; anything else goes through the LLM
+WORKFLOWS = {
+    intent_router.HOTEL: ("book_hotel", ToHotelBookingAssistant),
+    intent_router.EXCURSION: ("book_excursion", ToBookExcursion),
+}
+
+
+async def route_intent(state: State) -> Optional[dict]:
+    message = state["messages"][-1]
+    if not isinstance(message, HumanMessage):
+        return None
+    intent = await intent_router.route(message.content if isinstance(message.content, str) else "")
+    if intent is None:
+        return None
+    workflow, delegation = WORKFLOWS[intent]
+    dialog_state = state.get("dialog_state")
+    if dialog_state and dialog_state[-1] != workflow:
+        # Switching assistants mid-dialog is left to the primary assistant
+        return None
+    args = {name: "" for name in delegation.model_fields}
+    args["request"] = message.content
+    return {
+        "messages": [
+            AIMessage(content="", tool_calls=[{"name": delegation.__name__, "args": args, "id": f"call_{uuid.uuid4().hex}"}])
+        ]
+    }
+
+
+def route_after_intent(
+    state: State,
+) -> Literal["primary_assistant", "enter_book_hotel", "enter_book_excursion"]:
+    if isinstance(state["messages"][-1], AIMessage):
+        return route_primary_assistant(state)
+    return "primary_assistant"
+
+
+# Similar general questions asked before are answered from the semantic cache, without any LLM call
+async def answer_from_cache(state: State, config: RunnableConfig) -> Optional[dict]:
+    message = state["messages"][-1]
+    if not isinstance(message, HumanMessage) or not isinstance(message.content, str):
+        return None
+    answer = await semantic_cache.lookup(message.content, config)
+    if answer is None:
+        return None
+    return {"messages": [AIMessage(content=answer, response_metadata={"semantic_cache": True})]}
+
+
+def route_after_cache(state: State) -> Literal["intent_router", "__end__"]:
+    if isinstance(state["messages"][-1], AIMessage):
+        return END
+    return "intent_router"
+
+
+builder.add_node("semantic_cache", answer_from_cache)
+builder.add_edge(START, "semantic_cache")
+builder.add_conditional_edges("semantic_cache", route_after_cache)
+builder.add_node("intent_router", route_intent)
 
 # This node will be shared for exiting all specialized assistants
 def pop_dialog_state(state: State) -> dict:
@@ -35,14 +96,13 @@ def pop_dialog_state(state: State) -> dict:
     to specific sub-graphs.
     """
     messages = []
-    if state["messages"][-1].tool_calls:
-        # Note: Doesn't currently handle the edge case where the llm performs parallel tool calls
-        messages.append(
-            ToolMessage(
-                content="Resuming dialog with the host assistant. Please reflect on the past conversation and assist the user as needed.",
-                tool_call_id=state["messages"][-1].tool_calls[0]["id"],
-            )
-        )
+    # Answer every tool call of the message, the escalation and any call made next to it
+    for tool_call in state["messages"][-1].tool_calls:
+        if tool_call["name"] == CompleteOrEscalate.__name__:
+            content = "Resuming dialog with the host assistant. Please reflect on the past conversation and assist the user as needed."
+        else:
+            content = "Not run: the dialog was returned to the host assistant before this call was made."
+        messages.append(ToolMessage(content=content, tool_call_id=tool_call["id"]))
     return {
         "dialog_state": "pop",
         "messages": messages,
@@ -64,7 +124,8 @@ builder.add_node(
 )
 builder.add_node(
     "book_hotel_sensitive_tools",
-    create_tool_node_with_fallback(book_hotel_sensitive_tools),
+    # Bookings, updates and cancellations run one at a time, in the order the model asked for them
+    create_tool_node_with_fallback(book_hotel_sensitive_tools, max_concurrency=1),
 )
 
 
@@ -103,7 +164,7 @@ builder.add_node(
 )
 builder.add_node(
     "book_excursion_sensitive_tools",
-    create_tool_node_with_fallback(book_excursion_sensitive_tools),
+    create_tool_node_with_fallback(book_excursion_sensitive_tools, max_concurrency=1),
 )
 
 
@@ -166,6 +227,7 @@ builder.add_conditional_edges(
     },
 )
 builder.add_edge("primary_assistant_tools", "primary_assistant")
+builder.add_conditional_edges("intent_router", route_after_intent)
 
 
 # Each delegated workflow can directly respond to the user
@@ -186,13 +248,32 @@ def route_to_workflow(
 
 #builder.add_conditional_edges("fetch_user_info", route_to_workflow)
 
+# Let the user approve or deny the use of sensitive tools
+INTERRUPT_BEFORE = [
+    "book_hotel_sensitive_tools",
+    "book_excursion_sensitive_tools",
+]
+# Routing of the assistants whose tool calls can lead to one of those nodes
+APPROVAL_ROUTES = {
+    "book_hotel": route_book_hotel,
+    "book_excursion": route_book_excursion,
+}
+
+
+def pending_approval(node: Optional[str], state: dict) -> Optional[AIMessage]:
+    """
+    The message whose tool calls wait for the user's approval, when a run
+    stopped right after node with this state; None when the run finished.
+    """
+    route = APPROVAL_ROUTES.get(node)
+    if route is None or route(state) not in INTERRUPT_BEFORE:
+        return None
+    return state["messages"][-1]
+
+
 # Compile graph
-memory = MemorySaver()
+memory = create_checkpointer()
 part_4_graph = builder.compile(
     checkpointer=memory,
-    # Let the user approve or deny the use of sensitive tools
-    interrupt_before=[
-        "book_hotel_sensitive_tools",
-        "book_excursion_sensitive_tools",
-    ],
+    interrupt_before=INTERRUPT_BEFORE,
 )
\ No newline at end of file
@@ -0,0 +1,98 @@
+import os
+from typing import Optional
+from urllib.parse import quote
+import helpers.cts_client as cts_client
+from helpers.cache import TTLCache
+from helpers.session import SessionContext
+
+# file_number -> minimal booking record, kept per agency token
+booking_index = TTLCache(
+    'booking_index',
+    ttl=float(os.getenv("BOOKING_INDEX_TTL", 600)),
+    max_entries=int(os.getenv("BOOKING_INDEX_SIZE", 5000)),
+)
+MAX_SCAN_PAGES = int(os.getenv("BOOKING_SCAN_MAX_PAGES", 50))
+HEADERS = {'origin': 'localhost'}
+
+
+def _summary(booking: dict) -> dict:
+    # Only what the update/cancel tools need, to keep the index small
+    return {
+        'file_number': str(booking['file_number']),
+        'slug': booking['slug'],
+        'items': [{'id': item['id']} for item in booking.get('items', [])],
+    }
+
+
+def _index_page(session: SessionContext, bookings: list, fileNumber: str) -> Optional[dict]:
+    """Index a page of bookings and return the one matching fileNumber, if any."""
+    found = None
+    for booking in bookings:
+        summary = _summary(booking)
+        booking_index.set((session.token_scope, summary['file_number']), summary)
+        if summary['file_number'] == fileNumber:
+            found = summary
+    return found
+
+
+async def _fetch_page(session: SessionContext, url: str) -> dict:
+    response = await cts_client.request(session, 'GET', url, endpoint='booking', headers=HEADERS)
+    response.raise_for_status()
+    return response.json()
+
+
+async def _fetch_direct(session: SessionContext, fileNumber: str) -> tuple[Optional[dict], Optional[dict]]:
+    """
+    Ask the API for the booking with a filtered query, when a filter parameter is configured.
+
+    Returns:
+    The booking, if found, and the page fetched when the API ignored the
+    filter (it is then the first page of the full list), else None.
+    """
+    param = os.getenv("CTS_BOOKING_LOOKUP_PARAM", "search")
+    if not param:
+        return None, None
+    url = f'{os.getenv("CTS_API_V1")}/booking/?showOnlyMyBookings=true&{param}={quote(fileNumber)}'
+    page = await _fetch_page(session, url)
+    bookings = page.get('results', [])
+    # An unsupported filter is ignored by the API, so always check the match
+    found = _index_page(session, bookings, fileNumber)
+    unfiltered = any(str(booking['file_number']) != fileNumber for booking in bookings)
+    return found, page if unfiltered else None
+
+
+async def _scan(session: SessionContext, fileNumber: str, first_page: Optional[dict] = None) -> Optional[dict]:
+    """Walk the paginated bookings list, stopping at the page that contains the booking; first_page is already indexed."""
+    url = f'{os.getenv("CTS_API_V1")}/booking/?showOnlyMyBookings=true'
+    pages = 0
+    if first_page is not None:
+        url = first_page.get('next')
+        pages = 1
+    while url and pages < MAX_SCAN_PAGES:
+        page = await _fetch_page(session, url)
+        found = _index_page(session, page.get('results', []), fileNumber)
+        if found:
+            return found
+        url = page.get('next')
+        pages += 1
+    return None
+
+
+async def find_booking(session: SessionContext, fileNumber) -> Optional[dict]:
+    """
+    Find a booking of the agency by its file number.
+
+    Args:
+    session: The session context of the conversation.
+    fileNumber: The booking file number.
+
+    Returns:
+    A dictionary with the booking 'file_number', 'slug' and 'items' ids, or None if not found.
+    """
+    fileNumber = str(fileNumber).strip()
+    key = (session.token_scope, fileNumber)
+    booking = booking_index.lookup(key)
+    if booking is not None:
+        return booking
+    booking, first_page = await _fetch_direct(session, fileNumber)
+    return booking or await _scan(session, fileNumber, first_page)
@@ -0,0 +1,154 @@
+import asyncio
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Hashable
+
+# Every cache created in the process, so their counters can be reported together
+_caches: list = []
+_MISSING = object()
+
+
+class TTLCache:
+    """
+    Size-bounded LRU cache whose entries expire after `ttl` seconds.
+
+    get_or_fetch also de-duplicates concurrent misses: while a value is
+    being fetched, other callers asking for the same key wait for that
+    fetch instead of starting their own.
+
+    Entries loaded speculatively (prefetched) are counted apart, and so is
+    the first real lookup that finds one, to measure whether prefetching pays.
+    """
+
+    def __init__(self, name: str, ttl: float, max_entries: int):
+        self.name = name
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries: OrderedDict = OrderedDict()
+        self._inflight: dict = {}
+        # Prefetched keys not yet asked for by a real lookup
+        self._speculative: set = set()
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.evictions = 0
+        self.prefetched = 0
+        self.prefetch_hits = 0
+        _caches.append(self)
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        entry = self._entries.get(key)
+        if entry is None:
+            return default
+        expires_at, value = entry
+        if expires_at <= time.monotonic():
+            del self._entries[key]
+            self._speculative.discard(key)
+            return default
+        self._entries.move_to_end(key)
+        return value
+
+    def lookup(self, key: Hashable, default: Any = None) -> Any:
+        """Like get, but counted as a hit or a miss, for callers that load missing values themselves."""
+        value = self.get(key, _MISSING)
+        if value is _MISSING:
+            self.misses += 1
+            return default
+        self.hits += 1
+        self._claim_speculative(key)
+        return value
+
+    def set(self, key: Hashable, value: Any):
+        self._entries[key] = (time.monotonic() + self.ttl, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            evicted, _ = self._entries.popitem(last=False)
+            self._speculative.discard(evicted)
+            self.evictions += 1
+
+    def invalidate(self, key: Hashable):
+        self._entries.pop(key, None)
+        self._speculative.discard(key)
+
+    def clear(self):
+        self._entries.clear()
+        self._speculative.clear()
+
+    def _claim_speculative(self, key: Hashable):
+        if key in self._speculative:
+            self._speculative.discard(key)
+            self.prefetch_hits += 1
+
+    async def get_or_fetch(self, key: Hashable, fetch: Callable[[], Awaitable[Any]], revalidate: bool = False, speculative: bool = False) -> Any:
+        """
+        Return the cached value for key, calling fetch on a miss.
+
+        Args:
+        key: The cache key.
+        fetch: Coroutine function that loads the value.
+        revalidate: Skip the cached value and always fetch a fresh one (the result is still cached).
+        speculative: The lookup is a prefetch; it does nothing when the key is cached or being fetched.
+        """
+        if speculative:
+            if self.get(key, _MISSING) is not _MISSING or key in self._inflight:
+                return None
+            self.prefetched += 1
+            self._speculative.add(key)
+            try:
+                return await self._fetch(key, fetch)
+            except BaseException:
+                self._speculative.discard(key)
+                raise
+
+        if not revalidate:
+            value = self.get(key, _MISSING)
+            if value is not _MISSING:
+                self.hits += 1
+                self._claim_speculative(key)
+                return value
+            inflight = self._inflight.get(key)
+            if inflight is not None:
+                self.coalesced += 1
+                self._claim_speculative(key)
+                return await asyncio.shield(inflight)
+
+        self.misses += 1
+        self._speculative.discard(key)
+        return await self._fetch(key, fetch)
+
+    async def _fetch(self, key: Hashable, fetch: Callable[[], Awaitable[Any]]) -> Any:
+        async def load() -> Any:
+            value = await fetch()
+            self.set(key, value)
+            return value
+
+        # The fetch runs as its own task so a cancelled caller does not fail the others waiting for it
+        task = self._inflight[key] = asyncio.ensure_future(load())
+        task.add_done_callback(lambda done: self._forget(key, done))
+        return await asyncio.shield(task)
+
+    def _forget(self, key: Hashable, task: asyncio.Task):
+        if self._inflight.get(key) is task:
+            del self._inflight[key]
+        # Mark a failure as retrieved when nobody else was waiting
+        if not task.cancelled():
+            task.exception()
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses + self.coalesced
+        return {
+            'entries': len(self._entries),
+            'hits': self.hits,
+            'misses': self.misses,
+            'coalesced': self.coalesced,
+            'evictions': self.evictions,
+            'hit_rate': round((self.hits + self.coalesced) / lookups, 3) if lookups else 0.0,
+            'prefetched': self.prefetched,
+            'prefetch_hits': self.prefetch_hits,
+            'prefetch_hit_rate': round(self.prefetch_hits / self.prefetched, 3) if self.prefetched else 0.0,
+        }
+
+
+def all_stats() -> dict:
+    """Counters of every cache in the process, by cache name."""
+    return {cache.name: cache.stats() for cache in _caches}
@@ -0,0 +1,271 @@
+import asyncio
+import hashlib
+import json
+import os
+import time
+from datetime import date, timedelta
+from typing import Optional
+from langchain_openai import OpenAIEmbeddings
+import helpers.excursion_helper as excursion_helper
+import helpers.town_directory as town_directory
+from helpers.cache import TTLCache
+from helpers.session import SessionContext
+from helpers.town_directory import normalize_town_name as normalize
+
+# Snapshot of every excursion and transfer of the CTS catalog, with a faiss
+# index of their texts. It is built offline (build_catalog.py), memory-mapped
+# at startup and answers discovery questions ('what can I do near Puerto
+# Varas') without live availability calls.
+CATALOG_DIR = os.getenv("CATALOG_DIR", "catalog")
+EMBEDDING_MODEL = os.getenv("CATALOG_EMBEDDING_MODEL", "text-embedding-3-small")
+SERVICES_FILE = 'services.json'
+INDEX_FILE = 'index.faiss'
+TOWNS_FILE = 'towns.json'
+
+query_cache = TTLCache(
+    'catalog_query_embedding',
+    ttl=float(os.getenv("CATALOG_QUERY_CACHE_TTL", 3600)),
+    max_entries=int(os.getenv("CATALOG_QUERY_CACHE_SIZE", 512)),
+)
+_embeddings: Optional[OpenAIEmbeddings] = None
+_catalog = None
+_loaded_mtime = None
+faiss = None
+np = None
+
+
+def _import_faiss() -> bool:
+    # Imported on first use: faiss and numpy add tens of MB to a server that has no snapshot
+    global faiss, np
+    if faiss is None:
+        try:
+            import faiss as faissModule
+            import numpy as numpyModule
+        except ImportError:
+            return False
+        faiss, np = faissModule, numpyModule
+    return True
+
+
+def embeddings() -> OpenAIEmbeddings:
+    global _embeddings
+    if _embeddings is None:
+        _embeddings = OpenAIEmbeddings(model=EMBEDDING_MODEL)
+    return _embeddings
+
+
+def service_text(service: dict) -> str:
+    """The text of a catalog entry that is embedded: names, city, description and what it includes."""
+    return '\n'.join([
+        service['name_en'], service['name_es'], service['city'],
+        service['description_en'], ', '.join(service['concepts']),
+    ])
+
+
+def catalog_entry(service: dict, townId: int, tipos: int) -> dict:
+    """The snapshot entry of one service of an /availability/ payload."""
+    options = service.get('services') or []
+    entry = {
+        'id': service['id'],
+        'tipos': tipos,
+        'town_id': townId,
+        'city': service.get('city') or '',
+        'name_es': service['glosas'].get('g_text_es') or '',
+        'name_en': service['glosas'].get('g_text_en') or '',
+        'description_es': (service.get('descriptions') or {}).get('d_text_es') or '',
+        'description_en': (service.get('descriptions') or {}).get('d_text_en') or '',
+        'concepts': service.get('concepts') or [],
+        'price_from': min((option['sale_price'] for option in options), default=None),
+        'currency': options[0]['currency'] if options else '',
+        'duration': options[0].get('service_duration', '') if options else '',
+    }
+    entry['hash'] = hashlib.sha256(service_text(entry).encode()).hexdigest()[:16]
+    return entry
+
+
+class Catalog:
+    """A loaded snapshot: the entries, in index order, and their faiss index."""
+
+    def __init__(self, services: list, index, towns: dict):
+        self.services = services
+        self.index = index
+        self.towns = towns
+        self.by_city = {}
+        for position, service in enumerate(services):
+            self.by_city.setdefault(normalize(service['city']), []).append(position)
+
+    def positions(self, townName: Optional[str] = None, tipos: Optional[int] = None) -> Optional[list]:
+        """Positions of the entries in a town (matched by name) and of a type, None for all of them."""
+        if not townName and not tipos:
+            return None
+        positions = range(len(self.services))
+        if townName:
+            name = normalize(townName)
+            positions = [position for city, cityPositions in self.by_city.items() if city and (name in city or city in name) for position in cityPositions]
+        if tipos:
+            positions = [position for position in positions if self.services[position]['tipos'] == tipos]
+        return list(positions)
+
+    def search(self, vector, k: int = 5, positions: Optional[list] = None) -> list[tuple[float, dict]]:
+        """The k entries closest to a normalized query vector, among positions when given."""
+        params = None
+        if positions is not None:
+            if not positions:
+                return []
+            params = faiss.SearchParameters(sel=faiss.IDSelectorBatch(np.array(positions, dtype='int64')))
+        similarities, ids = self.index.search(vector, min(k, len(self.services)), params=params)
+        return [(float(similarity), self.services[int(i)]) for similarity, i in zip(similarities[0], ids[0]) if i >= 0]
+
+
+def load(directory: str = CATALOG_DIR) -> Optional[Catalog]:
+    """Load the snapshot, memory-mapping its index; None when it was never built."""
+    global _catalog, _loaded_mtime
+    if not os.path.exists(os.path.join(directory, INDEX_FILE)) or not _import_faiss():
+        return None
+    _loaded_mtime = os.path.getmtime(os.path.join(directory, INDEX_FILE))
+    with open(os.path.join(directory, SERVICES_FILE)) as file:
+        services = json.load(file)
+    with open(os.path.join(directory, TOWNS_FILE)) as file:
+        towns = json.load(file)
+    index = faiss.read_index(os.path.join(directory, INDEX_FILE), faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY)
+    _catalog = Catalog(services, index, towns)
+    return _catalog
+
+
+def get() -> Optional[Catalog]:
+    """The loaded snapshot, loaded again when build_catalog.py has rewritten it."""
+    try:
+        mtime = os.path.getmtime(os.path.join(CATALOG_DIR, INDEX_FILE))
+    except OSError:
+        return _catalog
+    return _catalog if _catalog is not None and mtime == _loaded_mtime else load()
+
+
+async def embed_query(query: str):
+    async def fetch():
+        vector = np.array([await embeddings().aembed_query(query)], dtype='float32')
+        faiss.normalize_L2(vector)
+        return vector
+
+    return await query_cache.get_or_fetch(normalize(query), fetch)
+
+
+async def recommend(query: str, townName: Optional[str] = None, tipos: Optional[int] = None, k: int = 5) -> tuple[list, bool]:
+    """
+    The catalog entries closest to a free-text request.
+
+    Returns:
+    The (similarity, entry) pairs, and whether the town filter was applied
+    (False when no entry is in a town with that name, then the whole catalog is searched).
+    """
+    catalog = get()
+    positions = catalog.positions(townName, tipos)
+    inTown = True
+    if townName and not positions:
+        positions, inTown = catalog.positions(None, tipos), False
+    return catalog.search(await embed_query(query), k, positions), inTown
+
+
+async def _town_services(session: SessionContext, townId: int, dates: list[str], adults: int) -> list[dict]:
+    entries = {}
+    for tipos in (1, 2):
+        for day in dates:
+            availability = await excursion_helper.get_availability(session, townId, tipos, day, adults, 0)
+            for service in availability.services:
+                entries.setdefault((tipos, service['id']), catalog_entry(service, townId, tipos))
+    return list(entries.values())
+
+
+async def build(
+    session: SessionContext,
+    directory: str = CATALOG_DIR,
+    townIds: Optional[list[int]] = None,
+    max_age_hours: float = 24,
+    sample_days: tuple = (7, 30, 90),
+    adults: int = 2,
+    concurrency: int = 4,
+) -> dict:
+    """
+    Build or refresh the snapshot from the CTS availability of every town.
+
+    A town is fetched again only when its entries are older than max_age_hours
+    (or when it is listed in townIds), and only the entries whose text changed
+    are embedded again.
+
+    Args:
+    session: The session used for the CTS calls (token and currency).
+    directory: Where the snapshot is written.
+    townIds: Refresh these towns whatever their age.
+    max_age_hours: Age after which a town is refreshed.
+    sample_days: Days from today whose availability is merged to discover the services of a town.
+    adults: The number of adults of the availability queries.
+    concurrency: Towns fetched at the same time.
+
+    Returns:
+    Counters of the refresh.
+    """
+    if not _import_faiss():
+        raise RuntimeError("faiss-cpu is required to build the catalog")
+    os.makedirs(directory, exist_ok=True)
+    previous = load(directory)
+    services = previous.services if previous else []
+    towns = dict(previous.towns) if previous else {}
+    vectors = {
+        service['hash']: previous.index.reconstruct(position)
+        for position, service in enumerate(services)
+    } if previous else {}
+
+    await town_directory.excursion_towns.ensure_loaded(session)
+    directoryTowns = town_directory.excursion_towns.all_towns()
+    now = time.time()
+    stale = [
+        town for town in directoryTowns
+        if (townIds and town_directory.excursion_towns.town_id(town) in townIds)
+        or (not townIds and now - towns.get(str(town_directory.excursion_towns.town_id(town)), 0) > max_age_hours * 3600)
+    ]
+    dates = [(date.today() + timedelta(days=days)).isoformat() for days in sample_days]
+    semaphore = asyncio.Semaphore(concurrency)
+    counters = {'towns': len(stale), 'failed_towns': 0}
+
+    async def refresh(town):
+        townId = town_directory.excursion_towns.town_id(town)
+        async with semaphore:
+            try:
+                return townId, await _town_services(session, townId, dates, adults)
+            except Exception as e:
+                print(f"Error fetching the catalog of town {townId}: {e}")
+                counters['failed_towns'] += 1
+                return townId, None
+
+    fresh = {}
+    for townId, entries in await asyncio.gather(*(refresh(town) for town in stale)):
+        if entries is not None:
+            fresh[townId] = entries
+            towns[str(townId)] = now
+    services = [service for service in services if service['town_id'] not in fresh]
+    services += [entry for entries in fresh.values() for entry in entries]
+
+    missing = [service for service in services if service['hash'] not in vectors]
+    if missing:
+        embedded = await embeddings().aembed_documents([service_text(service) for service in missing])
+        for service, vector in zip(missing, embedded):
+            vectors[service['hash']] = np.array(vector, dtype='float32')
+    counters.update({'services': len(services), 'embedded': len(missing)})
+    if not services:
+        return counters
+
+    matrix = np.array([vectors[service['hash']] for service in services], dtype='float32')
+    faiss.normalize_L2(matrix)
+    index = faiss.IndexIDMap2(faiss.IndexFlatIP(matrix.shape[1]))
+    index.add_with_ids(matrix, np.arange(len(services), dtype='int64'))
+    # Written next to the snapshot and renamed, so a running server never reads a half-written file;
+    # the index goes last since servers reload when it changes
+    for name, data in ((SERVICES_FILE, services), (TOWNS_FILE, towns)):
+        path = os.path.join(directory, name)
+        with open(f'{path}.tmp', 'w') as file:
+            json.dump(data, file, ensure_ascii=False)
+        os.replace(f'{path}.tmp', path)
+    path = os.path.join(directory, INDEX_FILE)
+    faiss.write_index(index, f'{path}.tmp')
+    os.replace(f'{path}.tmp', path)
+    return counters
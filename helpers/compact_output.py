@@ -0,0 +1,85 @@
+import os
+from typing import Optional
+
+# 'compact' renders listings as one table with the instructions stated once,
+# 'prose' keeps the original one-paragraph-per-result text.
+OUTPUT_FORMAT = os.getenv("OUTPUT_FORMAT", "compact")
+MAX_RESULTS = int(os.getenv("OUTPUT_MAX_RESULTS", 10))
+
+
+def is_compact() -> bool:
+    return OUTPUT_FORMAT == 'compact'
+
+
+def page(items: list, limit: Optional[int] = None, offset: Optional[int] = 0) -> tuple[list, int, int]:
+    """
+    Slice a listing to the requested page.
+
+    Returns:
+    The items of the page, the offset actually used and the total number of items.
+    """
+    offset = max(offset or 0, 0)
+    limit = limit if limit and limit > 0 else MAX_RESULTS
+    return items[offset:offset + limit], offset, len(items)
+
+
+def more_available(offset: int, count: int, total: int) -> Optional[str]:
+    """The line telling the model how to get the next results, None on the last page."""
+    if offset + count < total:
+        return f'More available: call again with offset={offset + count} for the next results.'
+    return None
+
+
+def paged(text: str, offset: int, count: int, total: int) -> str:
+    """Prose output of one page, with the same continuation line as a table when more results are available."""
+    more = more_available(offset, count, total)
+    if more is None:
+        return text
+    return f'{text}\nShowing {offset + 1}-{offset + count} of {total}. {more}'
+
+
+def _cell(value) -> str:
+    if isinstance(value, (list, tuple)):
+        value = ', '.join(str(item) for item in value)
+    if isinstance(value, bool):
+        value = 'yes' if value else 'no'
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)
+    return ' '.join(str(value).replace('|', '/').split())
+
+
+def render_table(
+    title: str,
+    columns: list[str],
+    rows: list[dict],
+    notes: Optional[list[str]] = None,
+    fields: Optional[list[str]] = None,
+    offset: int = 0,
+    total: Optional[int] = None,
+) -> str:
+    """
+    Render rows as a pipe-separated table.
+
+    Args:
+    title: First line of the output, what the table lists.
+    columns: The columns of the table; the first one is the key and is always included.
+    rows: One dictionary per row, keyed by column.
+    notes: Instructions and shared values (links, currency), written once above the table.
+    fields: Columns to include (projection); None includes all of them.
+    offset: Position of the first row in the full listing.
+    total: Size of the full listing, to tell the model that more results are available.
+    """
+    if fields:
+        wanted = {field.strip().lower() for field in fields}
+        columns = [columns[0]] + [column for column in columns[1:] if column in wanted]
+    total = len(rows) + offset if total is None else total
+    if not rows:
+        return f'{title}: no results.'
+    lines = [f'{title}. Showing {offset + 1}-{offset + len(rows)} of {total}.']
+    lines += notes or []
+    lines.append('|'.join(columns))
+    lines += ['|'.join(_cell(row.get(column, '')) for column in columns) for row in rows]
+    more = more_available(offset, len(rows), total)
+    if more:
+        lines.append(more)
+    return '\n'.join(lines)
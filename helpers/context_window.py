@@ -0,0 +1,163 @@
+import os
+from typing import Optional
+from langchain_core.messages import AnyMessage, HumanMessage, SystemMessage, ToolMessage
+import helpers.model_registry as model_registry
+import time
+
+ENABLED = os.getenv("CONTEXT_WINDOW_ENABLED", "True") == "True"
+KEEP_TURNS = int(os.getenv("CONTEXT_KEEP_TURNS", 3))
+# Tool results of the last turns stay complete: follow-ups like "the first one" refer to their ids
+TOOL_KEEP_TURNS = int(os.getenv("CONTEXT_TOOL_KEEP_TURNS", 2))
+TOOL_MAX_CHARS = int(os.getenv("CONTEXT_TOOL_MAX_CHARS", 600))
+SUMMARY_TRIGGER_TOKENS = int(os.getenv("CONTEXT_SUMMARY_TRIGGER_TOKENS", 2000))
+SUMMARY_MAX_WORDS = int(os.getenv("CONTEXT_SUMMARY_MAX_WORDS", 250))
+
+SUMMARY_MODEL = model_registry.model_for('context_summary', 'summarization')
+
+SUMMARY_PROMPT = (
+    "You keep the running summary of a conversation between a customer and the CTS Travel Assistant. "
+    "Update the current summary with the new messages. Keep every fact a booking may still need: "
+    "names, towns, dates, number of adults, children and their ages, hotel, room and service ids, "
+    "prices, currency, booking file numbers and what the user accepted or rejected. "
+    "Drop greetings, listings the user did not pick and tool boilerplate. "
+    f"Answer only with the updated summary, in at most {SUMMARY_MAX_WORDS} words.\n\n"
+    "Current summary:\n{summary}\n\nNew messages:\n{messages}"
+)
+
+# Per-process token accounting, reported by /metrics
+_stats = {
+    'calls': 0,
+    'tokens_full': 0,
+    'tokens_sent': 0,
+    'summaries': 0,
+    'summary_errors': 0,
+    'tool_messages_elided': 0,
+    'input_tokens': 0,
+}
+
+
+def estimate_tokens(messages: list) -> int:
+    """Rough token count of a list of messages (about four characters per token)."""
+    chars = 0
+    for message in messages:
+        content = message.content if isinstance(message.content, str) else str(message.content)
+        chars += len(content) + 16
+        for toolCall in getattr(message, 'tool_calls', None) or []:
+            chars += len(toolCall['name']) + len(str(toolCall['args']))
+    return chars // 4
+
+
+def _turn_starts(messages: list) -> list[int]:
+    return [i for i, message in enumerate(messages) if isinstance(message, HumanMessage)]
+
+
+def _elide(message: ToolMessage) -> ToolMessage:
+    content = message.content if isinstance(message.content, str) else str(message.content)
+    if len(content) <= TOOL_MAX_CHARS:
+        return message
+    _stats['tool_messages_elided'] += 1
+    elided = f"{content[:TOOL_MAX_CHARS]}\n[... {len(content) - TOOL_MAX_CHARS} characters of an earlier tool result elided]"
+    return message.model_copy(update={'content': elided})
+
+
+def _compact(messages: list, keep_from: int) -> list:
+    """Shorten the tool results of the messages before keep_from."""
+    return [
+        _elide(message) if isinstance(message, ToolMessage) and i < keep_from else message
+        for i, message in enumerate(messages)
+    ]
+
+
+def _transcript(messages: list) -> str:
+    lines = []
+    for message in messages:
+        content = message.content if isinstance(message.content, str) else str(message.content)
+        if isinstance(message, ToolMessage):
+            content = content[:TOOL_MAX_CHARS]
+        for toolCall in getattr(message, 'tool_calls', None) or []:
+            content += f" [calls {toolCall['name']}({toolCall['args']})]"
+        lines.append(f"{message.type}: {content}")
+    return '\n'.join(lines)
+
+
+async def _summarize(summary: str, messages: list) -> str:
+    prompt = SUMMARY_PROMPT.format(summary=summary or '(empty)', messages=_transcript(messages))
+    # Marked so the summary tokens are not streamed to the user as the assistant answer
+    summarizer = model_registry.chat_model(SUMMARY_MODEL).with_config(tags=['context_summary'], metadata={'context_summary': True})
+    started = time.perf_counter()
+    try:
+        result = await summarizer.ainvoke([HumanMessage(content=prompt)])
+    finally:
+        model_registry.record_node('context_summary', started)
+    model_registry.record_call('context_summary', SUMMARY_MODEL, result)
+    _stats['summaries'] += 1
+    return result.content
+
+
+async def build_context(state: dict) -> tuple[list[AnyMessage], dict]:
+    """
+    Select the messages to send to the model for this turn.
+
+    The last CONTEXT_KEEP_TURNS user turns are kept, with the tool results
+    older than the last CONTEXT_TOOL_KEEP_TURNS turns shortened. Older
+    messages are folded into a running summary once they exceed
+    CONTEXT_SUMMARY_TRIGGER_TOKENS; until then they are sent with their
+    tool results shortened.
+
+    Args:
+    state: The graph state, with 'messages' and the optional 'summary' and 'summary_cursor'.
+
+    Returns:
+    The messages for the model, and the state updates to persist (empty when the summary did not change).
+    """
+    messages = state["messages"]
+    if not ENABLED:
+        _stats['calls'] += 1
+        _stats['tokens_full'] += estimate_tokens(messages)
+        _stats['tokens_sent'] += estimate_tokens(messages)
+        return messages, {}
+    summary: Optional[str] = state.get("summary") or ''
+    cursor = state.get("summary_cursor") or 0
+    starts = _turn_starts(messages)
+    windowStart = starts[-KEEP_TURNS] if len(starts) >= KEEP_TURNS else (starts[0] if starts else 0)
+    toolsStart = starts[-TOOL_KEEP_TURNS] if TOOL_KEEP_TURNS and len(starts) >= TOOL_KEEP_TURNS else 0
+    updates = {}
+
+    # Messages older than the window that are not in the summary yet
+    pending = messages[cursor:windowStart] if windowStart > cursor else []
+    if pending and estimate_tokens(pending) >= SUMMARY_TRIGGER_TOKENS:
+        try:
+            summary = await _summarize(summary, pending)
+            cursor = windowStart
+            pending = []
+            updates = {"summary": summary, "summary_cursor": cursor}
+        except Exception as e:
+            # Keep sending the pending messages, the summary is retried next turn
+            _stats['summary_errors'] += 1
+            print(f"Error summarizing conversation: {e}")
+
+    start = windowStart - len(pending)
+    selected = _compact(messages[start:], toolsStart - start)
+    if summary:
+        selected = [SystemMessage(content=f"Summary of the earlier conversation:\n{summary}")] + selected
+
+    _stats['calls'] += 1
+    _stats['tokens_full'] += estimate_tokens(messages)
+    _stats['tokens_sent'] += estimate_tokens(selected)
+    return selected, updates
+
+
+def record_usage(result: AnyMessage):
+    """Add the input tokens reported by the model for one call."""
+    usage = getattr(result, 'usage_metadata', None) or {}
+    _stats['input_tokens'] += usage.get('input_tokens', 0)
+
+
+def stats() -> dict:
+    calls = _stats['calls']
+    return {
+        **_stats,
+        'avg_tokens_full': round(_stats['tokens_full'] / calls) if calls else 0,
+        'avg_tokens_sent': round(_stats['tokens_sent'] / calls) if calls else 0,
+        'avg_input_tokens': round(_stats['input_tokens'] / calls) if calls else 0,
+    }
@@ -0,0 +1,158 @@
+import asyncio
+import json as jsonlib
+import os
+import importlib.util
+import httpx
+from typing import Optional
+from helpers.session import SessionContext
+
+# Default timeouts (in seconds) for each kind of CTS endpoint. Every value can
+# be overridden with a CTS_TIMEOUT_<ENDPOINT> environment variable.
+DEFAULT_TIMEOUTS = {
+    'default': 30.0,
+    'city': 15.0,
+    'search': 45.0,
+    'booking': 90.0,
+}
+CONNECT_TIMEOUT = float(os.getenv("CTS_CONNECT_TIMEOUT", 5))
+
+# Requests in flight to the same CTS host, across all sessions
+MAX_CONCURRENCY_PER_HOST = int(os.getenv("CTS_MAX_CONCURRENCY_PER_HOST", 20))
+
+# Identical read requests in flight at the same time share one upstream call
+COALESCE = os.getenv("CTS_COALESCE", "True") == "True"
+# POST endpoints that only read (searches); GET is always a read
+READ_ENDPOINTS = {'search'}
+
+_async_client: Optional[httpx.AsyncClient] = None
+_host_semaphores: dict = {}
+_inflight: dict = {}
+_stats = {'requests': 0, 'upstream': 0, 'coalesced': 0}
+_endpoint_stats: dict = {}
+
+
+def _limits() -> httpx.Limits:
+    return httpx.Limits(
+        max_connections=int(os.getenv("CTS_POOL_MAX_CONNECTIONS", 100)),
+        max_keepalive_connections=int(os.getenv("CTS_POOL_MAX_KEEPALIVE", 20)),
+        keepalive_expiry=float(os.getenv("CTS_POOL_KEEPALIVE_EXPIRY", 30)),
+    )
+
+
+def _http2() -> bool:
+    # HTTP/2 needs the optional 'h2' package (httpx[http2])
+    return os.getenv("CTS_HTTP2", "True") == "True" and importlib.util.find_spec("h2") is not None
+
+
+def get_timeout(endpoint: str) -> httpx.Timeout:
+    default = DEFAULT_TIMEOUTS.get(endpoint, DEFAULT_TIMEOUTS['default'])
+    timeout = float(os.getenv(f"CTS_TIMEOUT_{endpoint.upper()}", default))
+    return httpx.Timeout(timeout, connect=CONNECT_TIMEOUT)
+
+
+def get_async_client() -> httpx.AsyncClient:
+    """Return the process-wide asynchronous client, creating it on first use."""
+    global _async_client
+    if _async_client is None:
+        _async_client = httpx.AsyncClient(limits=_limits(), http2=_http2(), timeout=get_timeout('default'))
+    return _async_client
+
+
+def _host_semaphore(url: str) -> asyncio.Semaphore:
+    host = httpx.URL(url).netloc
+    semaphore = _host_semaphores.get(host)
+    if semaphore is None:
+        semaphore = _host_semaphores[host] = asyncio.Semaphore(MAX_CONCURRENCY_PER_HOST)
+    return semaphore
+
+
+def _headers(session: SessionContext, headers: Optional[dict]) -> dict:
+    return {**session.headers, **(headers or {})}
+
+
+def _coalesce_key(session: SessionContext, method: str, url: str, endpoint: str, json: Optional[dict], headers: Optional[dict]) -> Optional[tuple]:
+    """Key of a request that may share its upstream call, None when it must run on its own."""
+    if not COALESCE or (method.upper() != 'GET' and endpoint not in READ_ENDPOINTS):
+        return None
+    body = jsonlib.dumps(json, sort_keys=True, separators=(',', ':')) if json is not None else ''
+    extra = jsonlib.dumps(headers, sort_keys=True) if headers else ''
+    return (method.upper(), str(httpx.URL(url)), body, session.currency_id, session.token_scope, extra)
+
+
+def _count(endpoint: str, counter: str):
+    _stats[counter] += 1
+    counters = _endpoint_stats.setdefault(endpoint, {'requests': 0, 'upstream': 0, 'coalesced': 0})
+    counters[counter] += 1
+
+
+def _forget(key: tuple, task: asyncio.Task):
+    if _inflight.get(key) is task:
+        del _inflight[key]
+    # Mark a failure as retrieved when every waiter was cancelled
+    if not task.cancelled():
+        task.exception()
+
+
+async def request(
+    session: SessionContext,
+    method: str,
+    url: str,
+    endpoint: str = 'default',
+    json: Optional[dict] = None,
+    headers: Optional[dict] = None,
+) -> httpx.Response:
+    """
+    Send a request to the CTS API through the shared connection pool.
+
+    Reads (GET, and POST searches) identical to one already in flight
+    (same URL, body, currency and token) wait for it and get its response
+    instead of calling the API again. Writes always run on their own.
+
+    Args:
+    session: The session context, used for the authorization header.
+    method: The HTTP method.
+    url: The full URL.
+    endpoint: The kind of endpoint ('city', 'search', 'booking' or 'default'), used to pick the timeout.
+    json: The JSON body, if any.
+    headers: Extra headers to send.
+    """
+    _count(endpoint, 'requests')
+    key = _coalesce_key(session, method, url, endpoint, json, headers)
+    task = _inflight.get(key) if key is not None else None
+    if task is not None:
+        _count(endpoint, 'coalesced')
+        return await asyncio.shield(task)
+
+    async def send() -> httpx.Response:
+        _count(endpoint, 'upstream')
+        client = get_async_client()
+        async with _host_semaphore(url):
+            return await client.request(method, url, json=json, headers=_headers(session, headers), timeout=get_timeout(endpoint))
+
+    if key is None:
+        return await send()
+    # The call runs as its own task so a cancelled caller does not fail the others waiting for it
+    task = _inflight[key] = asyncio.ensure_future(send())
+    task.add_done_callback(lambda done: _forget(key, done))
+    return await asyncio.shield(task)
+
+
+def stats() -> dict:
+    """Requests made through request(), upstream calls sent and requests served by another in-flight call."""
+    requests = _stats['requests']
+    return {
+        **_stats,
+        'in_flight': len(_inflight),
+        'coalesce_rate': round(_stats['coalesced'] / requests, 3) if requests else 0.0,
+        'endpoints': {endpoint: dict(counters) for endpoint, counters in _endpoint_stats.items()},
+    }
+
+
+async def aclose():
+    """Close the client and its pooled connections."""
+    global _async_client
+    _host_semaphores.clear()
+    _inflight.clear()
+    if _async_client is not None:
+        await _async_client.aclose()
+        _async_client = None
@@ -1,5 +1,58 @@
-import requests
+import helpers.cts_client as cts_client
 import os
+from helpers.cache import TTLCache
+from helpers.compact_output import render_table
+from helpers.session import SessionContext
+
+# Availability payloads are shared by the listing, description, options and
+# booking steps of the excursion flow, so they are fetched once per query.
+availability_cache = TTLCache(
+    'excursion_availability',
+    ttl=float(os.getenv("AVAILABILITY_CACHE_TTL", 300)),
+    max_entries=int(os.getenv("AVAILABILITY_CACHE_SIZE", 256)),
+)
+
+
+class Availability:
+    """One /availability/ payload with its services indexed by id."""
+
+    def __init__(self, services: list):
+        self.services = services
+        self.by_id = {service['id']: service for service in services}
+
+
+async def get_availability(
+    session: SessionContext,
+    townId: int,
+    tipos: int,
+    fecha: str,
+    adults: int = 1,
+    children: int = 0,
+    revalidate: bool = False,
+) -> Availability:
+    """
+    Get the transfer or excursion availability for a town and date, from the cache when possible.
+
+    Args:
+    session: The session context of the conversation.
+    townId: The town ID.
+    tipos: The type of service. 1 is for transfer, and 2 is for excursions.
+    fecha (string): The date (format YYYY-MM-DD).
+    adults: The number of adults.
+    children: The number of children.
+    revalidate: Always fetch fresh data from the API (used when booking).
+    """
+    currency = session.currency_id
+    key = (session.token_scope, str(townId), str(tipos), fecha, str(adults), str(children), currency)
+
+    async def fetch():
+        url = f'{os.getenv("CTS_API_V2")}/availability/?townId={townId}&tipos={tipos}&fecha={fecha}&adults={adults}&children={children}&currency={currency}'
+        response = await cts_client.request(session, 'GET', url, endpoint='search')
+        response.raise_for_status()
+        return Availability(response.json())
+
+    return await availability_cache.get_or_fetch(key, fetch, revalidate=revalidate)
+
 
 def generate_excursion_availability_response(excursions, date, adults, children, townId, infants=0):
     result = 'The excursions available are the following:\n\n'
@@ -81,7 +134,100 @@ def generate_excursion_or_transfer_description_response(description, service):
     result += f'(Also, if necesary, translate the labels to the language used by the user)\n\n'
     return result
 
-def get_data_for_excursion_or_transfer_booking(
+EXCURSION_COLUMNS = ['id', 'name', 'price_from', 'duration', 'pickup', 'children_allowed', 'type', 'includes']
+TRANSFER_COLUMNS = ['id', 'name', 'price_from', 'pickup', 'free_cancellation', 'type']
+OPTION_COLUMNS = ['service_code', 'travel_date', 'cancel_until', 'languages', 'price', 'duration', 'pickup', 'type', 'guide']
+CATALOG_COLUMNS = ['id', 'name', 'type', 'city', 'town_id', 'price_from', 'duration', 'includes']
+LANGUAGE_NOTE = "Names are in the user's language when available; translate them and the labels if needed."
+
+
+def _text(texts: dict, prefix: str, language: str) -> str:
+    # Only the text in the user's language is sent; English is the fallback
+    suffix = 'es' if language == 'Spanish' else 'en'
+    return texts.get(f'{prefix}_{suffix}') or texts.get(f'{prefix}_en') or texts.get(f'{prefix}_es', '')
+
+
+def _service_type(services: list) -> str:
+    isRegular = {service['is_regular'] for service in services}
+    if len(isRegular) == 1:
+        return 'shared' if isRegular.pop() else 'private'
+    return 'shared and private'
+
+
+def _details_link(kind: str, serviceType: int, services: list, date, adults, children, townId, infants) -> str:
+    townName = services[0]['city'].title() if services else ''
+    return f"{os.getenv('FRONT_HOST')}/travel-assistant/{kind}/<id>?desde={date}&hasta={date}&adults={adults}&children={children}&infants={infants}&pax={adults}&townName={townName}&townId={townId}&serviceType={serviceType}"
+
+
+def generate_excursion_availability_table(excursions, date, adults, children, townId, language=None, fields=None, offset=0, total=None, infants=0):
+    notes = [
+        LANGUAGE_NOTE,
+        f"Prices are per service, from the cheapest option. Details link of an excursion (replace <id>): {_details_link('services', 2, excursions, date, adults, children, townId, infants)}",
+    ]
+    rows = [
+        {
+            'id': excursion['id'],
+            'name': _text(excursion['glosas'], 'g_text', language),
+            'price_from': f"{excursion['services'][0]['sale_price']} {excursion['services'][0]['currency']}",
+            'duration': excursion['services'][0]['service_duration'],
+            'pickup': f"{excursion['services'][0]['meeting_point']}, {excursion['services'][0]['city'].title()}",
+            'children_allowed': excursion['services'][0]['allow_childs'],
+            'type': _service_type(excursion['services']),
+            'includes': excursion['concepts'],
+        }
+        for excursion in excursions
+    ]
+    return render_table('Excursions available', EXCURSION_COLUMNS, rows, notes=notes, fields=fields, offset=offset, total=total)
+
+
+def generate_transfer_availability_table(transfers, date, adults, children, townId, language=None, fields=None, offset=0, total=None, infants=0):
+    notes = [
+        LANGUAGE_NOTE,
+        f"Prices are per service, from the cheapest option. Details link of a transfer (replace <id>): {_details_link('transfer', 1, transfers, date, adults, children, townId, infants)}",
+    ]
+    rows = [
+        {
+            'id': transfer['id'],
+            'name': _text(transfer['glosas'], 'g_text', language),
+            'price_from': f"{transfer['services'][0]['sale_price']} {transfer['services'][0]['currency']}",
+            'pickup': f"{transfer['services'][0]['meeting_point']}, {transfer['services'][0]['city'].title()}",
+            'free_cancellation': bool(transfer['services'][0]['cancellation_date']),
+            'type': _service_type(transfer['services']),
+        }
+        for transfer in transfers
+    ]
+    return render_table('Transfers available', TRANSFER_COLUMNS, rows, notes=notes, fields=fields, offset=offset, total=total)
+
+
+def generate_excursion_or_transfer_options_table(options, service):
+    notes = ['Never show the service_code to the user. Translate the labels if needed.']
+    rows = [
+        {
+            'service_code': option['service_code'],
+            'travel_date': option['travel_date'],
+            'cancel_until': option['cancellation_date'],
+            'languages': option['language'],
+            'price': f"{option['sale_price']} {option['currency']}",
+            'duration': option['service_duration'],
+            'pickup': f"{option['meeting_point']}, {option['city'].title()}",
+            'type': 'shared' if option['is_regular'] else 'private',
+            'guide': option['guide'],
+        }
+        for option in options['services']
+    ]
+    return render_table(f'Options available for this {service}', OPTION_COLUMNS, rows, notes=notes)
+
+
+def generate_excursion_or_transfer_description_compact(description, service, language=None):
+    result = f"The {service} information ({LANGUAGE_NOTE}):\n"
+    result += f"Name: {_text(description['glosas'], 'g_text', language)}\n"
+    result += f"Description: {_text(description['descriptions'], 'd_text', language)}\n"
+    result += f"Includes: {', '.join(description['concepts'])}\n"
+    result += f"City: {description['city']}\n"
+    return result
+
+async def get_data_for_excursion_or_transfer_booking(
+    session: SessionContext,
     serviceId: int,
     serviceCode: int,
     townId: str,
@@ -94,6 +240,7 @@ def get_data_for_excursion_or_transfer_booking(
     Get the data for a transport or excursion booking.
 
     Args:
+    session: The session context of the conversation.
     serviceId: The service Id.
     serviceCode: The service code.
     townId: The town ID.
@@ -106,14 +253,32 @@ def get_data_for_excursion_or_transfer_booking(
     The booking response as a string with the booking ID and
     a link to the booking detail.
     """
-    currency = 1 if os.getenv("CURRENCY") == 'CLP' else 2
-    url = f'{os.getenv("CTS_API_V2")}/availability/?townId={townId}&tipos={tipos}&fecha={travelDate}&adults={adults}&children={children}&currency={currency}'
-    ctsToken = os.getenv("CTS_TOKEN")
-    headers = {'Authorization': f'token {ctsToken}'}
-    response = requests.get(url, headers=headers).json()
-    for services in response:
-        if services['id'] == serviceId:
-            services = services
-            break
+    # Prices must be fresh at the booking step, so skip the cached availability
+    availability = await get_availability(session, townId, tipos, travelDate, adults, children, revalidate=True)
+    services = availability.by_id[serviceId]
     result = next((service for service in services['services'] if service['service_code'] == serviceCode), None)
-    return result
\ No newline at end of file
+    return result
+
+
+def generate_catalog_recommendations_table(results, language=None, townName=None, inTown=True):
+    notes = [
+        'From the catalog snapshot, not live availability: prices are indicative, per person, and the service may not run every day.',
+        "Once the user picks a service and a date, check it with 'get_availability_for_transfer_and_excursions' (tipos 1 for transfers, 2 for excursions) and the town_id.",
+        LANGUAGE_NOTE,
+    ]
+    if townName and not inTown:
+        notes.insert(0, f'Nothing in the catalog is in a town named {townName}; these are the closest matches anywhere.')
+    rows = [
+        {
+            'id': service['id'],
+            'name': _text({'g_text_es': service['name_es'], 'g_text_en': service['name_en']}, 'g_text', language),
+            'type': 'transfer' if service['tipos'] == 1 else 'excursion',
+            'city': service['city'].title(),
+            'town_id': service['town_id'],
+            'price_from': f"{service['price_from']} {service['currency']}" if service['price_from'] is not None else '',
+            'duration': service['duration'],
+            'includes': service['concepts'],
+        }
+        for _, service in results
+    ]
+    return render_table('Recommended excursions and transfers', CATALOG_COLUMNS, rows, notes=notes)
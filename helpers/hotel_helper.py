@@ -1,6 +1,255 @@
-import requests
+import asyncio
+import helpers.cts_client as cts_client
 import os
+from datetime import date, timedelta
+import json as jsonlib
+import unicodedata
 from typing import Optional
+from helpers.cache import TTLCache
+from helpers.compact_output import render_table
+from helpers.town_directory import normalize_town_name as normalize
+import helpers.booking_lookup as booking_lookup
+from helpers.session import SessionContext
+
+# The same /hotel/{hotelId}/ search backs the hotel info, the rooms list
+# and the booking, so identical queries hit the CTS API only once.
+hotel_detail_cache = TTLCache(
+    'hotel_detail',
+    ttl=float(os.getenv("HOTEL_DETAIL_CACHE_TTL", 300)),
+    max_entries=int(os.getenv("HOTEL_DETAIL_CACHE_SIZE", 512)),
+)
+
+# /hotel/ searches, kept so that filtering and paging the same search does not call the API again
+hotel_search_cache = TTLCache(
+    'hotel_search',
+    ttl=float(os.getenv("HOTEL_SEARCH_CACHE_TTL", 300)),
+    max_entries=int(os.getenv("HOTEL_SEARCH_CACHE_SIZE", 256)),
+)
+SORT_OPTIONS = ('price', 'price_desc', 'rating')
+
+# Flexible-date searches send one /hotel/ search per check-in date, at most
+# this many at a time and over at most this many dates
+FANOUT_MAX_CONCURRENCY = int(os.getenv("HOTEL_FANOUT_MAX_CONCURRENCY", 6))
+FANOUT_MAX_DATES = int(os.getenv("HOTEL_FANOUT_MAX_DATES", 31))
+WEEKDAYS = ('monday', 'tuesday', 'wednesday', 'thursday', 'friday', 'saturday', 'sunday')
+# Weekday names the model may pass on from the user, in English, Spanish and
+# Portuguese, without accents; Portuguese names may end in '-feira'
+WEEKDAY_NAMES = {
+    **{name: i for i, name in enumerate(WEEKDAYS)},
+    **{name: i for i, name in enumerate(('lunes', 'martes', 'miercoles', 'jueves', 'viernes', 'sabado', 'domingo'))},
+    **{name: i for i, name in enumerate(('segunda', 'terca', 'quarta', 'quinta', 'sexta', 'sabado', 'domingo'))},
+}
+
+
+class HotelSearch:
+    """One /hotel/ search result, indexed by price, rating, category and amenity."""
+
+    def __init__(self, hotels: list):
+        self.hotels = hotels
+        self.prices = [
+            min(available['price_value_with_tax'] for available in hotel['availability']) if hotel['availability'] else float('inf')
+            for hotel in hotels
+        ]
+        self.stars = [hotel['category']['rating'] or 0 for hotel in hotels]
+        self.by_category = {}
+        self.by_amenity = {}
+        for i, hotel in enumerate(hotels):
+            self.by_category.setdefault(normalize(hotel['category']['name']), set()).add(i)
+            for amenity in hotel['ammenities']:
+                self.by_amenity.setdefault(normalize(amenity['name']), set()).add(i)
+        positions = range(len(hotels))
+        self.orders = {
+            'price': sorted(positions, key=lambda i: self.prices[i]),
+            # Hotels without a price go last in both directions
+            'price_desc': sorted(positions, key=lambda i: -self.prices[i] if self.prices[i] != float('inf') else float('inf')),
+            'rating': sorted(positions, key=lambda i: (-self.stars[i], self.prices[i])),
+        }
+
+    def _matching(self, index: dict, term: str) -> set:
+        # 'wifi' matches 'Wifi' and 'Free WiFi'
+        term = normalize(term)
+        result = set()
+        for key, positions in index.items():
+            if term in key:
+                result |= positions
+        return result
+
+    def filter(
+        self,
+        max_price: Optional[float] = None,
+        min_stars: Optional[int] = None,
+        amenities: Optional[list[str]] = None,
+        category: Optional[str] = None,
+        sort_by: Optional[str] = None,
+    ) -> list[dict]:
+        """The hotels matching every filter, in the requested order (the API order by default)."""
+        candidates = None
+        for amenity in amenities or []:
+            matching = self._matching(self.by_amenity, amenity)
+            candidates = matching if candidates is None else candidates & matching
+        if category:
+            matching = self._matching(self.by_category, category)
+            candidates = matching if candidates is None else candidates & matching
+        order = self.orders.get(sort_by) or range(len(self.hotels))
+        return [
+            self.hotels[i] for i in order
+            if (candidates is None or i in candidates)
+            and (max_price is None or self.prices[i] <= max_price)
+            and (min_stars is None or self.stars[i] >= min_stars)
+        ]
+
+
+def _search_request(session: SessionContext, townId, checkin_date, checkout_date, rooms: list[dict]) -> tuple[dict, tuple]:
+    currency = session.currency_id
+    json = {'townId': townId, 'checkin': checkin_date, 'checkout': checkout_date, 'rooms': rooms, 'currency': currency}
+    key = (session.token_scope, str(townId), checkin_date, checkout_date, jsonlib.dumps(rooms, sort_keys=True), currency)
+    return json, key
+
+
+def cached_search(session: SessionContext, townId, checkin_date, checkout_date, rooms: list[dict]) -> Optional[HotelSearch]:
+    """The cached result of a search, without calling the API nor counting a cache lookup."""
+    _, key = _search_request(session, townId, checkin_date, checkout_date, rooms)
+    return hotel_search_cache.get(key)
+
+
+async def search_hotels(
+    session: SessionContext,
+    townId: Optional[str] = None,
+    checkin_date: Optional[str] = None,
+    checkout_date: Optional[str] = None,
+    adults: Optional[int] = 1,
+    children: Optional[int] = 0,
+    infants: Optional[int] = 0,
+    ages: Optional[list[int]] = [],
+    rooms: Optional[list[dict]] = None,
+) -> tuple[HotelSearch, dict]:
+    """
+    Search the hotels available in a town, from the cache when possible.
+
+    Args:
+    rooms: Several room configurations to search together; replaces adults, children, infants and ages.
+
+    Returns:
+    The indexed search result, and the search payload sent to the API.
+    """
+    json, key = _search_request(session, townId, checkin_date, checkout_date, rooms or room_list(adults, children, infants, ages))
+
+    async def fetch():
+        url = f'{os.getenv("CTS_API_V1")}/hotel/'
+        response = await cts_client.request(session, 'POST', url, endpoint='search', json=json)
+        response.raise_for_status()
+        return HotelSearch(response.json()['data'])
+
+    return await hotel_search_cache.get_or_fetch(key, fetch), json
+
+
+def stay_nights(checkin_date: str, checkout_date: str) -> int:
+    """Number of nights between two 'YYYY-mm-dd' dates."""
+    return (date.fromisoformat(checkout_date) - date.fromisoformat(checkin_date)).days
+
+
+def room_list(adults: int = 1, children: int = 0, infants: int = 0, ages: Optional[list[int]] = None, rooms: Optional[list[dict]] = None) -> list[dict]:
+    """The rooms entry of a search payload, one dictionary per room with every key set."""
+    if not rooms:
+        rooms = [{'adults': adults, 'children': children, 'infants': infants, 'ages': ages}]
+    return [
+        {'adults': room.get('adults') or 1, 'children': room.get('children') or 0, 'infants': room.get('infants') or 0, 'ages': list(room.get('ages') or [])}
+        for room in rooms
+    ]
+
+
+def weekday_number(name: str) -> int:
+    """Monday 0 to Sunday 6, from an English, Spanish or Portuguese weekday name."""
+    key = unicodedata.normalize('NFKD', name.strip().lower()).encode('ascii', 'ignore').decode()
+    key = key.removesuffix('-feira').removesuffix(' feira')
+    if key not in WEEKDAY_NAMES:
+        raise ValueError(f"unknown weekday '{name}'; use one of: {', '.join(WEEKDAY_NAMES)}")
+    return WEEKDAY_NAMES[key]
+
+
+def checkin_dates(date_from: str, date_to: str, nights: int, weekdays: Optional[list[str]] = None) -> list[str]:
+    """
+    The check-in dates of a date window: every day from date_from whose stay of
+    `nights` nights ends by date_to, optionally only on the given weekdays.
+    """
+    wanted = {weekday_number(day) for day in weekdays} if weekdays else None
+    first, last = date.fromisoformat(date_from), date.fromisoformat(date_to) - timedelta(days=nights)
+    days = (first + timedelta(days=i) for i in range((last - first).days + 1))
+    return [day.isoformat() for day in days if wanted is None or day.weekday() in wanted]
+
+
+async def search_date_window(
+    session: SessionContext,
+    townId: str,
+    checkins: list[str],
+    nights: int,
+    rooms: list[dict],
+) -> dict:
+    """
+    Search the hotels of a town for every check-in date concurrently.
+
+    Args:
+    session: The session context of the conversation.
+    townId: The town ID.
+    checkins: The check-in dates ('YYYY-mm-dd'), at most FANOUT_MAX_DATES.
+    nights: The length of every stay.
+    rooms: The room configurations, searched together.
+
+    Returns:
+    'hotels': {hotelId: {'hotel': the hotel, 'prices': {checkin: lowest price of the stay}}},
+    in the API order, and 'failed': the check-in dates whose search failed.
+    """
+    semaphore = asyncio.Semaphore(FANOUT_MAX_CONCURRENCY)
+
+    async def search(checkin):
+        checkout = (date.fromisoformat(checkin) + timedelta(days=nights)).isoformat()
+        async with semaphore:
+            result, _ = await search_hotels(session, townId, checkin, checkout, rooms=rooms)
+            return result
+
+    results = await asyncio.gather(*(search(checkin) for checkin in checkins), return_exceptions=True)
+    hotels, failed = {}, []
+    for checkin, result in zip(checkins, results):
+        # A search cancelled on its own (not the whole window) comes back as a CancelledError, a BaseException
+        if isinstance(result, BaseException):
+            failed.append(checkin)
+            continue
+        for hotel, price in zip(result.hotels, result.prices):
+            if price != float('inf'):
+                hotels.setdefault(hotel['id'], {'hotel': hotel, 'prices': {}})['prices'][checkin] = price
+    return {'hotels': hotels, 'failed': failed}
+
+
+def generate_hotels_date_matrix_table(entries, payload, checkins, nights, failed=(), offset=0, total=None):
+    """
+    Render the hotels of a date window search as a price-by-check-in-date table,
+    cheapest hotels first.
+    """
+    currency = 'CLP' if payload['currency'] == 1 else 'USD'
+    rooms = jsonlib.dumps(payload['rooms'], separators=(',', ':'))
+    link = f'{os.getenv("FRONT_HOST")}/travel-assistant/hotels/<id>?townId={payload["townId"]}&checkin=<checkin>&checkout=<checkout>&rooms={rooms}'
+    notes = [
+        f'Prices are the lowest per stay of {nights} night{"s" if nights != 1 else ""} for all the rooms, in {currency}{", tax included" if currency == "CLP" else ""}, by check-in date; "-" means not available.',
+        'Never show the id to the user. Tell the user the cheapest dates, not the whole table, unless asked.',
+        f'Details link of a hotel (replace <id>, <checkin> and <checkout>): {link}',
+    ]
+    if failed:
+        notes.append(f'The search failed for these check-in dates, try them again later: {", ".join(failed)}.')
+    columns = ['id', 'name', 'stars', 'cheapest', 'best_checkin'] + checkins
+    rows = []
+    for entry in entries:
+        prices = entry['prices']
+        best = min(prices, key=prices.get)
+        rows.append({
+            'id': entry['hotel']['id'],
+            'name': entry['hotel']['name'],
+            'stars': entry['hotel']['category']['rating'],
+            'cheapest': prices[best],
+            'best_checkin': best,
+            **{checkin: prices.get(checkin, '-') for checkin in checkins},
+        })
+    return render_table(f'Hotels available from {checkins[0]} to {checkins[-1]} (check-in dates)', columns, rows, notes=notes, offset=offset, total=total)
+
 
 def generate_hotels_availability_response(json_response, payload):
     result = f'The hotels available are the following: \n\n'
@@ -29,7 +278,81 @@ def generate_hotels_availability_response(json_response, payload):
         result += f'Hotel Ammenities: {ammenities}\n\n'
     return result
 
-def get_data_for_booking(
+HOTEL_COLUMNS = ['id', 'name', 'stars', 'price_from', 'address', 'category', 'amenities']
+
+def generate_hotels_availability_table(json_response, payload, fields=None, offset=0, total=None, filters=None):
+    hotels = json_response['data']
+    currency = 'CLP' if payload['currency'] == 1 else 'USD'
+    room = payload['rooms'][0]
+    townId = hotels[0]['town_id'] if hotels else payload['townId']
+    link = f'{os.getenv("FRONT_HOST")}/travel-assistant/hotels/<id>?townId={townId}&checkin={payload["checkin"]}&checkout={payload["checkout"]}&rooms=[{{"adults":{room["adults"]},"children":{room["children"]},"infants":{room["infants"]},"ages":{room["ages"]}}}]'
+    notes = [
+        f'Prices are the lowest per stay, in {currency}{", tax included" if currency == "CLP" else ""}.',
+        'Never show the id to the user. Only show category and amenities if asked; to narrow the list, call again with the filter arguments.',
+        f'Details link of a hotel (replace <id>): {link}',
+    ]
+    if filters:
+        notes.insert(0, f'Filters: {filters}.')
+    rows = [
+        {
+            'id': data['id'],
+            'name': data['name'],
+            'stars': data['category']['rating'],
+            'price_from': min(available['price_value_with_tax'] for available in data['availability']) if data['availability'] else '',
+            'address': data['address'],
+            'category': data['category']['name'],
+            'amenities': [amenity['name'] for amenity in data['ammenities']],
+        }
+        for data in hotels
+    ]
+    return render_table('Hotels available', HOTEL_COLUMNS, rows, notes=notes, fields=fields, offset=offset, total=total)
+
+async def get_hotel_detail(
+    session: SessionContext,
+    hotelId: str,
+    townId: Optional[str] = None,
+    checkin_date: Optional[str] = None,
+    checkout_date: Optional[str] = None,
+    adults: Optional[int] = 1,
+    children: Optional[int] = 0,
+    infants: Optional[int] = 0,
+    ages: Optional[list[int]] = [],
+    revalidate: bool = False,
+    speculative: bool = False,
+) -> dict:
+    """
+    Get the detail and room availability of one hotel, from the cache when possible.
+
+    Args:
+    session: The session context of the conversation.
+    hotelId: The hotel ID.
+    townId: The town ID.
+    checkin_date (string): The check-in date.
+    checkout_date (string): The check-out date.
+    adults: The number of adults. Default is 1.
+    children: The number of children. Default is 0.
+    infants: The number of infants. Default is 0.
+    ages: The ages of the children. Default is [].
+    revalidate: Always fetch fresh data from the API.
+    speculative: Prefetch only: warm the cache, or do nothing when the detail is already cached.
+
+    Returns:
+    The /hotel/{hotelId}/ response.
+    """
+    currency = session.currency_id
+    json = {'townId': townId, 'checkin': checkin_date, 'checkout': checkout_date, 'rooms': [{'adults': adults, 'children': children, 'infants': infants, 'ages': ages}], 'currency': currency}
+    key = (session.token_scope, str(hotelId), str(townId), checkin_date, checkout_date, jsonlib.dumps(json['rooms'], sort_keys=True), currency)
+
+    async def fetch():
+        url = f'{os.getenv("CTS_API_V1")}/hotel/{hotelId}/'
+        response = await cts_client.request(session, 'POST', url, endpoint='search', json=json)
+        response.raise_for_status()
+        return response.json()
+
+    return await hotel_detail_cache.get_or_fetch(key, fetch, revalidate=revalidate, speculative=speculative)
+
+async def get_data_for_booking(
+    session: SessionContext,
     hotelId: str,
     townId: Optional[str] = None,
     checkin_date: Optional[str] = None,
@@ -38,11 +361,13 @@ def get_data_for_booking(
     children: Optional[int] = 0,
     infants: Optional[int] = 0,
     ages: Optional[list[int]] = [],
+    revalidate: bool = True,
 ) -> list[dict]:
     """
     Get availability of hotels in a given town.
 
     Args:
+    session: The session context of the conversation.
     hotelId: The hotel ID.
     townId: The town ID.
     checkin_date (string): The check-in date.
@@ -51,6 +376,7 @@ def get_data_for_booking(
     children: The number of children. Default is 0.
     infants: The number of infants. Default is 0.
     ages: The ages of the children. Default is [].
+    revalidate: Fetch fresh prices instead of using the cached hotel detail. Default is True.
 
     Use this function when the user wants to know more information of the hotel
     or has already selected a hotel.
@@ -62,23 +388,10 @@ def get_data_for_booking(
     Example:
     get_availability(hotelId = '196', townId='1234', checkin_date='2022-12-01', checkout_date='2022-12-05', adults=2, children=1)
     """
-    url = f'{os.getenv("CTS_API_V1")}/hotel/{hotelId}/'
+    return await get_hotel_detail(session, hotelId, townId, checkin_date, checkout_date, adults, children, infants, ages, revalidate=revalidate)
 
-    ctsToken = os.getenv("CTS_TOKEN")
-    headers = {'Authorization': f'token {ctsToken}'}
-    currency = 1 if os.getenv('CURRENCY') == 'CLP' else 2
-    json = {'townId': townId, 'checkin': checkin_date, 'checkout': checkout_date, 'rooms': [{'adults': adults, 'children': children, 'infants': infants, 'ages': ages}], 'currency': currency}
-    response = requests.post(url, json=json, headers=headers)
-    result = response.json()
-    return result
-
-def get_booking_details(bookingId) -> list[dict]:
-    url = f'{os.getenv("CTS_API_V1")}/booking/?showOnlyMyBookings=true'
-    ctsToken = os.getenv("CTS_TOKEN")
-    headers = {'Authorization': f'token {ctsToken}', 'origin': 'localhost'}
-    response = requests.get(url, headers=headers).json()
-    response = response['results']
-    for booking in response:
-        if booking['file_number'] == bookingId:
-            result = booking
-    return result
\ No newline at end of file
+async def get_booking_details(session: SessionContext, bookingId) -> Optional[dict]:
+    """
+    Get the booking with the given file number, or None if the agency has no such booking.
+    """
+    return await booking_lookup.find_booking(session, bookingId)
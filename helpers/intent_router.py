@@ -0,0 +1,186 @@
+import os
+import re
+import time
+from typing import Optional
+from langchain_openai import OpenAIEmbeddings
+from helpers.town_directory import normalize_town_name as normalize
+
+# Unambiguous requests skip the primary assistant LLM call and enter the
+# specialized assistant directly; anything else goes to the LLM as before.
+ENABLED = os.getenv("ROUTER_ENABLED", "True") == "True"
+# Embedding similarity over EXAMPLES, for requests the keywords do not settle
+EMBEDDINGS = os.getenv("ROUTER_EMBEDDINGS", "True") == "True"
+EMBEDDING_MODEL = os.getenv("ROUTER_EMBEDDING_MODEL", "text-embedding-3-small")
+# Nearest examples that vote, the share of their similarity the winner needs and the similarity of the closest one
+NEIGHBOURS = int(os.getenv("ROUTER_NEIGHBOURS", 5))
+MIN_VOTE_SHARE = float(os.getenv("ROUTER_MIN_VOTE_SHARE", 0.8))
+MIN_SIMILARITY = float(os.getenv("ROUTER_MIN_SIMILARITY", 0.5))
+
+faiss = None
+if EMBEDDINGS:
+    try:
+        import faiss
+        import numpy as np
+    except ImportError:
+        print("faiss-cpu is not installed: the intent router uses keywords only")
+
+HOTEL = 'hotel'
+EXCURSION = 'excursion'
+OTHER = 'other'
+
+# Whole words (after folding accents and case) that only one assistant handles
+KEYWORDS = {
+    HOTEL: [
+        'hotel', 'hoteles', 'hotels', 'hostal', 'hostel', 'alojamiento', 'alojarme', 'alojarnos', 'hospedaje',
+        'hospedarme', 'hospedagem', 'pousada', 'habitacion', 'habitaciones', 'cuarto', 'quarto', 'quartos',
+        'room', 'rooms', 'suite', 'lodging', 'accommodation', 'check in', 'checkin', 'check out', 'checkout',
+        'cabana', 'cabanas', 'resort', 'apart hotel',
+    ],
+    EXCURSION: [
+        'excursion', 'excursiones', 'excursions', 'excursao', 'excursoes', 'tour', 'tours', 'traslado', 'traslados',
+        'transfer', 'transfers', 'translado', 'transporte', 'transport', 'transportation', 'shuttle', 'paseo',
+        'paseos', 'passeio', 'passeios', 'actividad', 'actividades', 'activity', 'activities', 'trekking',
+        'sightseeing', 'day trip', 'visita guiada', 'guided',
+    ],
+}
+_KEYWORD_PATTERNS = {
+    intent: re.compile(r'\b(?:' + '|'.join(re.escape(word) for word in words) + r')\b')
+    for intent, words in KEYWORDS.items()
+}
+# 'cancel booking 12345': the file numbers of the CTS bookings are handled by the hotel assistant
+_BOOKING_ACTION = re.compile(
+    r'\b(?:cancel|cancelar|anular|cancela|modify|update|change|modificar|cambiar|actualizar|alterar)\b'
+    r'.*\b(?:booking|reservation|reserva|reservacion|file)\b.*\d{3,}'
+)
+
+# Labelled requests for the embedding similarity; benchmarks/router_eval.py measures on a different set
+EXAMPLES = [
+    ('quiero un hotel en Pucón', HOTEL),
+    ('necesito alojamiento en Santiago del 3 al 5 de marzo', HOTEL),
+    ('busco donde dormir en Valparaíso este fin de semana', HOTEL),
+    ('dónde me puedo quedar en San Pedro de Atacama', HOTEL),
+    ('reservar una habitación doble para dos adultos', HOTEL),
+    ('I need a place to stay in Puerto Varas for three nights', HOTEL),
+    ('book me a room in Viña del Mar', HOTEL),
+    ('what hotels are available in Santiago next week', HOTEL),
+    ('cheapest accommodation in Puerto Natales in March', HOTEL),
+    ('preciso de um hotel em Santiago', HOTEL),
+    ('quero me hospedar em Valparaíso', HOTEL),
+    ('cancel booking 12345', HOTEL),
+    ('quiero cancelar mi reserva 88231', HOTEL),
+    ('cambiar la fecha de mi reserva de hotel', HOTEL),
+    ('add a note to my hotel reservation', HOTEL),
+    ('quiero un tour por Santiago', EXCURSION),
+    ('qué excursiones hay en San Pedro de Atacama', EXCURSION),
+    ('necesito un traslado del aeropuerto al hotel', EXCURSION),
+    ('how do I get from the airport to downtown Santiago', EXCURSION),
+    ('I want to visit the geysers del Tatio', EXCURSION),
+    ('book a wine tasting in the Casablanca valley', EXCURSION),
+    ('things to do in Puerto Varas', EXCURSION),
+    ('un paseo a Isla Negra para dos personas', EXCURSION),
+    ('quero um passeio ao Valle Nevado', EXCURSION),
+    ('transfer from Calama airport to San Pedro', EXCURSION),
+    ('recommend me an activity for kids in Santiago', EXCURSION),
+    ('cancel my transfer booking', EXCURSION),
+    ('hola', OTHER),
+    ('good morning', OTHER),
+    ('gracias por la ayuda', OTHER),
+    ('what can you do', OTHER),
+    ('which currency are the prices in', OTHER),
+    ('qué tiempo hace en Santiago en julio', OTHER),
+    ('do I need a visa to travel to Chile', OTHER),
+    ('quiero ir de vacaciones a Chile', OTHER),
+    ('plan a trip for me', OTHER),
+    ('help', OTHER),
+]
+
+embeddings = OpenAIEmbeddings(model=EMBEDDING_MODEL) if EMBEDDINGS and faiss is not None else None
+_index = None
+_labels: list = []
+_stats = {'messages': 0, HOTEL: 0, EXCURSION: 0, 'fallback': 0, 'keyword': 0, 'embedding': 0, 'errors': 0, 'elapsed_ms': 0.0}
+
+
+def classify_keywords(text: str) -> Optional[str]:
+    """The intent whose keywords alone appear in the text, or None."""
+    folded = normalize(text)
+    found = {intent for intent, pattern in _KEYWORD_PATTERNS.items() if pattern.search(folded)}
+    if len(found) == 1:
+        return found.pop()
+    if not found and _BOOKING_ACTION.search(folded):
+        return HOTEL
+    return None
+
+
+async def _build_index():
+    global _index, _labels
+    vectors = np.array(await embeddings.aembed_documents([text for text, _ in EXAMPLES]), dtype='float32')
+    faiss.normalize_L2(vectors)
+    index = faiss.IndexFlatIP(vectors.shape[1])
+    index.add(vectors)
+    _index, _labels = index, [label for _, label in EXAMPLES]
+
+
+async def classify_embedding(text: str) -> Optional[str]:
+    """The intent of the closest examples when they agree and are close enough, or None."""
+    if embeddings is None:
+        return None
+    if _index is None:
+        await _build_index()
+    vector = np.array([await embeddings.aembed_query(text)], dtype='float32')
+    faiss.normalize_L2(vector)
+    similarities, positions = _index.search(vector, min(NEIGHBOURS, len(_labels)))
+    votes = {}
+    for similarity, position in zip(similarities[0], positions[0]):
+        votes[_labels[position]] = votes.get(_labels[position], 0.0) + max(float(similarity), 0.0)
+    winner = max(votes, key=votes.get)
+    if similarities[0][0] < MIN_SIMILARITY or votes[winner] < MIN_VOTE_SHARE * sum(votes.values()):
+        return None
+    return winner
+
+
+async def classify(text: str) -> tuple[str, str]:
+    """
+    Classify a user request.
+
+    Returns:
+    The intent (hotel, excursion or other) and what decided it (keyword,
+    embedding, or fallback when the request must go to the LLM).
+    """
+    intent = classify_keywords(text)
+    if intent is not None:
+        return intent, 'keyword'
+    try:
+        intent = await classify_embedding(text)
+    except Exception as e:
+        _stats['errors'] += 1
+        print(f"Intent router embedding error: {e}")
+        intent = None
+    if intent in (HOTEL, EXCURSION):
+        return intent, 'embedding'
+    return OTHER, 'fallback'
+
+
+async def route(text: str) -> Optional[str]:
+    """The assistant (hotel or excursion) to enter directly, or None to ask the primary assistant."""
+    if not ENABLED or not text.strip():
+        return None
+    start = time.perf_counter()
+    intent, decided_by = await classify(text)
+    _stats['messages'] += 1
+    _stats['elapsed_ms'] += (time.perf_counter() - start) * 1000
+    if decided_by == 'fallback':
+        _stats['fallback'] += 1
+        return None
+    _stats[intent] += 1
+    _stats[decided_by] += 1
+    return intent
+
+
+def stats() -> dict:
+    """Messages routed directly (by intent and by stage), sent to the LLM, and the router time per message."""
+    messages = _stats['messages']
+    return {
+        **{key: value for key, value in _stats.items() if key != 'elapsed_ms'},
+        'routed_rate': round((messages - _stats['fallback']) / messages, 3) if messages else 0.0,
+        'avg_ms': round(_stats['elapsed_ms'] / messages, 2) if messages else 0.0,
+    }
@@ -0,0 +1,254 @@
+import asyncio
+import os
+import time
+import uuid
+from collections import OrderedDict, deque
+from typing import Any, Callable, Optional
+import openai
+from langchain_core.callbacks import AsyncCallbackHandler, BaseCallbackManager
+from langchain_core.messages import convert_to_messages
+from langchain_core.runnables import Runnable, RunnableConfig
+import helpers.context_window as context_window
+
+# Every assistant call goes through here: each attempt has a timeout, failed
+# or empty attempts are retried within a fixed budget, and an attempt that
+# has not produced its first token within the p95 of recent calls can be
+# raced against a second (hedged) request. The OpenAI clients do not retry
+# on their own (max_retries=0), so this is the only retry budget.
+TIMEOUT = float(os.getenv("LLM_TIMEOUT", 60))
+MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", 2))
+RETRY_BACKOFF = float(os.getenv("LLM_RETRY_BACKOFF", 0.5))
+HEDGE = os.getenv("LLM_HEDGE", "False") == "True"
+# Fixed hedging delay; 0 uses the p95 time to first token of the last calls
+HEDGE_AFTER_MS = float(os.getenv("LLM_HEDGE_AFTER_MS", 0))
+HEDGE_MIN_SAMPLES = int(os.getenv("LLM_HEDGE_MIN_SAMPLES", 20))
+LATENCY_WINDOW = 200
+# Outcomes kept for the requests whose chunks may still be in the stream
+OUTCOMES_KEPT = 10000
+
+RETRYABLE = (
+    asyncio.TimeoutError,
+    openai.APIConnectionError,
+    openai.RateLimitError,
+    openai.InternalServerError,
+)
+
+_first_token_ms = deque(maxlen=LATENCY_WINDOW)
+# By the request id in the metadata of its streamed chunks: None while it races, then whether it won
+_outcomes = OrderedDict()
+_stats = {
+    'calls': 0, 'attempts': 0, 'retries': 0, 'timeouts': 0, 'errors': 0, 'empty': 0,
+    'hedges': 0, 'hedge_wins': 0, 'exhausted': 0, 'wasted_tokens': 0,
+}
+
+
+class LLMUnavailable(Exception):
+    """The retry budget of a call was spent without a usable answer."""
+
+
+class _FirstToken(AsyncCallbackHandler):
+    """Marks when one attempt streams its first token, or answers without streaming."""
+
+    def __init__(self):
+        self.event = asyncio.Event()
+        self.tokens = 0
+
+    async def on_llm_new_token(self, token: str, **kwargs: Any):
+        self.tokens += 1
+        self.event.set()
+
+    async def on_llm_end(self, response, **kwargs: Any):
+        self.event.set()
+
+
+def _with_handler(config: RunnableConfig, handler: AsyncCallbackHandler) -> RunnableConfig:
+    callbacks = (config or {}).get("callbacks")
+    if isinstance(callbacks, BaseCallbackManager):
+        callbacks = callbacks.copy()
+        callbacks.add_handler(handler, inherit=True)
+    else:
+        callbacks = [*(callbacks or []), handler]
+    return {**(config or {}), "callbacks": callbacks}
+
+
+def _resolve(request: str, won: Optional[bool]):
+    _outcomes[request] = won
+    _outcomes.move_to_end(request)
+    while len(_outcomes) > OUTCOMES_KEPT:
+        _outcomes.popitem(last=False)
+
+
+def outcome(request: Optional[str]) -> Optional[bool]:
+    """
+    Whether the streamed chunks of a request may reach the user: True once it
+    won, False when it lost the hedge race or failed, None while it races.
+    Chunks without a request id do not come from the governor and may.
+    """
+    if request is None:
+        return True
+    return _outcomes.get(request, False)
+
+
+def _percentile(values, fraction: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(int(len(ordered) * fraction), len(ordered) - 1)] if ordered else 0.0
+
+
+def hedge_after() -> Optional[float]:
+    """Seconds to wait for a first token before hedging, None when hedging is off."""
+    if not HEDGE:
+        return None
+    if HEDGE_AFTER_MS:
+        return HEDGE_AFTER_MS / 1000
+    if len(_first_token_ms) < HEDGE_MIN_SAMPLES:
+        return None
+    return _percentile(_first_token_ms, 0.95) / 1000
+
+
+def _wasted(input: dict, handler: _FirstToken, result=None) -> int:
+    usage = getattr(result, 'usage_metadata', None) or {}
+    if usage:
+        return usage.get('total_tokens', 0)
+    return context_window.estimate_tokens(convert_to_messages(input.get("messages", []))) + handler.tokens
+
+
+async def _attempt(runnable: Runnable, input: dict, config: RunnableConfig):
+    """One attempt, hedged when its first token is late; returns the result of the request that answered first."""
+    started = time.perf_counter()
+    deadline = started + TIMEOUT
+    requests = []
+    ids = {}
+
+    def launch():
+        handler = _FirstToken()
+        request = uuid.uuid4().hex
+        _resolve(request, None)
+        # The id tells the stream which chunks belong to the request that is finally used
+        request_config = _with_handler(config, handler)
+        request_config["metadata"] = {**(request_config.get("metadata") or {}), "llm_request": request}
+        task = asyncio.create_task(runnable.ainvoke(input, request_config))
+        requests.append((task, handler))
+        ids[task] = request
+
+    def failed(task: asyncio.Task) -> bool:
+        return task.done() and (task.cancelled() or task.exception() is not None)
+
+    async def first_token(timeout: Optional[float]):
+        # The first request to stream a token or to answer, None when none did within timeout. A failed
+        # request is dropped while another is still running; the failure is raised once all have failed.
+        until = None if timeout is None else time.perf_counter() + timeout
+        while True:
+            running = [(task, handler) for task, handler in requests if not failed(task)]
+            if not running:
+                return await requests[-1][0]
+            waiters = {asyncio.create_task(handler.event.wait()): (task, handler) for task, handler in running}
+            events = set(waiters)
+            waiters.update({task: (task, handler) for task, handler in running})
+            remaining = None if until is None else max(until - time.perf_counter(), 0)
+            try:
+                done, _ = await asyncio.wait(waiters, timeout=remaining, return_when=asyncio.FIRST_COMPLETED)
+            finally:
+                for event in events:
+                    event.cancel()
+            if not done:
+                return None
+            winner = next((waiters[waiter] for waiter in done if not failed(waiters[waiter][0])), None)
+            if winner is not None:
+                return winner
+
+    launch()
+    try:
+        delay = hedge_after()
+        winner = await first_token(delay if delay is not None else TIMEOUT)
+        if winner is None and delay is not None:
+            _stats['hedges'] += 1
+            launch()
+            winner = await first_token(max(deadline - time.perf_counter(), 0))
+        if winner is None:
+            for _, handler in requests:
+                _stats['wasted_tokens'] += _wasted(input, handler)
+            raise asyncio.TimeoutError()
+        _first_token_ms.append((time.perf_counter() - started) * 1000)
+        task, handler = winner
+        _resolve(ids[task], True)
+        if task is not requests[0][0]:
+            _stats['hedge_wins'] += 1
+        for other, otherHandler in requests:
+            if other is not task:
+                other.cancel()
+                _resolve(ids[other], False)
+                _stats['wasted_tokens'] += _wasted(input, otherHandler)
+        try:
+            return await asyncio.wait_for(task, max(deadline - time.perf_counter(), 0)), handler
+        except asyncio.TimeoutError:
+            _stats['wasted_tokens'] += _wasted(input, handler)
+            raise
+    finally:
+        for task, _ in requests:
+            if not task.done() or failed(task) or _outcomes.get(ids[task]) is None:
+                task.cancel()
+                _resolve(ids[task], False)
+
+
+async def ainvoke(
+    runnable: Runnable,
+    input: dict,
+    config: RunnableConfig,
+    is_empty: Optional[Callable[[Any], bool]] = None,
+    retry_input: Optional[Callable[[dict], dict]] = None,
+    max_retries: Optional[int] = None,
+):
+    """
+    Invoke runnable with a timeout, a bounded number of retries and optional hedging.
+
+    Args:
+    runnable: The prompt and model to invoke.
+    input: Its input, with the messages.
+    config: The config of the node run.
+    is_empty: Whether a result is unusable and must be asked again.
+    retry_input: The input of the attempt after an empty result.
+    max_retries: Retries of this call, LLM_MAX_RETRIES by default.
+
+    Returns:
+    The first usable result; raises LLMUnavailable once the retries are spent.
+    """
+    retries = MAX_RETRIES if max_retries is None else max_retries
+    _stats['calls'] += 1
+    for attempt in range(retries + 1):
+        if attempt:
+            _stats['retries'] += 1
+        _stats['attempts'] += 1
+        try:
+            result, handler = await _attempt(runnable, input, config)
+        except asyncio.TimeoutError:
+            _stats['timeouts'] += 1
+            error = f"no answer within {TIMEOUT:g}s"
+        except RETRYABLE as e:
+            _stats['errors'] += 1
+            error = repr(e)
+        else:
+            if is_empty is None or not is_empty(result):
+                return result
+            _stats['empty'] += 1
+            _stats['wasted_tokens'] += _wasted(input, handler, result)
+            error = "empty answer"
+            if retry_input is not None:
+                input = retry_input(input)
+            # An empty answer is not an outage: ask again right away
+            continue
+        if attempt < retries:
+            await asyncio.sleep(RETRY_BACKOFF * 2 ** attempt)
+    _stats['exhausted'] += 1
+    raise LLMUnavailable(f"The model gave no usable answer after {retries + 1} attempts ({error})")
+
+
+def stats() -> dict:
+    """Calls, attempts, retries, timeouts, hedges and the tokens spent on discarded attempts."""
+    return {
+        **_stats,
+        'first_token_ms': {
+            'p50': round(_percentile(_first_token_ms, 0.5), 1),
+            'p95': round(_percentile(_first_token_ms, 0.95), 1),
+        },
+        'hedge_after_ms': round(hedge_after() * 1000, 1) if hedge_after() is not None else None,
+    }
@@ -0,0 +1,236 @@
+import asyncio
+import gzip
+import os
+import shutil
+from typing import Optional
+
+# Conversation logs are queued in memory and written by one background task,
+# in batches and in a worker thread, so a turn never waits on the disk and an
+# open socket holds no file handle. Finished files (closed conversations, or
+# parts rotated at LOG_MAX_BYTES) are gzipped and handed to a bounded upload
+# queue, retried with backoff, to Cloud Storage or to a local directory.
+LOG_DIR = os.getenv("LOG_DIR", "logs")
+QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", 10000))
+BATCH_SIZE = int(os.getenv("LOG_BATCH_SIZE", 200))
+FLUSH_INTERVAL = float(os.getenv("LOG_FLUSH_INTERVAL", 0.5))
+MAX_BYTES = int(os.getenv("LOG_MAX_BYTES", 5 * 1024 * 1024))
+UPLOAD_QUEUE_SIZE = int(os.getenv("LOG_UPLOAD_QUEUE_SIZE", 1000))
+UPLOAD_WORKERS = int(os.getenv("LOG_UPLOAD_WORKERS", 2))
+UPLOAD_RETRIES = int(os.getenv("LOG_UPLOAD_RETRIES", 5))
+UPLOAD_BACKOFF = float(os.getenv("LOG_UPLOAD_BACKOFF", 1))
+BUCKET_NAME = os.getenv("LOG_BUCKET_NAME", "travel-assistant-logs")
+# A local directory standing in for the bucket, for development and tests
+BUCKET_DIR = os.getenv("LOG_BUCKET_DIR")
+BUCKET_PREFIX = "logs/"
+
+_STOP = object()
+
+
+class LocalBucket:
+    """Filesystem stand-in for the Cloud Storage bucket."""
+
+    def __init__(self, directory: str):
+        self.directory = directory
+
+    def upload(self, path: str, name: str):
+        target = os.path.join(self.directory, name)
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        shutil.copyfile(path, f'{target}.tmp')
+        os.replace(f'{target}.tmp', target)
+
+
+class GCSBucket:
+    def __init__(self, name: str):
+        from google.cloud import storage
+        self.bucket = storage.Client().bucket(name)
+
+    def upload(self, path: str, name: str):
+        self.bucket.blob(name).upload_from_filename(path)
+
+
+def create_bucket():
+    """The upload target: LOG_BUCKET_DIR, else Cloud Storage when ENABLE_STORAGE_LOGS is True, else None (files stay local)."""
+    if BUCKET_DIR:
+        return LocalBucket(BUCKET_DIR)
+    if os.getenv("ENABLE_STORAGE_LOGS") == "True":
+        return GCSBucket(BUCKET_NAME)
+    return None
+
+
+def _compress(path: str) -> str:
+    with open(path, 'rb') as source, gzip.open(f'{path}.gz', 'wb') as target:
+        shutil.copyfileobj(source, target)
+    os.remove(path)
+    return f'{path}.gz'
+
+
+class ConversationLog:
+    """Log of one conversation; writes are queued and never block."""
+
+    def __init__(self, sink: 'LogSink', name: str):
+        self.sink = sink
+        self.name = name
+
+    def write(self, text: str):
+        self.sink.put(self.name, text)
+
+    def close(self):
+        """Flush the log, compress it and queue its upload, in the background."""
+        self.sink.put(self.name, None)
+
+
+class LogSink:
+    def __init__(self, directory: str = LOG_DIR):
+        self.directory = directory
+        self.bucket = None
+        self._records: Optional[asyncio.Queue] = None
+        self._uploads: Optional[asyncio.Queue] = None
+        self._tasks: list = []
+        # Rotated parts per log file; only touched by the writer thread
+        self._parts: dict = {}
+        self._stats = {
+            'records': 0, 'dropped': 0, 'batches': 0, 'bytes_written': 0, 'rotations': 0, 'files_closed': 0,
+            'uploads': 0, 'upload_retries': 0, 'upload_failures': 0, 'upload_dropped': 0,
+        }
+
+    def open(self, name: str) -> ConversationLog:
+        return ConversationLog(self, name)
+
+    def put(self, name: str, text: Optional[str]):
+        if self._records is None:
+            return
+        try:
+            self._records.put_nowait((name, text))
+            self._stats['records'] += 1
+        except asyncio.QueueFull:
+            # Logging never slows a turn down; the record is lost and counted
+            self._stats['dropped'] += 1
+
+    async def start(self):
+        os.makedirs(self.directory, exist_ok=True)
+        self.bucket = create_bucket()
+        self._records = asyncio.Queue(QUEUE_SIZE)
+        self._uploads = asyncio.Queue(UPLOAD_QUEUE_SIZE)
+        self._tasks = [asyncio.create_task(self._writer())]
+        if self.bucket is not None:
+            self._tasks += [asyncio.create_task(self._uploader()) for _ in range(UPLOAD_WORKERS)]
+            # Files left by a previous run that stopped before uploading them
+            for name in sorted(os.listdir(self.directory)):
+                if name.endswith('.gz'):
+                    self._queue_upload(os.path.join(self.directory, name))
+
+    async def stop(self, timeout: float = 10):
+        """Write what is queued, then wait (up to timeout) for the pending uploads."""
+        if self._records is None:
+            return
+        await self._records.put(_STOP)
+        writer, uploaders = self._tasks[0], self._tasks[1:]
+        try:
+            await asyncio.wait_for(writer, timeout)
+            if uploaders:
+                await asyncio.wait_for(self._uploads.join(), timeout)
+        except asyncio.TimeoutError:
+            print("Log sink stopped with pending writes or uploads; they stay in the log directory")
+        for task in uploaders:
+            task.cancel()
+        self._records = None
+
+    async def _writer(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self._records.get()]
+            deadline = loop.time() + FLUSH_INTERVAL
+            while len(batch) < BATCH_SIZE and batch[-1] is not _STOP:
+                try:
+                    batch.append(await asyncio.wait_for(self._records.get(), max(deadline - loop.time(), 0)))
+                except asyncio.TimeoutError:
+                    break
+            stop = batch[-1] is _STOP
+            records = [record for record in batch if record is not _STOP]
+            try:
+                finished = await asyncio.to_thread(self._write_batch, records)
+            except Exception as e:
+                print(f"Error writing conversation logs: {e}")
+                finished = []
+            self._stats['batches'] += 1
+            for path in finished:
+                self._queue_upload(path)
+            if stop:
+                return
+
+    def _write_batch(self, records: list) -> list[str]:
+        """Append the records to their files; returns the compressed files that are ready to upload."""
+        finished = []
+        pending = {}
+        for name, text in records:
+            if text is not None:
+                pending.setdefault(name, []).append(text)
+                continue
+            # The conversation is closed: write what is left and compress the file
+            finished += self._append(name, pending.pop(name, []))
+            path = os.path.join(self.directory, name)
+            self._parts.pop(name, None)
+            if os.path.exists(path):
+                finished.append(_compress(path))
+                self._stats['files_closed'] += 1
+        for name, texts in pending.items():
+            finished += self._append(name, texts)
+        return finished
+
+    def _append(self, name: str, texts: list) -> list[str]:
+        path = os.path.join(self.directory, name)
+        if texts:
+            data = ''.join(texts)
+            with open(path, 'a') as file:
+                file.write(data)
+            self._stats['bytes_written'] += len(data)
+        if not os.path.exists(path) or os.path.getsize(path) < MAX_BYTES:
+            return []
+        part = self._parts[name] = self._parts.get(name, 0) + 1
+        os.replace(path, f'{path}.{part}')
+        self._stats['rotations'] += 1
+        return [_compress(f'{path}.{part}')]
+
+    def _queue_upload(self, path: str):
+        if self.bucket is None:
+            return
+        try:
+            self._uploads.put_nowait(path)
+        except asyncio.QueueFull:
+            # Kept in the log directory; uploaded on the next start
+            self._stats['upload_dropped'] += 1
+
+    async def _uploader(self):
+        while True:
+            path = await self._uploads.get()
+            try:
+                for attempt in range(UPLOAD_RETRIES + 1):
+                    try:
+                        await asyncio.to_thread(self.bucket.upload, path, f'{BUCKET_PREFIX}{os.path.basename(path)}')
+                        os.remove(path)
+                        self._stats['uploads'] += 1
+                        break
+                    except Exception as e:
+                        if attempt == UPLOAD_RETRIES:
+                            self._stats['upload_failures'] += 1
+                            print(f"Error uploading log {path} to the bucket: {e}")
+                        else:
+                            self._stats['upload_retries'] += 1
+                            await asyncio.sleep(UPLOAD_BACKOFF * 2 ** attempt)
+            finally:
+                self._uploads.task_done()
+
+    def stats(self) -> dict:
+        return {
+            **self._stats,
+            'queued': self._records.qsize() if self._records else 0,
+            'upload_queue': self._uploads.qsize() if self._uploads else 0,
+        }
+
+
+sink = LogSink()
+
+
+def stats() -> dict:
+    """Records queued, written and dropped, batches, rotations, and uploads done, retried and failed."""
+    return sink.stats()
@@ -0,0 +1,220 @@
+import os
+import time
+from collections import deque
+from typing import Optional
+import httpx
+from langchain_core.messages import AIMessage, ToolMessage
+from langchain_core.runnables import Runnable
+from langchain_core.tools import BaseTool
+from langchain_core.utils.function_calling import convert_to_openai_tool
+from langchain_openai import ChatOpenAI
+
+# Model of each task type of a graph node. Routing and tool selection use
+# the small model, answers written from tool results the large one; a call
+# of a smaller model that fails or looks unreliable is asked again to
+# ESCALATION_MODEL. LLM_NODE_MODELS pins a node to one model, e.g.
+# "book_hotel=gpt-4o,context_summary=gpt-4o-mini".
+LARGE_MODEL = os.getenv("LLM_LARGE_MODEL", "gpt-4o")
+SMALL_MODEL = os.getenv("LLM_SMALL_MODEL", "gpt-4o-mini")
+TASK_MODELS = {
+    'routing': os.getenv("LLM_MODEL_ROUTING", SMALL_MODEL),
+    'tool_selection': os.getenv("LLM_MODEL_TOOL_SELECTION", SMALL_MODEL),
+    'final_answer': os.getenv("LLM_MODEL_FINAL_ANSWER", LARGE_MODEL),
+    'summarization': os.getenv("LLM_MODEL_SUMMARIZATION", os.getenv("CONTEXT_SUMMARY_MODEL", SMALL_MODEL)),
+}
+NODE_MODELS = dict(
+    pair.strip().split('=', 1) for pair in os.getenv("LLM_NODE_MODELS", "").split(',') if '=' in pair
+)
+ESCALATION_MODEL = os.getenv("LLM_ESCALATION_MODEL", LARGE_MODEL)
+# A booking, update or cancellation proposed by a smaller model is asked again to ESCALATION_MODEL
+ESCALATE_SENSITIVE = os.getenv("LLM_ESCALATE_SENSITIVE", "True") == "True"
+# USD per million input, cached input and output tokens; models are matched by prefix
+PRICES = {
+    'gpt-4o': (2.50, 1.25, 10.00),
+    'gpt-4o-mini': (0.15, 0.075, 0.60),
+    'gpt-4.1': (2.00, 0.50, 8.00),
+    'gpt-4.1-mini': (0.40, 0.10, 1.60),
+    'gpt-4.1-nano': (0.10, 0.025, 0.40),
+}
+LATENCY_WINDOW = 200
+
+# One connection pool for every model
+_http_client: Optional[httpx.AsyncClient] = None
+_models: dict = {}
+_nodes: dict = {}
+
+
+def _node_stats(node: str) -> dict:
+    if node not in _nodes:
+        _nodes[node] = {
+            'calls': 0, 'escalations': 0, 'escalation_reasons': {}, 'models': {},
+            'input_tokens': 0, 'cached_tokens': 0, 'output_tokens': 0, 'cost_usd': 0.0,
+            'latency_ms': deque(maxlen=LATENCY_WINDOW),
+        }
+    return _nodes[node]
+
+
+def http_client() -> httpx.AsyncClient:
+    global _http_client
+    if _http_client is None:
+        _http_client = httpx.AsyncClient(
+            limits=httpx.Limits(
+                max_connections=int(os.getenv("LLM_POOL_MAX_CONNECTIONS", 100)),
+                max_keepalive_connections=int(os.getenv("LLM_POOL_MAX_KEEPALIVE", 20)),
+            ),
+        )
+    return _http_client
+
+
+def chat_model(model: str) -> ChatOpenAI:
+    """The chat model of that name, on the shared connection pool; retries are left to helpers/llm_governor.py."""
+    if model not in _models:
+        _models[model] = ChatOpenAI(model=model, temperature=0, max_retries=0, http_async_client=http_client())
+    return _models[model]
+
+
+def model_for(node: str, task: str) -> str:
+    return NODE_MODELS.get(node) or TASK_MODELS[task]
+
+
+def _tool_name(tool) -> str:
+    return tool.name if isinstance(tool, BaseTool) else convert_to_openai_tool(tool)['function']['name']
+
+
+def _tool_schema(tool):
+    return tool.tool_call_schema if isinstance(tool, BaseTool) else tool
+
+
+class NodeModels:
+    """
+    The prompt and tools of one graph node, bound to whichever model a call
+    uses, and the checks that send a smaller model's answer to the escalation model.
+    """
+
+    def __init__(
+        self,
+        node: str,
+        prompt: Runnable,
+        tools: list,
+        sensitive_tools: tuple = (),
+        exclusive_tools: tuple = (),
+        routing: bool = False,
+    ):
+        self.node = node
+        # Every call of a routing node is a routing task
+        self.routing = routing
+        self.prompt = prompt
+        self.tools = tools
+        self.schemas = {_tool_name(tool): _tool_schema(tool) for tool in tools}
+        self.sensitive = {_tool_name(tool) for tool in sensitive_tools}
+        # Tools of which one answer may call only one, like the hand-offs to the specialists
+        self.exclusive = {_tool_name(tool) for tool in exclusive_tools}
+        self._runnables = {}
+
+    def runnable(self, model: str) -> Runnable:
+        if model not in self._runnables:
+            self._runnables[model] = self.prompt | chat_model(model).bind_tools(self.tools)
+        return self._runnables[model]
+
+    def task_for(self, messages: list) -> str:
+        """
+        The task of a call: a final answer when it reads the results of the
+        node's own tools, else a tool selection (a user message, or a hand-off
+        from another node).
+        """
+        if self.routing:
+            return 'routing'
+        if not messages or not isinstance(messages[-1], ToolMessage):
+            return 'tool_selection'
+        caller = next((message for message in reversed(messages) if isinstance(message, AIMessage) and message.tool_calls), None)
+        if caller is not None and any(call['name'] in self.schemas for call in caller.tool_calls):
+            return 'final_answer'
+        return 'tool_selection'
+
+    def model_for(self, messages: list) -> tuple[str, str]:
+        """The task of a call with these messages, and its model."""
+        task = self.task_for(messages)
+        return task, model_for(self.node, task)
+
+    def escalation_reason(self, result) -> Optional[str]:
+        """Why an answer of a smaller model should be asked again to the escalation model, None to keep it."""
+        if getattr(result, 'invalid_tool_calls', None):
+            return 'invalid_tool_call'
+        names = [call['name'] for call in result.tool_calls]
+        if any(name not in self.schemas for name in names):
+            return 'unknown_tool'
+        if len(set(names) & self.exclusive) > 1:
+            return 'ambiguous_route'
+        for call in result.tool_calls:
+            try:
+                self.schemas[call['name']].model_validate(call['args'])
+            except Exception:
+                return 'invalid_arguments'
+        if ESCALATE_SENSITIVE and self.sensitive & set(names):
+            return 'sensitive_tool'
+        return None
+
+
+def price(model: str, usage: dict) -> float:
+    """Cost in USD of one call from its usage metadata; 0 for a model without a price."""
+    prices = next((PRICES[name] for name in sorted(PRICES, key=len, reverse=True) if model.startswith(name)), None)
+    if prices is None or not usage:
+        return 0.0
+    cached = (usage.get('input_token_details') or {}).get('cache_read', 0) or 0
+    return (
+        (usage.get('input_tokens', 0) - cached) * prices[0]
+        + cached * prices[1]
+        + usage.get('output_tokens', 0) * prices[2]
+    ) / 1_000_000
+
+
+def record_call(node: str, model: str, result=None):
+    """Count one model call of a node, with its tokens and cost when it answered."""
+    stats = _node_stats(node)
+    stats['models'][model] = stats['models'].get(model, 0) + 1
+    usage = getattr(result, 'usage_metadata', None) or {}
+    stats['input_tokens'] += usage.get('input_tokens', 0)
+    stats['cached_tokens'] += (usage.get('input_token_details') or {}).get('cache_read', 0) or 0
+    stats['output_tokens'] += usage.get('output_tokens', 0)
+    stats['cost_usd'] += price(model, usage)
+
+
+def record_node(node: str, started: float, escalation: Optional[str] = None):
+    """Count one run of a node, with its latency (escalation included) and why it escalated."""
+    stats = _node_stats(node)
+    stats['calls'] += 1
+    stats['latency_ms'].append((time.perf_counter() - started) * 1000)
+    if escalation:
+        stats['escalations'] += 1
+        stats['escalation_reasons'][escalation] = stats['escalation_reasons'].get(escalation, 0) + 1
+
+
+def _percentile(values, fraction: float) -> float:
+    ordered = sorted(values)
+    return round(ordered[min(int(len(ordered) * fraction), len(ordered) - 1)], 1) if ordered else 0.0
+
+
+async def aclose():
+    """Close the shared connection pool, at shutdown."""
+    global _http_client
+    if _http_client is not None:
+        await _http_client.aclose()
+        _http_client = None
+
+
+def stats() -> dict:
+    """Per node: runs, latency, escalations and their reasons, model calls, tokens, cached token ratio and cost."""
+    return {
+        'task_models': TASK_MODELS,
+        'escalation_model': ESCALATION_MODEL,
+        'nodes': {
+            node: {
+                **{key: value for key, value in stats.items() if key != 'latency_ms'},
+                'cost_usd': round(stats['cost_usd'], 6),
+                # Share of the input tokens served from the provider's prompt cache
+                'cached_token_ratio': round(stats['cached_tokens'] / stats['input_tokens'], 3) if stats['input_tokens'] else 0.0,
+                'latency_ms': {'p50': _percentile(stats['latency_ms'], 0.5), 'p95': _percentile(stats['latency_ms'], 0.95)},
+            }
+            for node, stats in _nodes.items()
+        },
+    }
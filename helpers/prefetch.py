@@ -0,0 +1,95 @@
+import asyncio
+import os
+from typing import Callable
+from langchain_core.runnables import RunnableConfig
+import helpers.compact_output as compact_output
+import helpers.hotel_helper as hotel_helper
+from helpers.session import SessionContext, get_session_context
+
+# While the model reads a tool result and writes its reply, the CTS calls the
+# user is most likely to trigger next are started in the background, so the
+# next tool call finds them in the cache.
+ENABLED = os.getenv("PREFETCH_ENABLED", "True") == "True"
+# Results of a listing whose details are warmed
+TOP_N = int(os.getenv("PREFETCH_TOP_N", 3))
+# Speculative calls started for one tool message, and in flight across all conversations
+MAX_PER_MESSAGE = int(os.getenv("PREFETCH_MAX_PER_MESSAGE", 6))
+MAX_IN_FLIGHT = int(os.getenv("PREFETCH_MAX_IN_FLIGHT", 20))
+
+_rules: dict = {}
+_tasks: set = set()
+_stats = {'scheduled': 0, 'skipped_budget': 0, 'failed': 0}
+
+
+def rule(tool_name: str) -> Callable:
+    """
+    Register the prefetch rule of a tool: a function of (session, tool args)
+    returning the coroutine functions of the calls likely to follow it.
+    """
+    def register(function: Callable) -> Callable:
+        _rules[tool_name] = function
+        return function
+    return register
+
+
+@rule('get_availability_for_hotels')
+def _hotel_details(session: SessionContext, args: dict) -> list:
+    # The user picks one of the hotels just shown: warm their detail, which backs both the info and the rooms
+    rooms = hotel_helper.room_list(args.get('adults'), args.get('children'), args.get('infants'), args.get('ages'))
+    search = hotel_helper.cached_search(session, args.get('townId'), args.get('checkin_date'), args.get('checkout_date'), rooms)
+    if search is None:
+        return []
+    hotels = search.filter(
+        max_price=args.get('max_price'), min_stars=args.get('min_stars'), amenities=args.get('amenities'),
+        category=args.get('category'), sort_by=args.get('sort_by'),
+    )
+    shown, _, _ = compact_output.page(hotels, args.get('limit'), args.get('offset'))
+    return [
+        lambda hotelId=hotel['id']: hotel_helper.get_hotel_detail(
+            session, str(hotelId), args.get('townId'), args.get('checkin_date'), args.get('checkout_date'),
+            args.get('adults', 1), args.get('children', 0), args.get('infants', 0), args.get('ages', []), speculative=True,
+        )
+        for hotel in shown[:TOP_N]
+    ]
+
+
+async def _run(fetch: Callable):
+    try:
+        await fetch()
+    except Exception:
+        _stats['failed'] += 1
+
+
+def schedule(config: RunnableConfig, tool_calls: list):
+    """
+    Start, in the background, the prefetches of the tool calls that just ran.
+
+    Args:
+    config: The config of the tool node, for the session.
+    tool_calls: The tool calls of the message, with their name and args.
+    """
+    if not ENABLED:
+        return
+    session = get_session_context(config)
+    fetches = []
+    for call in tool_calls:
+        function = _rules.get(call['name'])
+        if function is None:
+            continue
+        try:
+            fetches += function(session, call['args'])
+        except Exception:
+            _stats['failed'] += 1
+    for i, fetch in enumerate(fetches):
+        if i >= MAX_PER_MESSAGE or len(_tasks) >= MAX_IN_FLIGHT:
+            _stats['skipped_budget'] += 1
+            continue
+        _stats['scheduled'] += 1
+        task = asyncio.create_task(_run(fetch))
+        _tasks.add(task)
+        task.add_done_callback(_tasks.discard)
+
+
+def stats() -> dict:
+    """Speculative calls started, dropped over budget and failed, and the calls still in flight."""
+    return {**_stats, 'in_flight': len(_tasks)}
@@ -0,0 +1,182 @@
+import os
+import re
+import time
+from typing import Optional
+from langchain_core.messages import AIMessage, BaseMessage, HumanMessage
+from langchain_core.runnables import RunnableConfig
+from langchain_openai import OpenAIEmbeddings
+import helpers.excursion_helper as excursion_helper
+import helpers.hotel_helper as hotel_helper
+from helpers.session import get_session_context
+from helpers.town_directory import normalize_town_name as normalize
+
+# Answers to general, self-contained questions ('do excursions allow
+# children?') are reused for similar questions in the same language and
+# currency, without calling the LLM. Booking, update and cancel requests,
+# and questions that point back at the conversation, are never cached; an
+# answer is only stored when it was read from the catalog description tools.
+ENABLED = os.getenv("SEMANTIC_CACHE_ENABLED", "True") == "True"
+EMBEDDING_MODEL = os.getenv("SEMANTIC_CACHE_EMBEDDING_MODEL", "text-embedding-3-small")
+# Cosine similarity a question needs with a cached one to reuse its answer
+MIN_SIMILARITY = float(os.getenv("SEMANTIC_CACHE_MIN_SIMILARITY", 0.92))
+TTL = float(os.getenv("SEMANTIC_CACHE_TTL", 3600))
+MAX_ENTRIES = int(os.getenv("SEMANTIC_CACHE_SIZE", 1000))
+MAX_QUESTION_CHARS = 300
+
+# Tools an answer may be based on, with the cache of the catalog data they read:
+# the answer expires with that data
+CATALOG_TOOLS = {
+    'get_excursion_or_transfer_description': excursion_helper.availability_cache,
+    'get_excursion_or_transfer_options_avilable': excursion_helper.availability_cache,
+    'get_hotel_info': hotel_helper.hotel_detail_cache,
+}
+# Calls that only move the dialog between assistants, whatever the answer is read from
+DIALOG_TOOLS = {'ToHotelBookingAssistant', 'ToBookExcursion', 'CompleteOrEscalate'}
+_EXCLUDED = re.compile(
+    r'\b(?:'
+    # Booking, update and cancel flows
+    r'book|booking|bookings|reserve|reservation|reserva|reservas|reservar|reservacion|cancel|cancelar|anular|'
+    r'update|modify|change|modificar|cambiar|actualizar|alterar|confirm|confirmo|confirmar|pagar|pay|'
+    # References to earlier messages, which make the question depend on the conversation
+    r'first|second|third|last|this|that|these|those|it|there|primero|primera|segundo|segunda|tercero|tercera|'
+    r'ultimo|ultima|este|esta|esto|ese|esa|eso|aquel|ahi|alli|mismo|misma|esse|essa|isso|dele|dela'
+    r')\b'
+)
+
+embeddings = OpenAIEmbeddings(model=EMBEDDING_MODEL) if ENABLED else None
+faiss = None
+if ENABLED:
+    try:
+        import faiss
+        import numpy as np
+    except ImportError:
+        print("faiss-cpu is not installed: the semantic cache is disabled")
+
+# One index per (token scope, language, currency), and the entries by faiss id
+_indexes: dict = {}
+_entries: dict = {}
+_next_id = 0
+_stats = {'lookups': 0, 'hits': 0, 'misses': 0, 'skipped': 0, 'stored': 0, 'evictions': 0, 'expired': 0, 'errors': 0, 'saved_ms': 0.0}
+
+
+def eligible(question: str) -> bool:
+    """Whether a question may be answered from, or stored in, the cache."""
+    folded = normalize(question)
+    return (
+        0 < len(question) <= MAX_QUESTION_CHARS
+        and len(folded.split()) >= 3
+        and not any(character.isdigit() for character in folded)
+        and not _EXCLUDED.search(folded)
+    )
+
+
+def _partition(config: RunnableConfig) -> tuple:
+    session = get_session_context(config)
+    return (session.token_scope, session.language, session.currency_id)
+
+
+async def _embed(question: str):
+    vector = np.array([await embeddings.aembed_query(normalize(question))], dtype='float32')
+    faiss.normalize_L2(vector)
+    return vector
+
+
+def _remove(entryId: int):
+    entry = _entries.pop(entryId)
+    _indexes[entry['partition']].remove_ids(np.array([entryId], dtype='int64'))
+
+
+async def lookup(question: str, config: RunnableConfig) -> Optional[str]:
+    """The cached answer of a similar question, or None."""
+    if embeddings is None or faiss is None:
+        return None
+    if not eligible(question):
+        _stats['skipped'] += 1
+        return None
+    _stats['lookups'] += 1
+    index = _indexes.get(_partition(config))
+    if index is None or index.ntotal == 0:
+        _stats['misses'] += 1
+        return None
+    start = time.perf_counter()
+    try:
+        similarities, ids = index.search(await _embed(question), 1)
+    except Exception as e:
+        _stats['errors'] += 1
+        print(f"Semantic cache lookup error: {e}")
+        return None
+    entry = _entries.get(int(ids[0][0]))
+    if entry is not None and entry['expires_at'] <= time.monotonic():
+        _remove(int(ids[0][0]))
+        _stats['expired'] += 1
+        entry = None
+    if entry is None or similarities[0][0] < MIN_SIMILARITY:
+        _stats['misses'] += 1
+        return None
+    entry['last_used'] = time.monotonic()
+    _stats['hits'] += 1
+    _stats['saved_ms'] += max(entry['elapsed_ms'] - (time.perf_counter() - start) * 1000, 0.0)
+    return entry['answer']
+
+
+async def remember(messages: list[BaseMessage], config: RunnableConfig, elapsed_ms: float):
+    """
+    Store the answer of the last turn when it is a cacheable question.
+
+    Args:
+    messages: The messages of the conversation, ending with the answer.
+    config: The config of the run, for the session.
+    elapsed_ms: How long the turn took, reported as saved on every hit.
+    """
+    global _next_id
+    if embeddings is None or faiss is None or not messages:
+        return
+    answer = messages[-1]
+    if not isinstance(answer, AIMessage) or answer.tool_calls or not answer.content or answer.response_metadata.get('semantic_cache'):
+        return
+    last = next((i for i in range(len(messages) - 1, -1, -1) if isinstance(messages[i], HumanMessage)), None)
+    if last is None or not isinstance(messages[last].content, str) or not eligible(messages[last].content):
+        return
+    # Only answers read from the catalog description tools in this turn; an
+    # answer without any tool may come from the conversation itself
+    tools = {call['name'] for message in messages[last + 1:] for call in getattr(message, 'tool_calls', None) or []}
+    tools -= DIALOG_TOOLS
+    if not tools or not tools <= CATALOG_TOOLS.keys():
+        return
+    ttl = min([TTL] + [CATALOG_TOOLS[tool].ttl for tool in tools])
+    try:
+        vector = await _embed(messages[last].content)
+    except Exception as e:
+        _stats['errors'] += 1
+        print(f"Semantic cache store error: {e}")
+        return
+    partition = _partition(config)
+    index = _indexes.get(partition)
+    if index is None:
+        index = _indexes[partition] = faiss.IndexIDMap2(faiss.IndexFlatIP(vector.shape[1]))
+    entryId = _next_id
+    _next_id += 1
+    index.add_with_ids(vector, np.array([entryId], dtype='int64'))
+    now = time.monotonic()
+    _entries[entryId] = {
+        'partition': partition,
+        'answer': answer.content,
+        'expires_at': now + ttl,
+        'last_used': now,
+        'elapsed_ms': elapsed_ms,
+    }
+    _stats['stored'] += 1
+    while len(_entries) > MAX_ENTRIES:
+        _remove(min(_entries, key=lambda entryId: _entries[entryId]['last_used']))
+        _stats['evictions'] += 1
+
+
+def stats() -> dict:
+    """Lookups, hits and misses, questions not eligible, stored answers and the turn time saved by hits."""
+    lookups = _stats['lookups']
+    return {
+        **{key: value for key, value in _stats.items() if key != 'saved_ms'},
+        'entries': len(_entries),
+        'hit_rate': round(_stats['hits'] / lookups, 3) if lookups else 0.0,
+        'saved_ms': round(_stats['saved_ms'], 1),
+    }
@@ -0,0 +1,44 @@
+import hashlib
+from dataclasses import dataclass
+from typing import Optional
+from langchain_core.runnables import RunnableConfig
+
+
+@dataclass(frozen=True)
+class SessionContext:
+    """
+    Values that belong to a single conversation (WebSocket session).
+
+    They travel with the graph run inside RunnableConfig["configurable"],
+    so concurrent conversations in the same process never see each
+    other's currency, language or CTS token.
+    """
+    thread_id: Optional[str] = None
+    currency: Optional[str] = None
+    language: Optional[str] = None
+    cts_token: Optional[str] = None
+
+    @property
+    def currency_id(self) -> int:
+        """Currency code expected by the CTS API (1 = CLP, 2 = USD)."""
+        return 1 if self.currency == 'CLP' else 2
+
+    @property
+    def token_scope(self) -> str:
+        """Short fingerprint of the CTS token, to key shared caches per agency without storing the token."""
+        return hashlib.sha256(str(self.cts_token).encode()).hexdigest()[:16]
+
+    @property
+    def headers(self) -> dict:
+        return {'Authorization': f'token {self.cts_token}'}
+
+
+def get_session_context(config: Optional[RunnableConfig]) -> SessionContext:
+    """Build the session context from the configurable values of a graph run."""
+    configurable = (config or {}).get("configurable", {})
+    return SessionContext(
+        thread_id=configurable.get("thread_id"),
+        currency=configurable.get("currency"),
+        language=configurable.get("language"),
+        cts_token=configurable.get("cts_token"),
+    )
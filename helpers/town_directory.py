@@ -0,0 +1,157 @@
+import asyncio
+import os
+import time
+import unicodedata
+from bisect import bisect_left
+from collections import defaultdict
+from typing import Callable, Optional
+import helpers.cts_client as cts_client
+from helpers.session import SessionContext
+
+DEFAULT_DTT_CITY_URL = 'https://apibooking.ctsturismo.com/api/city/dtt/?q='
+
+
+def normalize_town_name(name: str) -> str:
+    """Fold accents, case, punctuation and repeated whitespace ('Pucón ' -> 'pucon')."""
+    folded = unicodedata.normalize('NFKD', str(name))
+    folded = ''.join(c for c in folded if not unicodedata.combining(c)).casefold()
+    folded = ''.join(c if c.isalnum() else ' ' for c in folded)
+    return ' '.join(folded.split())
+
+
+def _trigrams(text: str) -> set:
+    padded = f'  {text} '
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class _Index:
+    def __init__(self, towns: list, name_key: str):
+        self.towns = towns
+        self.by_name = {}
+        self.names = []
+        self.trigrams = defaultdict(set)
+        self.town_trigrams = []
+        for i, town in enumerate(towns):
+            name = normalize_town_name(town[name_key])
+            self.by_name.setdefault(name, town)
+            self.names.append((name, i))
+            grams = _trigrams(name)
+            self.town_trigrams.append(grams)
+            for gram in grams:
+                self.trigrams[gram].add(i)
+        self.names.sort()
+
+    def prefixed(self, name: str) -> list:
+        """Positions of the towns whose normalized name starts with name."""
+        start = bisect_left(self.names, (name, -1))
+        result = []
+        for town_name, i in self.names[start:]:
+            if not town_name.startswith(name):
+                break
+            result.append(i)
+        return result
+
+
+class TownDirectory:
+    """
+    In-memory index of one CTS city catalog.
+
+    The catalog is downloaded once, kept for `ttl` seconds and then
+    refreshed in the background while lookups keep being served from the
+    previous copy, so a lookup never waits on the CTS API except for the
+    very first load.
+    """
+
+    def __init__(self, url: Callable[[], str], id_key: str, name_key: str, ttl: Optional[float] = None):
+        self.url = url
+        self.id_key = id_key
+        self.name_key = name_key
+        self.ttl = ttl if ttl is not None else float(os.getenv("TOWN_DIRECTORY_TTL", 24 * 60 * 60))
+        self._index: Optional[_Index] = None
+        self._loaded_at = 0.0
+        self._refresh_task: Optional[asyncio.Task] = None
+
+    def is_stale(self) -> bool:
+        return self._index is None or time.monotonic() - self._loaded_at > self.ttl
+
+    async def ensure_loaded(self, session: SessionContext):
+        """Load the catalog on first use and schedule a refresh once it expires."""
+        if self._index is None:
+            if self._refresh_task is None:
+                self._refresh_task = asyncio.create_task(self._refresh(session))
+            await asyncio.shield(self._refresh_task)
+        elif self.is_stale() and self._refresh_task is None:
+            self._refresh_task = asyncio.create_task(self._refresh_in_background(session))
+
+    async def _refresh(self, session: SessionContext):
+        try:
+            response = await cts_client.request(session, 'GET', self.url(), endpoint='city')
+            response.raise_for_status()
+            self._index = _Index(response.json(), self.name_key)
+            self._loaded_at = time.monotonic()
+        finally:
+            self._refresh_task = None
+
+    async def _refresh_in_background(self, session: SessionContext):
+        try:
+            await self._refresh(session)
+        except Exception as e:
+            # Keep serving the previous catalog, it will be retried on the next lookup
+            print(f"Error refreshing town directory {self.url()}: {e}")
+
+    def all_towns(self) -> list[dict]:
+        """Every town of the catalog, empty until it is loaded."""
+        return list(self._index.towns) if self._index is not None else []
+
+    def lookup(self, townName: str) -> Optional[dict]:
+        """Return the town matching the name exactly, or by a unique prefix."""
+        if self._index is None:
+            return None
+        name = normalize_town_name(townName)
+        if not name:
+            return None
+        town = self._index.by_name.get(name)
+        if town is not None:
+            return town
+        prefixed = self._index.prefixed(name)
+        if len(prefixed) == 1:
+            return self._index.towns[prefixed[0]]
+        return None
+
+    def closest(self, townName: str, k: int = 10) -> list[dict]:
+        """Return the k towns closest to the name, ranked by prefix and trigram similarity."""
+        if self._index is None:
+            return []
+        name = normalize_town_name(townName)
+        grams = _trigrams(name)
+        candidates = set()
+        for gram in grams:
+            candidates |= self._index.trigrams.get(gram, set())
+        prefixed = set(self._index.prefixed(name)) if name else set()
+        candidates |= prefixed
+
+        def score(i):
+            town_grams = self._index.town_trigrams[i]
+            similarity = len(grams & town_grams) / len(grams | town_grams)
+            return similarity + (1 if i in prefixed else 0)
+
+        ranked = sorted(candidates, key=score, reverse=True)[:k]
+        return [self._index.towns[i] for i in ranked]
+
+    def town_id(self, town: dict):
+        return town[self.id_key]
+
+    def town_name(self, town: dict) -> str:
+        return town[self.name_key]
+
+
+hotel_towns = TownDirectory(
+    url=lambda: os.getenv("CTS_DTT_CITY_URL", DEFAULT_DTT_CITY_URL),
+    id_key='dtt_id',
+    name_key='display_name',
+)
+excursion_towns = TownDirectory(
+    url=lambda: f'{os.getenv("CTS_API_V2")}/city/',
+    id_key='id',
+    name_key='name',
+)
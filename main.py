@@ -2,15 +2,27 @@ from fastapi import FastAPI, HTTPException, WebSocket, WebSocketDisconnect
 from datetime import datetime
 from pydantic import BaseModel
 from langgraph.graph import StateGraph
-from graph import part_4_graph
+from graph import part_4_graph, memory, pending_approval
+import asyncio
 import uuid
 import json
 import os
 from state import State
-from langchain_core.messages import ToolMessage, AIMessage
-from utilities import _print_event, print_action
+from langchain_core.messages import ToolMessage, AIMessage, AIMessageChunk
+from utilities import _print_event, print_action, MessageCursor, DeltaFilter, drop_session
 from fastapi.middleware.cors import CORSMiddleware
-from google.cloud import storage
+from contextlib import asynccontextmanager
+import helpers.cts_client as cts_client
+import helpers.cache as cache
+import helpers.context_window as context_window
+import helpers.prefetch as prefetch
+import helpers.intent_router as intent_router
+import helpers.semantic_cache as semantic_cache
+import helpers.catalog as catalog
+import helpers.log_sink as log_sink
+import helpers.llm_governor as llm_governor
+import helpers.model_registry as model_registry
+import time
 from dotenv import load_dotenv
 
 
@@ -23,8 +35,40 @@ openai_api_key = os.getenv("OPENAI_API_KEY")
 # Use the API key in your application
 
 
+async def evict_idle_threads():
+    # Drop conversations nobody has written to in CHECKPOINT_IDLE_TTL seconds
+    idle_ttl = float(os.getenv("CHECKPOINT_IDLE_TTL", 3600))
+    interval = float(os.getenv("CHECKPOINT_EVICT_INTERVAL", 300))
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            evicted = await memory.aevict_idle(idle_ttl)
+            for thread_id in evicted:
+                drop_session(thread_id)
+            if evicted:
+                print(f"Evicted {len(evicted)} idle conversation threads")
+        except Exception as e:
+            print(f"Error evicting idle threads: {e}")
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    eviction_task = asyncio.create_task(evict_idle_threads())
+    # Memory-map the excursion catalog snapshot, when build_catalog.py has built one
+    catalog.load()
+    # Conversation logs are written and uploaded in the background
+    await log_sink.sink.start()
+    yield
+    eviction_task.cancel()
+    # Write the queued log lines and wait for the pending uploads
+    await log_sink.sink.stop()
+    # Release the pooled CTS and OpenAI connections
+    await cts_client.aclose()
+    await model_registry.aclose()
+
+
 # Create the FastAPI application
-app = FastAPI()
+app = FastAPI(lifespan=lifespan)
 
 # Configure CORS
 app.add_middleware(
@@ -39,128 +83,161 @@ app.add_middleware(
 conversation_history = []
 sessions = {}
 
-# Configure the Google Cloud Storage client
-storage_client = storage.Client() if os.getenv("ENABLE_STORAGE_LOGS") == "True" else None
-bucket_name = "travel-assistant-logs"
+# Nodes whose model output is streamed to the client as "delta" frames
+STREAMED_NODES = {"primary_assistant", "book_hotel", "book_excursion"}
+STREAM_DELTAS = os.getenv("STREAM_DELTAS", "True") == "True"
 
 class Message(BaseModel):
     content: str
 
+@app.get("/metrics")
+async def metrics():
+    # Hit/miss counters of the in-process caches, CTS request coalescing, prefetching, intent routing, prompt size accounting, LLM retries and hedging, per-node model latency and cost, and the log pipeline
+    return {
+        "caches": cache.all_stats(),
+        "cts": cts_client.stats(),
+        "prefetch": prefetch.stats(),
+        "router": intent_router.stats(),
+        "semantic_cache": semantic_cache.stats(),
+        "context": context_window.stats(),
+        "llm": llm_governor.stats(),
+        "models": model_registry.stats(),
+        "logs": log_sink.stats(),
+    }
+
 @app.websocket("/chat")
 async def chat(websocket: WebSocket):
     await websocket.accept()
     # Create a unique identifier for each session
     thread_id = str(uuid.uuid4())
     # Initialize the graph configuration for this session
-    last_message = []
+    cursor = MessageCursor()
+    _printed = set()
 
-    # Create log conversation log file
+    # Create the conversation log; its lines are queued, never written inline
     current_time = datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
-    log_filename = f"logs/{current_time}_conversation_{thread_id}.log"
-    log_path = os.path.join(os.getcwd(), log_filename)
+    log_file = log_sink.sink.open(f"{current_time}_conversation_{thread_id}.log")
+
+    async def run_graph(graph_input, config):
+        """
+        Run the graph, sending its new answers to the client.
+
+        Returns:
+        The last state of the run, and the message waiting for the user's approval (None when the run finished).
+        """
+        # Stream answer tokens as they are generated, then the complete message once the node finishes;
+        # "updates" tells which node ran last, to detect the approval interrupt without reading the state again
+        modes = ["messages", "updates", "values"] if STREAM_DELTAS else ["updates", "values"]
+        state, node = None, None
+        # Text of tool-call messages, and of hedged or retried requests that were not used, is held back
+        deltas = DeltaFilter()
+
+        async def send_deltas(ready: list):
+            for delta in ready:
+                await websocket.send_json({"type": "delta", "id": delta.id, "content": delta.content})
+            # The client drops the text it got from a request that failed midway; the retry streams again
+            for run in deltas.retracted():
+                await websocket.send_json({"type": "discard", "id": run})
+
+        async for mode, chunk in part_4_graph.astream(graph_input, config, stream_mode=modes):
+            if mode == "messages":
+                message_chunk, metadata = chunk
+                ready = []
+                if (
+                    isinstance(message_chunk, AIMessageChunk)
+                    and metadata.get("langgraph_node") in STREAMED_NODES
+                    and not metadata.get("context_summary")
+                ):
+                    ready = deltas.push(message_chunk, metadata.get("llm_request"))
+                await send_deltas(ready)
+                continue
+            # Chunks of requests that won after their last chunk came in
+            await send_deltas(deltas.flush())
+            if mode == "updates":
+                node = next(iter(chunk), node)
+                continue
+            state = chunk
+            print_event = _print_event(chunk, _printed)
+            log_file.write(f"{print_event}\n")
+            # Only the messages added since the last state
+            for message in cursor.advance(chunk.get('messages', [])):
+                if isinstance(message, AIMessage) and message.content:
+                    await websocket.send_json({"type": "text", "id": message.id, "content": message.content})
+        return state, pending_approval(node, state) if state else None
 
     try:
-        with open(log_path, "a") as log_file:
-            while True:
-                # Receive the user's message through the WebSocket
-                data = await websocket.receive_text()
-                json_data = json.loads(data)
-                message = json_data.get("message")
-                currency = json_data.get("currency")
-                os.environ["CURRENCY"] = currency
-                language = json_data.get("language")
-                os.environ["LANGUAGE"] = language
-                token = json_data.get("token")
-                os.environ["CTS_TOKEN"] = token
-                config = {"configurable": {"thread_id": thread_id, "language": language, "currency": currency}}
-                _printed = set()
-                try:
-                    events = part_4_graph.stream(
-                        {"messages": [{"role": "user", "type": "text", "content": message}]}, config, stream_mode="values"
-                    )
-                    for event in events:
-                        print_event = _print_event(event, _printed)
-                        log_file.write(f"{print_event}\n")
-                        log_file.flush()
-                        for message in event.get('messages', []):
-                            if isinstance(message, AIMessage) and message.content:
-                                response = {"type": "text", "content": message.content}
-                                if response not in last_message:
-                                    await websocket.send_json(response)
-                                    last_message.append(response)
-                    snapshot = part_4_graph.get_state(config)
-                    while snapshot.next:
-                        # Inform the frontend about the interruption and the need for user approval
-                        content_english = "You are about do an action on your booking request. Are you sure you want to continue?"
-                        content_spanish = "Estás a punto de realizar una acción sobre tu reserva ¿Estás seguro que deseas continuar?"
-                        content = content_spanish if language == "Spanish" else content_english
-                        print_event = print_action("Approval Needed", content)
-                        log_file.write(f"{print_event}\n\n")
-                        log_file.flush()
-                        await websocket.send_json({
-                            "type": "approval_needed",
-                            "content": content,
-                        })
-
-                        # Wait for the user's response from the frontend
-                        data = await websocket.receive_text()
-                        json_data = json.loads(data)
-                        user_input = json_data.get("message")
-                        print_event = print_action("User Input", user_input)
-                        log_file.write(f"{print_event}\n")
-                        log_file.flush()
-                        correct_answer = "si" if language == "Spanish" else "yes"
-
-                        if user_input.lower() == correct_answer:
-                            # Continue without changes
-                            result = part_4_graph.invoke(None, config)
-                        else:
-                            # Process the new instruction provided by the user
-                            result = part_4_graph.invoke(
-                                {
-                                    "messages": [
-                                        ToolMessage(
-                                            tool_call_id=snapshot.values["messages"][-1].tool_calls[0]["id"],
-                                            content=f"API call denied by user. Reasoning: '{user_input}'. Continue assisting, accounting for the user's input.",
-                                        )
-                                    ]
-                                },
-                                config,
-                            )
-                        print_event = _print_event(result, _printed)
-                        log_file.write(f"{print_event}\n\n")
-                        log_file.flush()
-                        # Update the snapshot to continue checking for more steps
-                        snapshot = part_4_graph.get_state(config)
-                        # Return the response to the user
-                        for message in snapshot.values['messages']:
-                            if isinstance(message, AIMessage) and message.content:
-                                response = {"type": "text", "content": message.content}
-                                if response not in last_message:
-                                    await websocket.send_json(response)
-                                    last_message.append(response)
-                except Exception as e:
-                    error_message = f"Error: {str(e)}"
-                    await websocket.send_text(error_message)
-                    log_file.write(f"{error_message}\n\n")
+        while True:
+            # Receive the user's message through the WebSocket
+            data = await websocket.receive_text()
+            json_data = json.loads(data)
+            message = json_data.get("message")
+            currency = json_data.get("currency")
+            language = json_data.get("language")
+            token = json_data.get("token")
+            # Session values travel with the run config, never through os.environ
+            config = {"configurable": {"thread_id": thread_id, "language": language, "currency": currency, "cts_token": token}}
+            _printed.clear()
+            try:
+                started = time.perf_counter()
+                state, pending = await run_graph(
+                    {"messages": [{"role": "user", "type": "text", "content": message}]}, config
+                )
+                if state and not pending:
+                    # Turns waiting for an approval are bookings, never cached
+                    await semantic_cache.remember(state["messages"], config, (time.perf_counter() - started) * 1000)
+                while pending:
+                    # Inform the frontend about the interruption and the need for user approval
+                    content_english = "You are about do an action on your booking request. Are you sure you want to continue?"
+                    content_spanish = "Estás a punto de realizar una acción sobre tu reserva ¿Estás seguro que deseas continuar?"
+                    content = content_spanish if language == "Spanish" else content_english
+                    print_event = print_action("Approval Needed", content)
+                    log_file.write(f"{print_event}\n\n")
+                    await websocket.send_json({
+                        "type": "approval_needed",
+                        "content": content,
+                    })
+
+                    # Wait for the user's response from the frontend
+                    data = await websocket.receive_text()
+                    json_data = json.loads(data)
+                    user_input = json_data.get("message")
+                    print_event = print_action("User Input", user_input)
+                    log_file.write(f"{print_event}\n")
+                    correct_answer = "si" if language == "Spanish" else "yes"
+
+                    if user_input.lower() == correct_answer:
+                        # Continue without changes
+                        state, pending = await run_graph(None, config)
+                    else:
+                        # Process the new instruction provided by the user
+                        state, pending = await run_graph(
+                            {
+                                "messages": [
+                                    ToolMessage(
+                                        tool_call_id=pending.tool_calls[0]["id"],
+                                        content=f"API call denied by user. Reasoning: '{user_input}'. Continue assisting, accounting for the user's input.",
+                                    )
+                                ]
+                            },
+                            config,
+                        )
+            except Exception as e:
+                error_message = f"Error: {str(e)}"
+                await websocket.send_text(error_message)
+                log_file.write(f"{error_message}\n\n")
     except WebSocketDisconnect:
         print(f"WebSocket disconnected: {thread_id}")
+        drop_session(thread_id)
+        # The thread id is per socket, so nothing can resume it after a disconnect; a
+        # persistent backend keeps it by default and leaves it to idle eviction
+        if os.getenv("CHECKPOINT_DELETE_ON_DISCONNECT", str(memory.delete_on_disconnect)) == "True":
+            await memory.adelete_thread(thread_id)
     except Exception as e:
         await websocket.close()
         raise HTTPException(status_code=500, detail=str(e))
     finally:
-        try:
-            if storage_client:
-                bucket = storage_client.bucket(bucket_name)
-                blob = bucket.blob(log_filename)
-                blob.upload_from_filename(log_path)
-
-                # Delete the local file after uploading it to the bucket
-                if os.path.exists(log_path):
-                    os.remove(log_path)
-
-        except Exception as e:
-            raise HTTPException(status_code=500, detail=f"Error uploading log to Cloud Storage: {str(e)}")
+        # Compressed and uploaded to the bucket in the background
+        log_file.close()
 
 if __name__ == "__main__":
     import uvicorn
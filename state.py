@@ -14,6 +14,9 @@ def update_dialog_stack(left: list[str], right: Optional[str]) -> list[str]:
 
 class State(TypedDict):
     messages: Annotated[list[AnyMessage], add_messages]
+    # Running summary of the messages before summary_cursor (see helpers/context_window.py)
+    summary: Optional[str]
+    summary_cursor: Optional[int]
     #user_info: str
     dialog_state: Annotated[
         list[
@@ -1,16 +1,25 @@
 from typing import Optional
-import requests
+import helpers.cts_client as cts_client
 import os
 from langchain_core.tools import tool
+from langchain_core.runnables import RunnableConfig
+from helpers.session import get_session_context
 import helpers.excursion_helper as helper
+import helpers.town_directory as town_directory
+import helpers.compact_output as compact_output
+import helpers.catalog as catalog
 
 @tool
-def get_availability_for_transfer_and_excursions(
+async def get_availability_for_transfer_and_excursions(
     townId: int,
     tipos: int,
     fecha: str,
     adults: Optional[int] = 1,
     children: Optional[int] = 0,
+    fields: Optional[list[str]] = None,
+    limit: Optional[int] = None,
+    offset: Optional[int] = 0,
+    config: RunnableConfig = None,
     ) -> list[dict]:
     """
     Get availability of transport or excursions in a given town.
@@ -21,6 +30,9 @@ def get_availability_for_transfer_and_excursions(
     fecha (string): The date (format YYYY-MM-DD).
     adults: The number of adults. Default is 1.
     children: The number of children. Default is 0.
+    fields: Only return these columns. Excursions: id, name, price_from, duration, pickup, children_allowed, type, includes. Transfers: id, name, price_from, pickup, free_cancellation, type. Default is all.
+    limit: The maximum number of services to return. Default is 10.
+    offset: The number of services to skip, to see more results. Default is 0.
 
     Returns:
     A list of dictionaries containing the availability of
@@ -29,21 +41,22 @@ def get_availability_for_transfer_and_excursions(
     Example:
     get_availability_for_transport_and_excursions(townId='1234', tipos='1', fecha='2024-12-01', adults=2, children=1, currency=1)
     """
-
-    currency = 1 if os.getenv("CURRENCY") == 'CLP' else 2
-    url = f'{os.getenv("CTS_API_V2")}/availability/?townId={townId}&tipos={tipos}&fecha={fecha}&adults={adults}&children={children}&currency={currency}'
-    ctsToken = os.getenv("CTS_TOKEN")
-    headers = {'Authorization': f'token {ctsToken}'}
-    response = requests.get(url, headers=headers)
-
+    session = get_session_context(config)
+    availability = await helper.get_availability(session, townId, tipos, fecha, adults, children)
+    services, offset, total = compact_output.page(availability.services, limit, offset)
+
+    if compact_output.is_compact():
+        if tipos == 1:
+            return helper.generate_transfer_availability_table(services, fecha, adults, children, townId, session.language, fields, offset, total)
+        return helper.generate_excursion_availability_table(services, fecha, adults, children, townId, session.language, fields, offset, total)
     if tipos == 1:
-        result = helper.generate_transfer_availability_response(response.json(), fecha, adults, children, townId)
+        result = helper.generate_transfer_availability_response(services, fecha, adults, children, townId)
     if tipos == 2:
-        result = helper.generate_excursion_availability_response(response.json(), fecha, adults, children, townId)
-    return result
+        result = helper.generate_excursion_availability_response(services, fecha, adults, children, townId)
+    return compact_output.paged(result, offset, len(services), total)
 
 @tool
-def get_town_id_for_transport_and_excursions(townName: str) -> list[dict]:
+async def get_town_id_for_transport_and_excursions(townName: str, config: RunnableConfig = None) -> list[dict]:
     """
     Get the town ID.
 
@@ -56,28 +69,58 @@ def get_town_id_for_transport_and_excursions(townName: str) -> list[dict]:
     Example:
     get_town_id_for_transport_and_excursions('santiago')
     """
-    url = f'{os.getenv("CTS_API_V2")}/city/'
-    ctsToken = os.getenv("CTS_TOKEN")
-    headers = {'Authorization': f'token {ctsToken}'}
-    response = requests.get(url, headers=headers)
-
-    result = 'We could not find the town you are looking for, but here is a list of towns available. '
+    session = get_session_context(config)
+    towns = town_directory.excursion_towns
+    await towns.ensure_loaded(session)
+    town = towns.lookup(townName)
+    if town:
+        return towns.town_id(town)
+
+    result = 'We could not find the town you are looking for, but here are the closest towns available. '
     result += 'Select the town you are looking for and use the town ID to search for the availability of transport or excursions.\n\n'
     result += 'Town ID\t|\tTown Name\n'
-    for town in response.json():
-        result += f"{town['id']}\t|\t{town['name']}\n"
-        if town['name'].lower() == townName.lower():
-            return town['id']
+    for town in towns.closest(townName):
+        result += f"{towns.town_id(town)}\t|\t{towns.town_name(town)}\n"
     return result
 
 @tool
-def get_excursion_or_transfer_description(
+async def recommend_excursions_and_transfers(
+    query: str,
+    townName: Optional[str] = None,
+    tipos: Optional[int] = None,
+    limit: Optional[int] = 5,
+    config: RunnableConfig = None,
+) -> str:
+    """
+    Recommend excursions or transfers for a free-text request, without a date.
+
+    Args:
+    query: What the user is looking for (e.g. 'wine tasting', 'things to do with kids', 'airport transfer').
+    townName: The town or city, if the user gave one.
+    tipos: The type of service: 1 for transfers, 2 for excursions. Default is both.
+    limit: The maximum number of services to return. Default is 5.
+
+    Use this function for discovery questions ('what can I do near Puerto Varas?')
+    before the user has chosen a date; use 'get_availability_for_transfer_and_excursions' once they have.
+    """
+    session = get_session_context(config)
+    try:
+        if catalog.get() is None:
+            return "The catalog is not available. Ask the user for a date and use 'get_availability_for_transfer_and_excursions' instead."
+        results, inTown = await catalog.recommend(query, townName, tipos, limit or 5)
+        return helper.generate_catalog_recommendations_table(results, session.language, townName, inTown)
+    except Exception as e:
+        return f'Error: {e}'
+
+@tool
+async def get_excursion_or_transfer_description(
     serviceId: int,
     townId: int,
     tipos: int,
     date: str,
     adults: int,
     children: int,
+    config: RunnableConfig = None,
 )->list [dict]:
     """
     Get the information of the excursion or transfer.
@@ -90,29 +133,27 @@ def get_excursion_or_transfer_description(
     adults: The number of adults. Default is 1.
     children: The number of children. Default is 0.
     """
-    currency = 1 if os.getenv("CURRENCY") == 'CLP' else 2
-    url = f'{os.getenv("CTS_API_V2")}/availability/?townId={townId}&tipos={tipos}&fecha={date}&adults={adults}&children={children}&currency={currency}'
-    ctsToken = os.getenv("CTS_TOKEN")
-    headers = { 'Authorization': f'token {ctsToken}' }
-    response = requests.get(url, headers = headers).json()
-
-    for service in response:
-        if service['id'] == serviceId:
-            serviceOptions = service
-            break
+    session = get_session_context(config)
+    availability = await helper.get_availability(session, townId, tipos, date, adults, children)
+    serviceOptions = availability.by_id.get(serviceId)
+    if serviceOptions is None:
+        return f'No service with id {serviceId} is available for that date.'
     service = 'excursion' if tipos == 2 else 'transfer'
+    if compact_output.is_compact():
+        return helper.generate_excursion_or_transfer_description_compact(serviceOptions, service, session.language)
     result = helper.generate_excursion_or_transfer_description_response(serviceOptions, service)
 
     return result
 
 @tool
-def get_excursion_or_transfer_options_avilable(
+async def get_excursion_or_transfer_options_avilable(
     serviceId: int,
     townId: int,
     tipos: int,
     date: str,
     adults: int,
-    children: int = 0
+    children: int = 0,
+    config: RunnableConfig = None,
 )->list [dict]:
     """
     Get the options for excursions or transfers.
@@ -132,23 +173,20 @@ def get_excursion_or_transfer_options_avilable(
     Example:
     get_excursion_or_transfer_options(townId=1234, tipos=1, fecha='2024-12-01', adults=2, children=1, currency=1)
     """
-    currency = 1 if os.getenv("CURRENCY") == 'CLP' else 2
-    url = f'{os.getenv("CTS_API_V2")}/availability/?townId={townId}&tipos={tipos}&fecha={date}&adults={adults}&children={children}&currency={currency}'
-    ctsToken = os.getenv("CTS_TOKEN")
-    headers = { 'Authorization': f'token {ctsToken}' }
-    response = requests.get(url, headers = headers).json()
-    # extract the service object from response['id']
-    for service in response:
-        if service['id'] == serviceId:
-            serviceOptions = service
-            break
+    session = get_session_context(config)
+    availability = await helper.get_availability(session, townId, tipos, date, adults, children)
+    serviceOptions = availability.by_id.get(serviceId)
+    if serviceOptions is None:
+        return f'No service with id {serviceId} is available for that date.'
     service = 'excursion' if tipos == 2 else 'transfer'
+    if compact_output.is_compact():
+        return helper.generate_excursion_or_transfer_options_table(serviceOptions, service)
     result = helper.generate_excursion_or_transfer_options_response(serviceOptions, service)
 
     return result
 
 @tool
-def create_transport_or_excursion_booking(
+async def create_transport_or_excursion_booking(
     serviceId: int,
     serviceCode: int,
     townId: int,
@@ -166,6 +204,7 @@ def create_transport_or_excursion_booking(
     referenceNumber: Optional[str] = 'N/A',
     notes: Optional[str] = 'N/A',
     flightNumber: Optional[str] = 'N/A',
+    config: RunnableConfig = None,
     ) -> dict:
     """
     Create a transport or excursion booking.
@@ -195,9 +234,10 @@ def create_transport_or_excursion_booking(
     Example:
     create_transport_or_excursion_booking()
     """
+    session = get_session_context(config)
     try:
-        currency = 1 if os.getenv("CURRENCY") == 'CLP' else 2
-        serviceAvailability = helper.get_data_for_excursion_or_transfer_booking(serviceId=serviceId, serviceCode=serviceCode, townId=townId, tipos=tipos, travelDate=travelDate, adults=adults, children=children)
+        currency = session.currency_id
+        serviceAvailability = await helper.get_data_for_excursion_or_transfer_booking(session, serviceId=serviceId, serviceCode=serviceCode, townId=townId, tipos=tipos, travelDate=travelDate, adults=adults, children=children)
         serviceCode = serviceAvailability['service_code']
         adults = serviceAvailability['adults']
         children = serviceAvailability['children']
@@ -235,9 +275,7 @@ def create_transport_or_excursion_booking(
             ],
         }
         url = f'{os.getenv("CTS_API_V2")}/booking/'
-        ctsToken = os.getenv("CTS_TOKEN")
-        headers = {'Authorization': f'token {ctsToken}'}
-        response = requests.post(url, json=payload, headers=headers).json()
+        response = (await cts_client.request(session, 'POST', url, endpoint='booking', json=payload)).json()
         bookingId = response['booking_id']
         return f"Se ha realizado la reserva con éxito. El número de reserva es {bookingId}"
     except Exception as e:
@@ -262,7 +300,7 @@ def create_transport_or_excursion_booking(
 #     return response.json()
 
 @tool
-def cancel_transport_or_excursion_booking(bookingId: str) -> list[dict]:
+async def cancel_transport_or_excursion_booking(bookingId: str, config: RunnableConfig = None) -> list[dict]:
     """
     Cancel a transport or excursion booking.
 
@@ -275,10 +313,9 @@ def cancel_transport_or_excursion_booking(bookingId: str) -> list[dict]:
     Example:
     cancel_transport_or_excursion_booking('1234')
     """
+    session = get_session_context(config)
     url = f'{os.getenv("CTS_API_V2")}/booking/{bookingId}/'
-    ctsToken = os.getenv("CTS_TOKEN")
-    headers = {'Authorization': f'token {ctsToken}'}
-    response = requests.delete(url, headers=headers).json()
+    response = (await cts_client.request(session, 'DELETE', url, endpoint='booking')).json()
     if response['is_active'] == False:
         return f'La reserva con el número {bookingId} ha sido cancelada con éxito.'
     return 'No se ha podido cancelar la reserva.'
\ No newline at end of file
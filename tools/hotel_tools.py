@@ -1,12 +1,16 @@
 from langchain_core.tools import tool
+from langchain_core.runnables import RunnableConfig
+from helpers.session import get_session_context
 import os
-import requests
+import helpers.cts_client as cts_client
 from datetime import date, datetime, timedelta
 from typing import Optional, List, Dict
 import helpers.hotel_helper as helper
+import helpers.town_directory as town_directory
+import helpers.compact_output as compact_output
 
 @tool
-def get_availability_for_hotels(
+async def get_availability_for_hotels(
     townId: Optional[str] = None,
     checkin_date: Optional[str] = None,
     checkout_date: Optional[str] = None,
@@ -14,6 +18,15 @@ def get_availability_for_hotels(
     children: Optional[int] = 0,
     infants: Optional[int] = 0,
     ages: Optional[List[int]] = [],
+    max_price: Optional[float] = None,
+    min_stars: Optional[int] = None,
+    amenities: Optional[List[str]] = None,
+    category: Optional[str] = None,
+    sort_by: Optional[str] = None,
+    fields: Optional[List[str]] = None,
+    limit: Optional[int] = None,
+    offset: Optional[int] = 0,
+    config: RunnableConfig = None,
 ) -> List[Dict]:
     """
     Get availability of hotels in a given town.
@@ -26,6 +39,16 @@ def get_availability_for_hotels(
     children: The number of children. Default is 0.
     infants: The number of infants. Default is 0.
     ages: The ages of the children. Default is [].
+    max_price: Only hotels whose lowest price for the stay is at most this value, in the session currency.
+    min_stars: Only hotels with at least this number of stars.
+    amenities: Only hotels with all these amenities (e.g. ['pool', 'parking']).
+    category: Only hotels of this category (e.g. 'hostal', 'apart hotel').
+    sort_by: 'price' (cheapest first), 'price_desc' or 'rating' (most stars first). Default is the API order.
+    fields: Only return these columns (id, name, stars, price_from, address, category, amenities). Default is all.
+    limit: The maximum number of hotels to return. Default is 10.
+    offset: The number of hotels to skip, to see more results. Default is 0.
+
+    Use the filters to answer the user needs (budget, stars, amenities) instead of reading the whole list.
 
     Returns:
     A list of dictionaries containing the availability of
@@ -34,21 +57,98 @@ def get_availability_for_hotels(
     Example:
     get_availability(townId='1234', checkin_date='2022-12-01', checkout_date='2022-12-05', adults=2, children=1)
     """
+    session = get_session_context(config)
+    if sort_by and sort_by not in helper.SORT_OPTIONS:
+        return f"Error: sort_by must be one of {', '.join(helper.SORT_OPTIONS)}."
     try:
-        url = f'{os.getenv("CTS_API_V1")}/hotel/'
-
-        ctsToken = os.getenv("CTS_TOKEN")
-        headers = {'Authorization': f'token {ctsToken}'}
-        currency = 1 if os.getenv('CURRENCY') == 'CLP' else 2
-        json = {'townId': townId, 'checkin': checkin_date, 'checkout': checkout_date, 'rooms': [{'adults': adults, 'children': children, 'infants': infants, 'ages': ages}], 'currency': currency}
-        response = requests.post(url, json=json, headers=headers)
-        result = helper.generate_hotels_availability_response(response.json(), json)
-        return result
+        search, json = await helper.search_hotels(session, townId, checkin_date, checkout_date, adults, children, infants, ages)
+        matching = search.filter(max_price=max_price, min_stars=min_stars, amenities=amenities, category=category, sort_by=sort_by)
+        applied = {'max_price': max_price, 'min_stars': min_stars, 'amenities': amenities, 'category': category}
+        filters = ', '.join(f"{name}={', '.join(value) if isinstance(value, list) else value}" for name, value in applied.items() if value)
+        if filters:
+            if not matching:
+                return f'No hotels match the filters ({filters}); {len(search.hotels)} hotels are available without them.'
+            filters += f' ({len(matching)} of {len(search.hotels)} hotels match)'
+        hotels, offset, total = compact_output.page(matching, limit, offset)
+        if compact_output.is_compact():
+            return helper.generate_hotels_availability_table({'data': hotels}, json, fields=fields, offset=offset, total=total, filters=filters)
+        result = helper.generate_hotels_availability_response({'data': hotels}, json)
+        return compact_output.paged(result, offset, len(hotels), total)
     except Exception as e:
         return f'Error: {e}, in line {e.__traceback__.tb_lineno}'
 
 @tool
-def get_hotel_info(
+async def search_hotels_flexible_dates(
+    townId: str,
+    date_from: str,
+    date_to: str,
+    nights: int,
+    checkin_weekdays: Optional[List[str]] = None,
+    adults: Optional[int] = 1,
+    children: Optional[int] = 0,
+    infants: Optional[int] = 0,
+    ages: Optional[List[int]] = [],
+    rooms: Optional[List[Dict]] = None,
+    max_price: Optional[float] = None,
+    min_stars: Optional[int] = None,
+    limit: Optional[int] = None,
+    offset: Optional[int] = 0,
+    config: RunnableConfig = None,
+) -> str:
+    """
+    Compare hotel prices over a window of check-in dates in one call.
+
+    Args:
+    townId: The town ID.
+    date_from (string): The first possible check-in date (format YYYY-MM-DD).
+    date_to (string): The last possible check-out date (format YYYY-MM-DD).
+    nights: The number of nights of the stay.
+    checkin_weekdays: Only check in on these days (e.g. ['friday'] for weekends). Default is every day.
+    adults: The number of adults, for a single room. Default is 1.
+    children: The number of children, for a single room. Default is 0.
+    infants: The number of infants, for a single room. Default is 0.
+    ages: The ages of the children, for a single room. Default is [].
+    rooms: Several rooms, each one a dictionary with adults, children, infants and ages. Replaces the single room arguments.
+    max_price: Only hotels whose cheapest stay is at most this value.
+    min_stars: Only hotels with at least this number of stars.
+    limit: The maximum number of hotels to return. Default is 10.
+    offset: The number of hotels to skip, to see more results. Default is 0.
+
+    Use this function instead of calling 'get_availability_for_hotels' once per date
+    when the user is flexible with the dates (e.g. 'the cheapest weekend in March').
+
+    Example:
+    search_hotels_flexible_dates(townId='1234', date_from='2025-03-01', date_to='2025-03-31', nights=2, checkin_weekdays=['friday'], adults=2)
+    """
+    session = get_session_context(config)
+    try:
+        if nights < 1:
+            return 'Error: nights must be at least 1.'
+        checkins = helper.checkin_dates(date_from, date_to, nights, checkin_weekdays)
+        if not checkins:
+            return f'Error: no check-in date from {date_from} allows a stay of {nights} nights ending by {date_to}.'
+        if len(checkins) > helper.FANOUT_MAX_DATES:
+            return f'Error: the window has {len(checkins)} check-in dates; search at most {helper.FANOUT_MAX_DATES} at a time (narrow the dates or the weekdays).'
+        roomList = helper.room_list(adults, children, infants, ages, rooms)
+        window = await helper.search_date_window(session, townId, checkins, nights, roomList)
+        if len(window['failed']) == len(checkins):
+            return 'Error: the hotel search failed for every date, try again later.'
+        entries = [
+            entry for entry in window['hotels'].values()
+            if (max_price is None or min(entry['prices'].values()) <= max_price)
+            and (min_stars is None or (entry['hotel']['category']['rating'] or 0) >= min_stars)
+        ]
+        if not entries:
+            return f'No hotels are available in the town for {nights} nights between {date_from} and {date_to} with those filters.'
+        entries.sort(key=lambda entry: min(entry['prices'].values()))
+        entries, offset, total = compact_output.page(entries, limit, offset)
+        payload = {'townId': townId, 'rooms': roomList, 'currency': session.currency_id}
+        return helper.generate_hotels_date_matrix_table(entries, payload, checkins, nights, window['failed'], offset=offset, total=total)
+    except Exception as e:
+        return f'Error: {e}'
+
+@tool
+async def get_hotel_info(
     hotelId: str,
     townId: Optional[str] = None,
     checkin_date: Optional[str] = None,
@@ -57,6 +157,7 @@ def get_hotel_info(
     children: Optional[int] = 0,
     infants: Optional[int] = 0,
     ages: Optional[list[int]] = [],
+    config: RunnableConfig = None,
 ) -> list[dict]:
     """
     Get general information from a specific hotel.
@@ -80,14 +181,9 @@ def get_hotel_info(
     Example:
     get_availability(hotelId = '196', townId='1234', checkin_date='2022-12-01', checkout_date='2022-12-05', adults=2, children=1)
     """
+    session = get_session_context(config)
     try:
-        url = f'{os.getenv("CTS_API_V1")}/hotel/{hotelId}/'
-
-        ctsToken = os.getenv("CTS_TOKEN")
-        headers = {'Authorization': f'token {ctsToken}'}
-        currency = 1 if os.getenv('CURRENCY') == 'CLP' else 2
-        json = {'townId': townId, 'checkin': checkin_date, 'checkout': checkout_date, 'rooms': [{'adults': adults, 'children': children, 'infants': infants, 'ages': ages}], 'currency': currency}
-        response = requests.post(url, json=json, headers=headers).json()
+        response = await helper.get_hotel_detail(session, hotelId, townId, checkin_date, checkout_date, adults, children, infants, ages)
         hotelData = response['data']
         hotelId = hotelData['id']
         hotelName = hotelData['name']
@@ -115,7 +211,7 @@ def get_hotel_info(
         return f'Error: {e}, in line {e.__traceback__.tb_lineno}'
 
 @tool
-def get_hotel_rooms_available(
+async def get_hotel_rooms_available(
     hotelId: str,
     townId: Optional[str] = None,
     checkin_date: Optional[str] = None,
@@ -124,6 +220,7 @@ def get_hotel_rooms_available(
     children: Optional[int] = 0,
     infants: Optional[int] = 0,
     ages: Optional[list[int]] = [],
+    config: RunnableConfig = None,
 ) -> list[dict]:
     """
     Get the rooms available in a given hotel.
@@ -159,14 +256,9 @@ def get_hotel_rooms_available(
     Example:
     get_availability(hotelId = '196', townId='1234', checkin_date='2022-12-01', checkout_date='2022-12-05', adults=2, children=1)
     """
+    session = get_session_context(config)
     try:
-        url = f'{os.getenv("CTS_API_V1")}/hotel/{hotelId}/'
-
-        ctsToken = os.getenv("CTS_TOKEN")
-        headers = {'Authorization': f'token {ctsToken}'}
-        currency = 1 if os.getenv('CURRENCY') == 'CLP' else 2
-        json = {'townId': townId, 'checkin': checkin_date, 'checkout': checkout_date, 'rooms': [{'adults': adults, 'children': children, 'infants': infants, 'ages': ages}], 'currency': currency}
-        response = requests.post(url, json=json, headers=headers).json()
+        response = await helper.get_hotel_detail(session, hotelId, townId, checkin_date, checkout_date, adults, children, infants, ages)
         hotelName = response['data']['name']
         availability = response['data']['availability']
         result = f'The rooms available in {hotelName} from {checkin_date} to {checkout_date} are: \n\n'
@@ -208,7 +300,7 @@ def get_hotel_rooms_available(
         return f'Error: {e}, in line {e.__traceback__.tb_lineno}'
 
 @tool
-def get_town_id_for_hotels(townName: str) -> List[Dict]:
+async def get_town_id_for_hotels(townName: str, config: RunnableConfig = None) -> List[Dict]:
     """
     Get the town ID.
 
@@ -221,27 +313,22 @@ def get_town_id_for_hotels(townName: str) -> List[Dict]:
     Example:
     get_city_id('santiago')
     """
-
-    # Set townName to uppercase and replace written accents
-    townName = townName.upper().replace('Á', 'A').replace('É', 'E').replace('Í', 'I').replace('Ó', 'O').replace('Ú', 'U')
-    
-    url = f'https://apibooking.ctsturismo.com/api/city/dtt/?q='
-    ctsToken = os.getenv("CTS_TOKEN")
-    headers = {'Authorization': f'token {ctsToken}'}
-    response = requests.get(url, headers=headers)
-
-    result = 'We could not find the town you are looking for, but here is a list of towns available. '
+    session = get_session_context(config)
+    towns = town_directory.hotel_towns
+    await towns.ensure_loaded(session)
+    town = towns.lookup(townName)
+    if town:
+        return towns.town_id(town)
+
+    result = 'We could not find the town you are looking for, but here are the closest towns available. '
     result += 'Select the town you are looking for and use the town ID to search for hotels availability.\n\n'
     result += 'Town ID\t|\tTown Name\n'
-    for town in response.json():
-        result += f"{town['dtt_id']}\t|\t{town['display_name']}\n"
-        dttTownName = town['display_name'].upper().replace('Á', 'A').replace('É', 'E').replace('Í', 'I').replace('Ó', 'O').replace('Ú', 'U')
-        if dttTownName == townName:
-            return town['dtt_id']
+    for town in towns.closest(townName):
+        result += f"{towns.town_id(town)}\t|\t{towns.town_name(town)}\n"
     return result
 
 @tool
-def create_hotel_booking(
+async def create_hotel_booking(
     hotelId: int,
     townId: Optional[str] = None,
     checkin_date: Optional[str] = None,
@@ -259,6 +346,7 @@ def create_hotel_booking(
     country: Optional[str] = None,
     referenceNumber: Optional[str] = '',
     notes: Optional[str] = '',
+    config: RunnableConfig = None,
 ) -> dict:
     """
     Create a hotel booking.
@@ -286,9 +374,10 @@ def create_hotel_booking(
     The booking response as a string with the booking ID and
     a link to the booking detail.
     """
+    session = get_session_context(config)
     try:
-        currency = 1 if os.getenv('CURRENCY') == 'CLP' else 2
-        hotelAvailability = helper.get_data_for_booking(hotelId=hotelId, townId=townId, checkin_date=checkin_date, checkout_date=checkout_date, adults=adults, children=children, infants=infants, ages=ages)
+        currency = session.currency_id
+        hotelAvailability = await helper.get_data_for_booking(session, hotelId=hotelId, townId=townId, checkin_date=checkin_date, checkout_date=checkout_date, adults=adults, children=children, infants=infants, ages=ages)
         if not hotelAvailability:
             raise ValueError("No availabilty found for this hotel.")
         hotelData = hotelAvailability['data']
@@ -409,13 +498,13 @@ def create_hotel_booking(
                         "total_dtt": 0,
                         "rooms": rooms,
                         "id": 3,
-                        "nights": 2,
+                        "nights": helper.stay_nights(checkin_date, checkout_date),
                         "hotelName": hotelName,
                         "roomType": room_name,
                         "subTotalPrice": priceValue,
                         "taxPrice": priceValueWithTax - priceValue,
                         "totalPrice": priceValueWithTax,
-                        "serviceUrl": f"/results/hotels/{hotelId}?townId=51&checkin={checkin_date}&checkout={checkout_date}&rooms=[{{%22adults%22:{adults},%22children%22:{children},%22infants%22:{infants},%22ages%22:[]}}]#rooms",
+                        "serviceUrl": f"/results/hotels/{hotelId}?townId={townId}&checkin={checkin_date}&checkout={checkout_date}&rooms=[{{%22adults%22:{adults},%22children%22:{children},%22infants%22:{infants},%22ages%22:[]}}]#rooms",
                         "item_extras": {
                             "address": hotelData['address'],
                             "description": hotelData['policies_description'],
@@ -437,10 +526,9 @@ def create_hotel_booking(
         }
 
         url = f'{os.getenv("CTS_API_V1")}/booking/'
-        cts_token = os.getenv("CTS_TOKEN")
-        headers = {'Authorization': f'token {cts_token}', 'origin': 'localhost'}
+        headers = {'origin': 'localhost'}
 
-        response = requests.post(url, headers=headers, json=payload).json()
+        response = (await cts_client.request(session, 'POST', url, endpoint='booking', json=payload, headers=headers)).json()
 
         if response:
             if response.get("errors"):
@@ -458,11 +546,12 @@ def create_hotel_booking(
         return f"Error: {e}"
 
 @tool
-def update_hotel_booking(
+async def update_hotel_booking(
         bookingId: str, 
         additionalInformation: Optional[str] = '',
         notes: Optional[str] = '',
-        referenceNumber: Optional[str] = ''
+        referenceNumber: Optional[str] = '',
+        config: RunnableConfig = None,
         ) -> list[dict]:
     """
     Update a hotel booking.
@@ -479,14 +568,14 @@ def update_hotel_booking(
     Example:
     update_hotel_booking('1234', additionalInformation='Room with a view', flightNumber='1234', notes='Late check-in', referenceNumber='1234')
     """
+    session = get_session_context(config)
     try:
-        bookingDetails = helper.get_booking_details(bookingId)
-        if bookingId not in bookingDetails['file_number']:
+        bookingDetails = await helper.get_booking_details(session, bookingId)
+        if not bookingDetails:
             return "No se ha encontrado la reserva."
         bookingSlug = bookingDetails['slug']
         bookingUpdate = {}
-        ctsToken = os.getenv("CTS_TOKEN")
-        headers = {'Authorization': f'token {ctsToken}', 'origin': 'localhost'}
+        headers = {'origin': 'localhost'}
         if additionalInformation != "":
             url = f'{os.getenv("CTS_API_V1")}/booking/item/{bookingDetails["items"][0]["id"]}/'
             bookingUpdate['additional_information'] = additionalInformation
@@ -496,7 +585,7 @@ def update_hotel_booking(
             bookingUpdate['notes'] = notes
             bookingUpdate['reference_number'] = referenceNumber
 
-        response = requests.put(url, json=bookingUpdate, headers=headers).json()
+        response = (await cts_client.request(session, 'PUT', url, endpoint='booking', json=bookingUpdate, headers=headers)).json()
         if response['file_number']:
             return f'La reserva con el número {bookingId} ha sido actualizada con éxito. Puede ver los detalles de la reserva en el siguiente enlace: {os.getenv("FRONT_HOST")}/bookings/{bookingSlug}'
         else:
@@ -505,7 +594,7 @@ def update_hotel_booking(
         return f'Error: {e}'
 
 @tool
-def cancel_hotel_booking(bookingId: str) -> List[Dict]:
+async def cancel_hotel_booking(bookingId: str, config: RunnableConfig = None) -> List[Dict]:
     """
     Cancel a hotel booking.
 
@@ -518,12 +607,11 @@ def cancel_hotel_booking(bookingId: str) -> List[Dict]:
     Example:
     cancel_hotel_booking('1234')
     """
+    session = get_session_context(config)
     try:
         url = f'{os.getenv("CTS_API_V1")}/booking/cancel/'
-        ctsToken = os.getenv("CTS_TOKEN")
-        headers = {'Authorization': f'token {ctsToken}'}
         json = {'file_number': bookingId}
-        response = requests.post(url, json=json, headers=headers).json()
+        response = (await cts_client.request(session, 'POST', url, endpoint='booking', json=json)).json()
         if response:
             slug = response['slug']
             return f'La reserva con el número {bookingId} ha sido cancelada con éxito. Puede consultar el estado de la reserva en el siguiente enlace: {os.getenv("FRONT_HOST")}/bookings/{slug}'
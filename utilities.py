@@ -1,8 +1,17 @@
-from langchain_core.messages import ToolMessage
-from langchain_core.runnables import RunnableLambda
+import asyncio
+import os
+from langchain_core.messages import AIMessageChunk, ToolMessage
+from langchain_core.runnables import RunnableConfig, RunnableLambda
 from langgraph.prebuilt import ToolNode
-from typing import Callable
+from typing import Callable, Optional
 from state import State
+import helpers.prefetch as prefetch
+import helpers.llm_governor as llm_governor
+
+# Tool calls of one conversation that may run at the same time, across all tool nodes
+MAX_TOOL_CONCURRENCY_PER_SESSION = int(os.getenv("TOOL_MAX_CONCURRENCY_PER_SESSION", 4))
+# By thread id; an entry lives until the conversation is closed or evicted (drop_session)
+_session_semaphores: dict = {}
 
 
 def handle_tool_error(state) -> dict:
@@ -19,8 +28,51 @@ def handle_tool_error(state) -> dict:
     }
 
 
-def create_tool_node_with_fallback(tools: list) -> dict:
-    return ToolNode(tools).with_fallbacks(
+def _session_semaphore(config: RunnableConfig) -> asyncio.Semaphore:
+    thread_id = (config or {}).get("configurable", {}).get("thread_id")
+    semaphore = _session_semaphores.get(thread_id)
+    if semaphore is None:
+        semaphore = asyncio.Semaphore(MAX_TOOL_CONCURRENCY_PER_SESSION)
+        _session_semaphores[thread_id] = semaphore
+    return semaphore
+
+
+def drop_session(thread_id: str):
+    """Forget the tool concurrency limit of a conversation that is closed or evicted."""
+    _session_semaphores.pop(thread_id, None)
+
+
+class ConcurrentToolNode(ToolNode):
+    """
+    ToolNode that runs the tool calls of one message concurrently, bounded
+    per conversation (TOOL_MAX_CONCURRENCY_PER_SESSION) and per node
+    (max_concurrency; 1 runs the calls one after another, in order).
+    """
+
+    def __init__(self, tools: list, max_concurrency: Optional[int] = None, **kwargs):
+        super().__init__(tools, **kwargs)
+        self.max_concurrency = max_concurrency
+
+    async def _afunc(self, input, config: RunnableConfig, *, store):
+        tool_calls, output_type = self._parse_input(input, store)
+        session = _session_semaphore(config)
+        node = asyncio.Semaphore(self.max_concurrency or len(tool_calls) or 1)
+
+        async def run(call):
+            async with node, session:
+                return await self._arun_one(call, config)
+
+        if self.max_concurrency == 1:
+            outputs = [await run(call) for call in tool_calls]
+        else:
+            outputs = await asyncio.gather(*(run(call) for call in tool_calls))
+        # Warm the cache for the calls likely to follow while the model reads these results
+        prefetch.schedule(config, tool_calls)
+        return outputs if output_type == "list" else {"messages": outputs}
+
+
+def create_tool_node_with_fallback(tools: list, max_concurrency: Optional[int] = None) -> dict:
+    return ConcurrentToolNode(tools, max_concurrency=max_concurrency).with_fallbacks(
         [RunnableLambda(handle_tool_error)], exception_key="error"
     )
 
@@ -41,6 +93,72 @@ def _print_event(event: dict, _printed: set, max_length=1500):
             _printed.add(message.id)
             return msg_repr
 
+class MessageCursor:
+    """
+    Id of the last message of a conversation that was already looked at, so
+    each streamed state only walks the messages added since, however long the
+    conversation is.
+    """
+
+    def __init__(self):
+        self.last_id = None
+
+    def advance(self, messages: list) -> list:
+        """The messages after the cursor, in order; the cursor moves to the last message."""
+        new = []
+        for message in reversed(messages):
+            if message.id == self.last_id:
+                break
+            new.append(message)
+        if messages:
+            self.last_id = messages[-1].id
+        return new[::-1]
+
+class DeltaFilter:
+    """
+    Which streamed model chunks are sent to the client. A model call that
+    started a tool call streams nothing more, since the escalation model may
+    still replace it; a request of helpers/llm_governor.py streams once it won
+    its hedge race, and the chunks of lost, failed or retried requests are dropped.
+    """
+
+    def __init__(self):
+        self.tool_runs = set()
+        # Chunks of the requests still racing, by (request id, model call id)
+        self.held = {}
+        # Model calls already streamed, by request id, in case the request fails after all
+        self.sent = {}
+
+    def push(self, chunk: AIMessageChunk, request: Optional[str]) -> list[AIMessageChunk]:
+        """The chunks to send now, in order, this one included when its request already won."""
+        if chunk.tool_call_chunks:
+            self.tool_runs.add(chunk.id)
+        if chunk.content and chunk.id not in self.tool_runs:
+            self.held.setdefault((request, chunk.id), []).append(chunk)
+        return self.flush()
+
+    def flush(self) -> list[AIMessageChunk]:
+        """The held chunks of the requests that won since; those of lost requests are dropped."""
+        ready = []
+        for request, run in list(self.held):
+            won = llm_governor.outcome(request)
+            if won is None:
+                continue
+            chunks = self.held.pop((request, run))
+            if won and run not in self.tool_runs:
+                ready += chunks
+                if request is not None:
+                    self.sent.setdefault(request, set()).add(run)
+        return ready
+
+    def retracted(self) -> list[str]:
+        """Ids of the model calls whose streamed text is void: their request failed after it had won, and is retried."""
+        runs = []
+        for request in list(self.sent):
+            if llm_governor.outcome(request) is False:
+                runs += self.sent.pop(request)
+        return runs
+
 def print_action(action: str, content: str):
     msg_repr = (f"\n================================== {action} ==================================\n")
     msg_repr += f"{content}\n"
@@ -49,7 +167,8 @@ def print_action(action: str, content: str):
 
 def create_entry_node(assistant_name: str, new_dialog_state: str) -> Callable:
     def entry_node(state: State) -> dict:
-        tool_call_id = state["messages"][-1].tool_calls[0]["id"]
+        tool_calls = state["messages"][-1].tool_calls
+        tool_call_id = tool_calls[0]["id"]
         return {
             "messages": [
                 ToolMessage(
@@ -60,6 +179,13 @@ def create_entry_node(assistant_name: str, new_dialog_state: str) -> Callable:
                     " Do not mention who you are - just act as the proxy for the assistant.",
                     tool_call_id=tool_call_id,
                 )
+            ] + [
+                # Every tool call needs an answer; only the first one is followed
+                ToolMessage(
+                    content=f"Not run: the dialog was handed to the {assistant_name} first. Ask again once it is done.",
+                    tool_call_id=tc["id"],
+                )
+                for tc in tool_calls[1:]
             ],
             "dialog_state": new_dialog_state,
         }